@@ -1,4 +1,5 @@
 import os
+import posixpath
 import re
 from canedge_browser import RelativeFileSystem
 
@@ -40,6 +41,30 @@ class CanedgeFileSystem(RelativeFileSystem):
             for split, log_file in self.get_device_splits(device, session, reverse=reverse):
                 yield log_file, session, split
 
+    def get_file_infos(self, paths) -> dict:
+        """Get info (size, ETag/mtime) of files, using one listing per folder instead of one request per file"""
+        infos = {}
+        for folder in sorted(set(posixpath.dirname(x) for x in paths)):
+            folder_infos = {posixpath.basename(x["name"]): x for x in self.ls(folder, detail=True)}
+            for path in paths:
+                if posixpath.dirname(path) == folder and posixpath.basename(path) in folder_infos:
+                    infos[path] = folder_infos[posixpath.basename(path)]
+
+        # Fall back to info for files not found in listings
+        for path in paths:
+            if path not in infos:
+                infos[path] = self.info(path)
+
+        return infos
+
+    @staticmethod
+    def get_file_version(info: dict) -> str:
+        """Get a string identifying the version of a file from its info (ETag on S3, else size and mtime)"""
+        etag = info.get("ETag", info.get("etag"))
+        if etag is not None:
+            return str(etag).strip('"')
+        return f"{info.get('size')}-{info.get('mtime')}"
+
     def path_to_pars(self, path):
         """Matches as much as possible of path to CANedge pars (device id, session, split, extension)"""
         pattern = r"^(?P<device_id>[0-9A-F]{8})?((/)(?P<session_no>\d{8}))?((/)(?P<split_no>\d{8})(?:-[0-9A-F]{8}){0,1}(?P<ext>\.(MF4|MFC|MFM|MFE)))?$"
@@ -1,7 +1,12 @@
-from flask import Flask, request, abort
+import importlib
+import os
+import threading
+from flask import Flask, request, abort, g
 from flask_caching import Cache
 from fsspec import AbstractFileSystem
 from waitress import serve
+from canedge_datasource.cancel import CancelToken, panel_key
+from canedge_datasource.warmup import WARMUP_HEADER
 
 import logging
 logger = logging.getLogger(__name__)
@@ -9,31 +14,93 @@ logger = logging.getLogger(__name__)
 # Flask app
 app = Flask(__name__, instance_relative_config=True)
 
-# Flask app cache
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache', 'CACHE_THRESHOLD': 25})
+# Flask app cache (SimpleCache, counting hits, misses and evictions for the metrics)
+cache = Cache(config={'CACHE_TYPE': 'canedge_datasource.metrics.InstrumentedSimpleCache', 'CACHE_THRESHOLD': 25})
 
+# Max time a query superseding a running query from the same panel waits for it to be cancelled
+SUPERSEDED_WAIT_S = 10
 
-def start_server(fs: AbstractFileSystem, dbs: [dict], passwords: [dict], port: int, limit_mb: int, tp_type: str):
+
+def start_server(fs: AbstractFileSystem, dbs: [dict], passwords: [dict], port: int, limit_mb: int, tp_type: str,
+                 batch_ms: int, deadline_s: float, coverage: bool, *, cache_dir: str = None,
+                 catalog_refresh_s: float = 300, chunk_rows: int = 500000, max_query_mb: float = 0,
+                 slow_query_s: float = 0, slow_query_log: str = None, profile_dir: str = None,
+                 max_process_mb: float = 0, reload_s: float = 60, predecode: [str] = None,
+                 predecode_interval_s: float = 60, predecode_workers: int = 1, predecode_mb: float = 256,
+                 warmup: [str] = None, warmup_devices: [str] = None, fleet_workers: int = 4,
+                 threads: int = 16, device_labels: bool = False):
     """
-    Start server.
+    Start server. The options following coverage are passed by keyword.
     :param fs: FS mounted in CANedge "root"
-    :param dbs: List of databases
+    :param dbs: Databases by name (dict, or DatabaseStore loading these lazily)
     :param passwords: List of log file passwords
     :param port: Port of the datasource server
     :param limit_mb: Limit amount of data to process
     :param tp_type: Type of ISO TP (multiframe) data to handle (uds, j1939, nmea)
+    :param batch_ms: Window in ms for merging concurrent panel queries
+    :param deadline_s: Default wall-clock time budget of a query in seconds (0 for none)
+    :param coverage: Spread the data limit evenly over the time range by default
+    :param cache_dir: Optional local directory for caches persisted across restarts
+    :param catalog_refresh_s: Interval between background refreshes of the device catalog in seconds
+    :param chunk_rows: Max number of frames decoded at a time when processing a log file (0 for whole files)
+    :param max_query_mb: Memory ceiling of a query in MB (0 for none)
+    :param slow_query_s: Requests taking longer are written to the slow query log (0 to disable)
+    :param slow_query_log: Path of the slow query log (JSON lines), logged as warnings if None
+    :param profile_dir: Optional directory for cProfile dumps of requests with a debug field
+    :param max_process_mb: Memory ceiling of the process in MB, queries are degraded or rejected near it (0 for none)
+    :param reload_s: Interval between polls of the root for changed DBs and passwords file in seconds (0 to disable)
+    :param predecode: DBs, optionally with signals (e.g. "canmod-gps:Speed,Latitude"), decoded in the background for new
+                      log files
+    :param predecode_interval_s: Interval between polls for new log files to pre-decode in seconds
+    :param predecode_workers: Max number of log files pre-decoded in parallel
+    :param predecode_mb: Max size of the pre-decoded signals in MB
+    :param warmup: Dashboards (Grafana JSON files) replayed in the background at startup to warm up the caches
+    :param warmup_devices: Devices the dashboards are replayed for, all devices if None
+    :param fleet_workers: Max number of devices processed in parallel by a fleet query
+    :param threads: Number of threads serving requests
+    :param device_labels: Label the stage, fetch and skipped file metrics by device (one series per device)
     """
 
     # TODO: Not sure if this is the preferred way to share objects with the blueprints
-    # Init processing flag
-    app.processing = False
-
     # Add the shared fs and dbs to the app context
     app.fs = fs
     app.dbs = dbs
     app.passwords = passwords
     app.limit_mb = limit_mb
     app.tp_type = tp_type
+    app.deadline_s = deadline_s
+    app.coverage = coverage
+    app.chunk_rows = chunk_rows
+    app.max_query_mb = max_query_mb
+    app.fleet_workers = fleet_workers
+
+    # Process memory ceiling, shared by all queries
+    from canedge_datasource.memory import MemoryGuard
+    app.memory_guard = MemoryGuard(max_process_mb)
+
+    # Log file header information (start time, meta data), read from the start of files only
+    from canedge_datasource.metadata import MetadataStore
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    app.metadata = MetadataStore(fs, path=os.path.join(cache_dir, "metadata.jsonl") if cache_dir else None)
+
+    # CAN IDs seen per device, used to limit signal searches to signals logged by a device
+    from canedge_datasource.presence import PresenceIndex
+    app.presence = PresenceIndex()
+
+    # Devices with their most recent log file comment, refreshed in the background for the device_name search
+    from canedge_datasource.catalog import DeviceCatalog
+    app.catalog = DeviceCatalog(fs, app.metadata, passwords, refresh_s=catalog_refresh_s)
+    app.catalog.start()
+
+    # Load the DBs in the background, such that the port is opened without waiting for these to be parsed
+    from canedge_datasource.databases import DatabaseStore
+    if isinstance(dbs, DatabaseStore):
+        dbs.start()
+
+    # Metrics per device, disabled by default as the number of series grows with the fleet
+    from canedge_datasource.metrics import enable_device_labels
+    enable_device_labels(device_labels)
 
     # Create cache for faster access on repeated calls
     cache.init_app(app)
@@ -41,21 +108,105 @@ def start_server(fs: AbstractFileSystem, dbs: [dict], passwords: [dict], port: i
     # Set simplecache logging level to WARNING to avoid heavy DEBUG level logging
     logging.getLogger('flask_caching.backends.simplecache').setLevel(logging.WARNING)
 
-    # Register blueprints
+    # Register blueprints. The views processing log files (importing pandas and the decoders) are imported on first use
+    # or in the background, such that the port is opened without waiting for these imports
     from canedge_datasource.alive import alive
     app.register_blueprint(alive)
 
-    from canedge_datasource.query import query
-    app.register_blueprint(query)
+    app.add_url_rule('/query', view_func=LazyFunction('canedge_datasource.query.query_view'), methods=['POST'])
+    app.add_url_rule('/annotations', view_func=LazyFunction('canedge_datasource.annotations.annotations_view'),
+                     methods=['POST'])
+    app.add_url_rule('/search', view_func=LazyFunction('canedge_datasource.search.search_view'), methods=['POST'])
+
+    from canedge_datasource.metrics import metrics
+    app.register_blueprint(metrics)
+
+    # Query planner, merging concurrent panel queries and limiting the load on the /query endpoint
+    from canedge_datasource.planner import QueryPlanner
+    app.planner = QueryPlanner(process=LazyFunction('canedge_datasource.query.process_signal_queries'),
+                               window_ms=batch_ms)
 
-    from canedge_datasource.annotations import annotations
-    app.register_blueprint(annotations)
+    from canedge_datasource.metrics import QUERY_GATE_USERS
+    QUERY_GATE_USERS.function = lambda: app.planner.users
 
-    from canedge_datasource.search import search
-    app.register_blueprint(search)
+    # Decode newly uploaded log files in the background, such that the first queries of a new period hit warm data
+    app.decoded_cache = None
+    app.predecoder = None
+    if predecode:
+        from canedge_datasource.decoded import DecodedCache
+        app.decoded_cache = DecodedCache(max_mb=predecode_mb)
 
-    # Use waitress to serve application
-    serve(app, host='0.0.0.0', port=port, ident="canedge-grafana-backend")
+    def load():
+        for name in ["query", "annotations", "search"]:
+            importlib.import_module(f"canedge_datasource.{name}")
+
+        if predecode:
+            from canedge_datasource.predecoder import PreDecoder, parse_targets
+            app.predecoder = PreDecoder(fs, dbs, parse_targets(predecode), app.passwords, app.metadata, app.presence,
+                                        app.decoded_cache, interval_s=predecode_interval_s,
+                                        max_workers=predecode_workers, busy=lambda: app.planner.users > 0,
+                                        limit_mb=limit_mb, memory_guard=app.memory_guard)
+            app.predecoder.start()
+
+    threading.Thread(target=load, name="loader", daemon=True).start()
+
+    # Apply changed DBs and passwords without restarting
+    if reload_s > 0:
+        from canedge_datasource.watcher import RootWatcher
+        app.watcher = RootWatcher(fs, dbs, on_passwords=_set_passwords, interval_s=reload_s)
+        app.watcher.start()
+
+    # Register of running queries per panel, such that superseded queries can be cancelled
+    from canedge_datasource.cancel import CancelRegistry
+    app.cancel_registry = CancelRegistry()
+
+    # Cancel tokens of the running warm-up queries, which are preempted by user queries
+    app.warmup_tokens = set()
+
+    # Opt-in request tracing (slow queries and requests with a debug field)
+    from canedge_datasource.profiling import Profiler
+    app.profiler = Profiler(threshold_s=slow_query_s, log_path=slow_query_log, profile_dir=profile_dir)
+
+    # Replay dashboards in the background, filling the caches and indexes before users arrive
+    app.warmup = None
+    if warmup:
+        from canedge_datasource.dashboard import Dashboard
+        from canedge_datasource.warmup import Warmup
+        app.warmup = Warmup(_post, [Dashboard.load(x) for x in warmup], devices=warmup_devices or None,
+                            busy=lambda: app.planner.users > len(app.warmup_tokens))
+        app.warmup.start()
+
+    # Use waitress to serve application. Use enough threads for the panels of a dashboard to be merged by the planner.
+    # Request lookahead enables detection of clients disconnecting while a query is processed
+    serve(app, host='0.0.0.0', port=port, ident="canedge-grafana-backend", threads=threads, channel_request_lookahead=5)
+
+
+class LazyFunction:
+    """
+    Function (e.g. a view) imported on first call, given by its import name (e.g. "canedge_datasource.query.query_view")
+    """
+
+    def __init__(self, import_name: str):
+        self.__module__, self.__name__ = import_name.rsplit(".", 1)
+        self._function = None
+
+    def __call__(self, *args, **kwargs):
+        if self._function is None:
+            self._function = getattr(importlib.import_module(self.__module__), self.__name__)
+        return self._function(*args, **kwargs)
+
+
+def _set_passwords(passwords: dict):
+    app.passwords = passwords
+    app.catalog.passwords = passwords
+    if app.predecoder is not None:
+        app.predecoder.passwords = passwords
+
+
+def _post(endpoint: str, body: dict) -> (int, object):
+    """Sends a warm-up request to the app in-process"""
+    response = app.test_client().post(endpoint, json=body, headers={WARMUP_HEADER: "1"})
+    return response.status_code, response.get_json(silent=True)
 
 
 @app.before_request
@@ -63,13 +214,36 @@ def before_request():
 
     logger.debug(f"Request: {request.method} {request.path}, {request.data}")
 
-    # Limit load on /query endpoint
+    # Trace the request if profiled
+    trace = app.profiler.start(request.path, request.get_json(silent=True))
+    if trace is not None:
+        g.trace = trace
+
     if request.path == "/query":
-        if app.processing is True:
+
+        # Register the query, cancelling a running query from the same panel (e.g. when zooming twice quickly)
+        g.cancel_token = CancelToken(request.environ.get("waitress.client_disconnected"))
+        g.panel_key = panel_key(request.get_json(silent=True))
+        superseded = app.cancel_registry.register(g.panel_key, g.cancel_token)
+
+        # User queries take precedence over the warm-up. Running warm-up queries are cancelled
+        warmup = WARMUP_HEADER in request.headers
+        preempted = False
+        if not warmup:
+            for token in list(app.warmup_tokens):
+                token.cancel()
+                preempted = True
+
+        # Limit load on /query endpoint. Queries arriving within the batching window of the planner are admitted. A
+        # superseded (or preempted) query stops within one file's processing time, in which case the new query waits
+        # for it
+        if not app.planner.try_acquire(timeout=SUPERSEDED_WAIT_S if superseded or preempted else 0):
             logger.info("Server busy, skipping query")
             abort(501)
-        else:
-            app.processing = True
+        g.query_admitted = True
+
+        if warmup:
+            app.warmup_tokens.add(g.cancel_token)
 
 
 @app.after_request
@@ -78,7 +252,14 @@ def after_request(response):
     logger.debug(f"Response: {response.status}")
 
     # Release query load limit
-    if request.path == "/query":
-        app.processing = False
+    if g.pop("query_admitted", False):
+        app.planner.release()
+
+    if "cancel_token" in g:
+        app.cancel_registry.unregister(g.panel_key, g.cancel_token)
+        app.warmup_tokens.discard(g.cancel_token)
+
+    if "trace" in g:
+        app.profiler.finish(g.pop("trace"), response.status_code)
 
     return response
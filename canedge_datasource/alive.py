@@ -1,4 +1,5 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify
+from flask import current_app as app
 
 alive = Blueprint('alive', __name__)
 
@@ -7,4 +8,20 @@ def alive_view():
     """
     Lets the frontend know that the backend is working
     """
-    return "OK"
\ No newline at end of file
+    return "OK"
+
+@alive.route('/ready',methods=['GET'])
+def ready_view():
+    """
+    Readiness of the backend, 503 while DBs are still loading. DBs not loaded yet are loaded on first use, such that the
+    backend serves requests before it is ready. Includes the progress of the warm-up, if any
+    """
+    status = app.dbs.status() if hasattr(app.dbs, "status") else {x: "loaded" for x in app.dbs.keys()}
+    ready = all(x != "pending" for x in status.values())
+    res = {"ready": ready, "dbs": status}
+
+    # Progress of the warm-up (dashboard loads), which does not affect readiness
+    if getattr(app, "warmup", None) is not None:
+        res["warmup"] = {"done": app.warmup.done, "total": app.warmup.total}
+
+    return jsonify(res), 200 if ready else 503
@@ -1,9 +1,10 @@
 import json
 import canedge_browser
-import mdf_iter
 from flask import Blueprint, jsonify, request
 from flask import current_app as app
 from canedge_datasource import cache
+from canedge_datasource.metrics import cache_namespace, timer
+from canedge_datasource.profiling import bypass_cache
 from canedge_datasource.time_range import parse_time_range
 
 import logging
@@ -22,8 +23,8 @@ def annotations_view():
         {"annotation":"split", "device":"AABBCCDD"}
     """
 
-    # Caching
-    @cache.memoize(timeout=50)
+    # Caching (debug requests are always processed)
+    @cache.memoize(timeout=50, unless=bypass_cache)
     def annotations_cache(req):
 
         res = []
@@ -52,9 +53,11 @@ def annotations_view():
 
         # Get log files in time interval
 
-        log_files = canedge_browser.get_log_files(app.fs, annotation_req["device"], start_date=start_date,
-                                                  stop_date=stop_date, passwords=app.passwords)
+        with timer("listing", annotation_req["device"]):
+            log_files = canedge_browser.get_log_files(app.fs, annotation_req["device"], start_date=start_date,
+                                                      stop_date=stop_date, passwords=app.passwords)
 
+        annotated_files = []
         for log_file in log_files:
 
             # Parse log file path
@@ -68,23 +71,30 @@ def annotations_view():
                     (annotation_req["annotation"] == "session" and int(split_no, 10) == 1)):
                 continue
 
-            # Get file start time
-            with app.fs.open(log_file, "rb") as handle:
-                mdf_file = mdf_iter.MdfFile(handle, passwords=app.passwords)
-                log_file_start_timestamp_ns = mdf_file.get_first_measurement()
+            annotated_files.append((log_file, session_no, split_no))
+
+        # Get file start times and sizes from the log file headers (read in parallel and cached)
+        meta_data = app.metadata.get_many([x[0] for x in annotated_files], app.passwords)
+
+        for (log_file, session_no, split_no), log_file_meta_data in zip(annotated_files, meta_data):
+
+            if log_file_meta_data is None:
+                continue
 
             res.append({
                 "text": f"{log_file}\n"
                         f"Session: {int(session_no, 10)}\n"
                         f"Split: {int(split_no, 10)}\n"
-                        f"Size: {app.fs.size(log_file) >> 20} MB",
-                "time": log_file_start_timestamp_ns / 1000000,
+                        f"Size: {log_file_meta_data.size >> 20} MB",
+                "time": log_file_meta_data.start_epoch_ns / 1000000,
             })
 
-        return jsonify(res)
+        with timer("serialize", annotation_req["device"]):
+            return jsonify(res)
 
     try:
-        res = annotations_cache(request.get_json())
+        with cache_namespace("annotations"):
+            res = annotations_cache(request.get_json())
     except Exception as e:
         logger.warning(f"Failed to annotate: {e}")
         res = jsonify([])
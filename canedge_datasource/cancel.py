@@ -0,0 +1,102 @@
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class QueryCancelled(Exception):
+    """
+    Raised when processing of an abandoned query is stopped.
+    """
+    pass
+
+
+class CancelToken:
+    """
+    Cooperative cancellation of a query. Long running work checks the token between files and decode groups.
+
+    A token is cancelled explicitly (e.g. when superseded by a newer query from the same panel) or when the client
+    has disconnected.
+    """
+
+    def __init__(self, client_disconnected=None):
+        """
+        :param client_disconnected: Optional callable returning True if the client has disconnected
+        """
+        self._event = threading.Event()
+        self._client_disconnected = client_disconnected
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self._client_disconnected is not None and self._client_disconnected():
+            logger.info("Client disconnected, cancelling query")
+            self._event.set()
+        return self._event.is_set()
+
+    def check(self):
+        """Raises QueryCancelled if cancelled"""
+        if self.cancelled:
+            raise QueryCancelled()
+
+
+class CancelGroup(CancelToken):
+    """
+    Token for work shared by several queries (e.g. a merged batch). Cancelled when all queries are cancelled.
+    """
+
+    def __init__(self, tokens: [CancelToken]):
+        super().__init__()
+        self._tokens = tokens
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (len(self._tokens) > 0 and all(x.cancelled for x in self._tokens))
+
+
+class CancelRegistry:
+    """
+    Keeps track of the running query of each panel, such that a newer query from the same panel supersedes it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def register(self, key, token: CancelToken) -> bool:
+        """
+        Registers the token of a new query. Returns True if a running query from the same panel was cancelled.
+        """
+        if key is None:
+            return False
+
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+
+        if previous is not None and not previous.cancelled:
+            logger.info(f"Query superseded by newer query from panel {key}, cancelling")
+            previous.cancel()
+            return True
+
+        return False
+
+    def unregister(self, key, token: CancelToken):
+        if key is None:
+            return
+
+        with self._lock:
+            if self._tokens.get(key) is token:
+                del self._tokens[key]
+
+
+def panel_key(req: dict):
+    """
+    Returns a key identifying the panel of a query request, or None if not identifiable.
+    """
+    if not isinstance(req, dict) or req.get("panelId") is None:
+        return None
+
+    return req.get("dashboardUID", req.get("dashboardId")), req["panelId"]
@@ -0,0 +1,126 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeviceEntry:
+    """
+    Catalog entry of a device.
+    """
+    device: str
+    log_file: str = None
+    comment: str = ""
+
+
+class DeviceCatalog:
+    """
+    In-memory catalog of devices with their most recent log file and its comment (as used in the device_name search).
+
+    Finding the most recent log file and reading its header is slow for large fleets. The catalog is refreshed in the
+    background with a bounded number of parallel listings and header reads, such that searches are served from memory.
+    Header reads go through the meta data store, such that unchanged log files are not read again.
+    """
+
+    def __init__(self, fs, metadata, passwords: dict, refresh_s: float = 300, max_workers: int = 8):
+        """
+        :param fs: FS mounted in CANedge "root"
+        :param metadata: MetadataStore used to read log file headers
+        :param passwords: Log file passwords
+        :param refresh_s: Interval between background refreshes in seconds
+        :param max_workers: Max number of devices listed in parallel
+        """
+        self.passwords = passwords
+        self._fs = fs
+        self._metadata = metadata
+        self._refresh_s = refresh_s
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._entries = {}
+        self._updated = None
+
+    @property
+    def updated(self) -> float:
+        """Epoch time of the last completed refresh, None if never refreshed"""
+        return self._updated
+
+    @property
+    def age(self) -> float:
+        """Seconds since the last completed refresh, None if never refreshed"""
+        return None if self._updated is None else time.time() - self._updated
+
+    def entries(self) -> [DeviceEntry]:
+        """Catalog entries ordered by device"""
+        with self._lock:
+            return [self._entries[x] for x in sorted(self._entries.keys())]
+
+    def start(self):
+        """Start refreshing the catalog in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="device-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Device catalog refresh failed: {e}")
+            self._stop.wait(self._refresh_s)
+
+    def refresh(self):
+        """
+        Refresh the catalog. Devices which fail to refresh keep their previous entry.
+        """
+
+        # Only one refresh at a time
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        try:
+            started = time.time()
+            devices = list(self._fs.get_device_ids())
+
+            # Find the most recent log file of each device and read its comment
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                refreshed = list(executor.map(self._get_entry, devices))
+
+            entries = {}
+            for device, entry in zip(devices, refreshed):
+                if entry is None:
+                    entry = self._entries.get(device, DeviceEntry(device=device))
+                entries[device] = entry
+
+            with self._lock:
+                self._entries = entries
+                self._updated = time.time()
+
+            logger.info(f"Device catalog refreshed ({len(entries)} devices) in {time.time() - started:.1f} s")
+        finally:
+            self._refreshing.release()
+
+    def _get_entry(self, device: str):
+        """Returns the catalog entry of a device, None on failure"""
+        try:
+            log_file, _, _ = next(self._fs.get_device_log_files(device=device, reverse=True), (None, None, None))
+        except Exception:
+            logger.warning(f"Unable to list log files for {device} - review folder structure and log file names")
+            return None
+
+        comment = ""
+        if log_file is not None:
+            meta_data = self._metadata.get(log_file, self.passwords)
+            if meta_data is not None:
+                comment = (meta_data.get("HDcomment.File Information.comment") or "").strip()
+
+        return DeviceEntry(device=device, log_file=log_file, comment=comment)
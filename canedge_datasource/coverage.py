@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def select_files(sizes_mb: [float], budget_mb: float, max_files: int = None) -> [int]:
+    """
+    Selects evenly spaced files across a time range, such that the total size is within the budget.
+
+    Used for long time ranges, where processing files in order until the budget is used would only cover the beginning
+    of the range. There is no need to select more files than there are data points (pixels) to show.
+
+    :param sizes_mb: Size of each file (ordered by time)
+    :param budget_mb: Amount of data allowed to process
+    :param max_files: Optional max number of files (e.g. max data points of the panel)
+    :return: Sorted list of indices of the selected files
+    """
+    count = len(sizes_mb)
+    if count == 0:
+        return []
+
+    sizes_mb = np.asarray(sizes_mb, dtype=np.float64)
+    k_max = count if max_files is None else max(min(count, max_files), 1)
+
+    # All files fit
+    if k_max == count and sizes_mb.sum() <= budget_mb:
+        return list(range(count))
+
+    def spread(k):
+        return np.unique(np.round(np.linspace(0, count - 1, k)).astype(np.int64))
+
+    # Start from the number of files expected to fit on average, then adjust to the actual sizes
+    k = int(np.clip(count * budget_mb / max(sizes_mb.sum(), 1e-9), 1, k_max))
+    while k < k_max and sizes_mb[spread(k + 1)].sum() <= budget_mb:
+        k += 1
+    while k > 1 and sizes_mb[spread(k)].sum() > budget_mb:
+        k -= 1
+
+    selected = spread(k)
+    if sizes_mb[selected].sum() > budget_mb:
+        return []
+
+    return selected.tolist()
+
+
+def get_file_sizes(fs, log_files: [str]) -> dict:
+    """
+    Gets the size of each log file in bytes, using one listing per session folder instead of one request per file.
+    """
+    return {path: info["size"] for path, info in fs.get_file_infos(log_files).items()}
@@ -0,0 +1,163 @@
+import json
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+# Grafana template variable references: $NAME, ${NAME} and ${NAME:format}
+_VARIABLE = re.compile(r"\$\{(\w+)(?::\w+)?\}|\$(\w+)")
+
+# Grafana relative times, e.g. now, now-12h, now-7d
+_RELATIVE_TIME = re.compile(r"^now(?:-(\d+)([smhdwMy]))?(?:/[smhdwMy])?$")
+_UNITS_S = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "M": 30 * 86400, "y": 365 * 86400}
+
+
+@dataclass
+class Variable:
+    name: str
+    query: str = None
+    multi: bool = False
+    current: object = None
+
+
+@dataclass
+class Panel:
+    id: int
+    title: str
+    targets: list = field(default_factory=list)
+    max_data_points: int = 400
+
+
+@dataclass
+class Dashboard:
+    """
+    The parts of a Grafana dashboard definition (JSON) querying the datasource: template variables, panels with their
+    targets, annotations and the default time range.
+    """
+    uid: str
+    title: str
+    variables: [Variable] = field(default_factory=list)
+    panels: [Panel] = field(default_factory=list)
+    annotations: [str] = field(default_factory=list)
+    time_from: str = "now-12h"
+    time_to: str = "now"
+
+    @classmethod
+    def from_json(cls, definition: dict) -> "Dashboard":
+
+        # Dashboards exported for sharing wrap the definition
+        definition = definition.get("dashboard", definition)
+
+        variables = []
+        for variable in definition.get("templating", {}).get("list", []):
+            query = variable.get("query")
+            variables.append(Variable(name=variable["name"],
+                                      query=query if isinstance(query, str) else None,
+                                      multi=bool(variable.get("multi", False)),
+                                      current=(variable.get("current") or {}).get("value")))
+
+        # Panels may be nested in (collapsed) rows. Targets without a target string reuse the data of other panels.
+        # Hidden targets are not queried
+        panels = []
+        for panel in _flatten(definition.get("panels", [])):
+            targets = [x for x in panel.get("targets", [])
+                       if isinstance(x.get("target"), str) and x["target"] != "" and not x.get("hide", False)]
+            if len(targets) > 0:
+                panels.append(Panel(id=panel.get("id"), title=panel.get("title", ""), targets=targets,
+                                    max_data_points=int(panel.get("maxDataPoints") or 400)))
+
+        annotations = [x["query"] for x in definition.get("annotations", {}).get("list", [])
+                       if x.get("enable", True) and isinstance(x.get("query"), str)]
+
+        time = definition.get("time", {})
+        return cls(uid=definition.get("uid"),
+                   title=definition.get("title", ""),
+                   variables=variables,
+                   panels=panels,
+                   annotations=annotations,
+                   time_from=time.get("from", "now-12h"),
+                   time_to=time.get("to", "now"))
+
+    @classmethod
+    def load(cls, path: str) -> "Dashboard":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+    def time_range(self, now: datetime = None) -> (datetime, datetime):
+        """The default time range of the dashboard"""
+        return parse_time(self.time_from, now), parse_time(self.time_to, now)
+
+    def search_requests(self, values: dict) -> [(str, dict)]:
+        """/search requests of the variables (as Grafana resolves these), as (variable name, request) pairs"""
+        return [(x.name, {"target": substitute(x.query, values)}) for x in self.variables if x.query is not None]
+
+    def annotation_requests(self, values: dict, start: datetime, stop: datetime) -> [dict]:
+        return [{"range": _format_range(start, stop), "annotation": {"query": substitute(x, values), "enable": True}}
+                for x in self.annotations]
+
+    def query_requests(self, values: dict, start: datetime, stop: datetime) -> [dict]:
+        """/query requests of the panels (one per panel, as sent by Grafana)"""
+        requests = []
+        for panel in self.panels:
+            interval_ms = max(int((stop - start).total_seconds() * 1000 / panel.max_data_points), 1)
+            requests.append({"panelId": panel.id,
+                             "dashboardUID": self.uid,
+                             "range": _format_range(start, stop),
+                             "intervalMs": interval_ms,
+                             "maxDataPoints": panel.max_data_points,
+                             "targets": [{"refId": x.get("refId", "A"),
+                                          "target": substitute(x["target"], values),
+                                          "type": x.get("type", "timeserie")} for x in panel.targets]})
+        return requests
+
+    def default_values(self) -> dict:
+        """The current values of the variables saved with the dashboard"""
+        return {x.name: x.current for x in self.variables if x.current not in (None, "", [])}
+
+
+def substitute(text: str, values: dict) -> str:
+    """
+    Replaces template variable references by their values. Lists (multi-value variables) are formatted as (a|b|c), as
+    by the Grafana JSON datasource. Unknown variables are left as is.
+    """
+    def replace(match):
+        name = match.group(1) or match.group(2)
+        if name not in values:
+            return match.group(0)
+        value = values[name]
+        if isinstance(value, (list, tuple)):
+            return f"({'|'.join(str(x) for x in value)})" if len(value) != 1 else str(value[0])
+        return str(value)
+
+    return _VARIABLE.sub(replace, text)
+
+
+def parse_time(text: str, now: datetime = None) -> datetime:
+    """Parses a Grafana time (ISO 8601, epoch ms, or relative such as now-12h) to a UTC datetime"""
+    now = now or datetime.now(timezone.utc)
+    text = str(text).strip()
+
+    match = _RELATIVE_TIME.match(text)
+    if match:
+        amount, unit = match.groups()
+        return now - timedelta(seconds=int(amount) * _UNITS_S[unit]) if amount else now
+
+    if text.isdigit():
+        return datetime.fromtimestamp(int(text) / 1000, timezone.utc)
+
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def _format_range(start: datetime, stop: datetime) -> dict:
+    return {"from": _format_time(start), "to": _format_time(stop)}
+
+
+def _format_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def _flatten(panels: list) -> list:
+    result = []
+    for panel in panels:
+        result.append(panel)
+        result.extend(_flatten(panel.get("panels", [])))
+    return result
@@ -0,0 +1,227 @@
+import hashlib
+import io
+import os
+import pickle
+import threading
+import time
+from importlib import metadata
+from pathlib import Path
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Version of the compiled DB cache format, part of the cache key together with the can_decoder version
+CACHE_VERSION = 1
+
+
+class DatabaseStore:
+    """
+    DBs (*.dbc) in the root of the file system by lower case name, loaded lazily on first use.
+
+    Parsing large DBs is slow, such that loading all DBs before the server starts delays restarts. The DB names are
+    listed up front, and each DB is parsed when first requested, or by the background preload started with the server.
+    Changed DBC files are compiled again on refresh (see RootWatcher), without affecting the other DBs.
+    Compiled DBs are optionally cached in a local directory keyed by a hash of the DBC content, such that unchanged DBs
+    are not parsed again after a restart.
+
+    Entries are dicts with the can_decoder SignalDB as "db" (the signal search index is added on first search).
+    """
+
+    def __init__(self, fs, cache_dir: str = None):
+        """
+        :param fs: FS mounted in CANedge "root"
+        :param cache_dir: Optional local directory for compiled DBs
+        """
+        self._fs = fs
+        self._cache_dir = cache_dir
+        self._entries = {}
+        self._failed = set()
+        self._thread = None
+
+        # Replaced as a whole when DBs are added or removed, such that readers never see a partial update
+        listing = self._list()
+        self._paths = {k: v[0] for k, v in listing.items()}
+        self._versions = {k: v[1] for k, v in listing.items()}
+        self._locks = {x: threading.Lock() for x in self._paths}
+
+        if self._cache_dir is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __getitem__(self, name: str) -> dict:
+        entry = self.get(name)
+        if entry is None:
+            raise KeyError(name)
+        return entry
+
+    def keys(self):
+        return self._paths.keys()
+
+    def get(self, name: str, default=None) -> dict:
+        """Gets a DB entry, loading the DB if not loaded yet. Returns the default if unknown or failing to load"""
+        if name not in self._paths:
+            return default
+
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._load(name)
+        return entry if entry is not None else default
+
+    def version(self, name: str) -> str:
+        """Version of the DBC file of a DB (ETag, or size and modification time), changing when the DB is reloaded"""
+        return self._versions.get(name)
+
+    @property
+    def ready(self) -> bool:
+        """True when all DBs have been loaded (or failed to load)"""
+        return all(x in self._entries or x in self._failed for x in self._paths)
+
+    def status(self) -> dict:
+        """Load status of each DB (loaded, failed or pending)"""
+        return {x: "loaded" if x in self._entries else "failed" if x in self._failed else "pending"
+                for x in sorted(self._paths)}
+
+    def start(self):
+        """Start loading all DBs in the background, such that the first queries do not wait for these"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load_all, name="db-preload", daemon=True)
+            self._thread.start()
+
+    def load_all(self):
+        for name in sorted(self._paths):
+            self.get(name)
+
+    def refresh(self) -> [str]:
+        """
+        Lists the DBs again. Changed DBs which are loaded are compiled again, and replace the previous DB when compiled,
+        such that queries keep using the previous DB meanwhile. Unchanged DBs are kept as is.
+        Returns the names of the added, changed and removed DBs.
+        """
+        listing = self._list()
+
+        added = [x for x in listing if x not in self._paths]
+        removed = [x for x in self._paths if x not in listing]
+        changed = [x for x in listing if x in self._versions and listing[x][1] != self._versions[x]]
+
+        if len(added) > 0 or len(removed) > 0:
+            self._locks = {x: self._locks.get(x) or threading.Lock() for x in listing}
+            self._paths = {k: v[0] for k, v in listing.items()}
+            for name in removed:
+                self._entries.pop(name, None)
+                self._failed.discard(name)
+            self._versions = {k: v for k, v in self._versions.items() if k in listing}
+
+        for name in added:
+            logger.info(f"Found new DB {name}")
+            self._versions = dict(self._versions, **{name: listing[name][1]})
+
+        for name in changed:
+            logger.info(f"DB {name} changed, reloading")
+            if name in self._entries or name in self._failed:
+                self._load(name, reload=True)
+            self._versions = dict(self._versions, **{name: listing[name][1]})
+
+        for name in removed:
+            logger.info(f"DB {name} removed")
+
+        return sorted(added + changed + removed)
+
+    def _list(self) -> dict:
+        """DBC files in the root of the file system, as {name: (path, version)}"""
+        listing = {}
+        for info in self._fs.ls("", detail=True):
+            path = info["name"].lstrip("/")
+            if info.get("type") != "directory" and path.endswith(".dbc"):
+                listing[Path(path).stem.lower()] = (path, self._fs.get_file_version(info))
+        return listing
+
+    def _load(self, name: str, reload: bool = False) -> dict:
+
+        # Concurrent requests for a DB wait for a single load. While reloading, the previous entry is served
+        lock = self._locks.get(name)
+        if lock is None:
+            return None
+
+        with lock:
+            if name in self._entries and not reload:
+                return self._entries[name]
+
+            start = time.time()
+            try:
+                with self._fs.open(self._paths[name], "rb") as fp:
+                    content = fp.read()
+
+                cache_path = self._cache_path(content)
+                db = self._read_cache(cache_path)
+                source = "cache"
+                if db is None:
+                    import can_decoder
+                    logging.getLogger("canmatrix").setLevel(logging.ERROR)
+                    db = can_decoder.load_dbc(io.BytesIO(content))
+                    self._write_cache(cache_path, db)
+                    source = "DBC"
+            except Exception as e:
+                logger.error(f"Failed to load DB {name}: {e}")
+                if name not in self._entries:
+                    self._failed.add(name)
+                return self._entries.get(name)
+
+            logger.info(f"Loaded DB {name} from {source} in {time.time() - start:.2f} s")
+            self._failed.discard(name)
+            self._entries[name] = {"db": db}
+            return self._entries[name]
+
+    def _cache_path(self, content: bytes) -> str:
+        if self._cache_dir is None:
+            return None
+        key = hashlib.sha256(content)
+        key.update(f"{CACHE_VERSION}:{_can_decoder_version()}".encode())
+        return os.path.join(self._cache_dir, f"{key.hexdigest()}.pickle")
+
+    @staticmethod
+    def _read_cache(cache_path: str):
+        if cache_path is None or not os.path.isfile(cache_path):
+            return None
+        try:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to read compiled DB {cache_path}: {e}")
+            return None
+
+    @staticmethod
+    def _write_cache(cache_path: str, db):
+        if cache_path is None:
+            return
+        try:
+            # Write to a temporary file first, such that an interrupted write does not leave a corrupt cache entry
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(db, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to write compiled DB {cache_path}: {e}")
+
+
+def db_versions(dbs, names) -> tuple:
+    """
+    Versions of DBs by name, changing when a DB is reloaded. Used in the keys of cached results derived from the DBs,
+    such that reloading a DB only invalidates the results derived from it.
+    """
+    versions = dbs.version if isinstance(dbs, DatabaseStore) else lambda x: None
+    return tuple((x, versions(x)) for x in sorted(set(names)))
+
+
+def _can_decoder_version() -> str:
+    try:
+        return metadata.version("can_decoder")
+    except metadata.PackageNotFoundError:
+        return "unknown"
@@ -0,0 +1,34 @@
+import time
+from datetime import datetime
+
+
+class Deadline:
+    """
+    Wall-clock time budget of a query. A deadline of None or 0 never expires.
+    """
+
+    def __init__(self, seconds: float = None):
+        self.seconds = seconds
+        self._end = time.monotonic() + seconds if seconds else None
+
+    @property
+    def expired(self) -> bool:
+        return self._end is not None and time.monotonic() >= self._end
+
+
+def add_notice(entry: dict, text: str, severity: str = "warning"):
+    """
+    Adds a notice to a response entry. Grafana shows notices in the meta data of a frame as panel warnings.
+    """
+    entry.setdefault("meta", {}).setdefault("notices", []).append({"severity": severity, "text": text})
+
+
+def is_partial(res) -> bool:
+    """
+    Returns True if any entry of a response carries notices (e.g. about skipped data).
+    """
+    return isinstance(res, list) and any(isinstance(x, dict) and "notices" in x.get("meta", {}) for x in res)
+
+
+def format_ranges(ranges: [(datetime, datetime)]) -> str:
+    return ", ".join(f"{a:%Y-%m-%d %H:%M:%S} - {b:%Y-%m-%d %H:%M:%S}" for a, b in ranges)
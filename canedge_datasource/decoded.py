@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from canedge_datasource import profiling
+from canedge_datasource.metrics import CACHE_EVICTIONS, CACHE_REQUESTS
+
+# Cache namespace in the metrics
+NAMESPACE = "decoded"
+
+
+@dataclass
+class DecodedEntry:
+    db: object
+    signal_names: frozenset
+    signals: dict
+    nbytes: int
+
+
+class DecodedCache:
+    """
+    Decoded signals of log files at full time resolution (timestamps in ns and physical values), per DB, interface and
+    channel. Filled ahead of queries by the pre-decoder (see PreDecoder), such that queries of cached signals are served
+    without loading and decoding the log files.
+
+    Log files are not modified once uploaded, such that entries are keyed by path. Entries are only served for the DB
+    object they were decoded with, such that a reloaded DB is not served data decoded with the previous DB. The size is
+    bounded, the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_mb: float = 256):
+        """
+        :param max_mb: Max size of the cached arrays in MB
+        """
+        self._max_bytes = int(max_mb * 2 ** 20)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def put(self, log_file: str, db, itf, chn: int, signal_names: set, signals: dict):
+        """
+        :param signal_names: Signals decoded. Signals without data in the log file are cached as empty
+        :param signals: (timestamps, values) arrays per signal name
+        """
+        nbytes = sum(x.nbytes for arrays in signals.values() for x in arrays)
+        if nbytes > self._max_bytes:
+            return
+
+        key = (log_file, id(db), itf, int(chn))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous.nbytes
+
+            self._entries[key] = DecodedEntry(db=db, signal_names=frozenset(signal_names), signals=signals,
+                                              nbytes=nbytes)
+            self._nbytes += nbytes
+
+            while self._nbytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                CACHE_EVICTIONS.inc(namespace=NAMESPACE)
+
+    def get(self, log_file: str, db, itf, chn: int, signal_names: [str]) -> dict:
+        """Cached (timestamps, values) arrays per signal name, None unless all the signals are cached"""
+        key = (log_file, id(db), itf, int(chn))
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry.db is db and entry.signal_names.issuperset(signal_names)
+            if hit:
+                self._entries.move_to_end(key)
+
+        CACHE_REQUESTS.inc(namespace=NAMESPACE, result="hit" if hit else "miss")
+        profiling.record_cache(NAMESPACE, "hit" if hit else "miss")
+        if not hit:
+            return None
+
+        return {x: entry.signals.get(x, _EMPTY) for x in signal_names}
+
+
+# Signal without data in a log file
+_EMPTY = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
@@ -0,0 +1,310 @@
+import threading
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from can_decoder.support import get_j1939_limit
+from canedge_datasource.raw_frames import RawFrames
+from canedge_datasource.signal_index import calculate_pgn, calculate_pgns
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompiledSignal:
+    """
+    A signal compiled to a bit-field extraction over the payload matrix.
+
+    The bytes start_byte to stop_byte (exclusive) are combined to an unsigned integer (little or big endian), from which
+    the signal is extracted by a shift and a mask. The bit positions follow can_decoder.
+    """
+    name: str
+    start_byte: int
+    stop_byte: int
+    shift: int
+    mask: int
+    size: int
+    little_endian: bool
+    signed: bool
+    is_float: bool
+    factor: float
+    offset: float
+    limit: int = None
+
+    @classmethod
+    def compile(cls, signal, j1939: bool = False) -> "CompiledSignal":
+        start_byte = signal.start_bit // 8
+        stop_byte = (signal.start_bit + signal.size + 7) // 8
+        if signal.is_little_endian:
+            shift = signal.start_bit % 8
+        else:
+            shift = 8 * (stop_byte - start_byte) - signal.start_bit % 8 - signal.size
+
+        # J1939 values above the limit of unsigned signals are invalid (not available, error)
+        limit = get_j1939_limit(signal.size) if j1939 and not signal.is_signed else None
+
+        return cls(name=signal.name,
+                   start_byte=start_byte,
+                   stop_byte=stop_byte,
+                   shift=shift,
+                   mask=(1 << signal.size) - 1,
+                   size=signal.size,
+                   little_endian=signal.is_little_endian,
+                   signed=signal.is_signed,
+                   is_float=signal.is_float,
+                   factor=float(signal.factor),
+                   offset=float(signal.offset),
+                   limit=limit)
+
+    def raw(self, data: np.ndarray) -> np.ndarray:
+        """Raw (unsigned) values from a payload matrix as uint64"""
+        data = data[:, self.start_byte:self.stop_byte].astype(np.uint64)
+        byte_count = self.stop_byte - self.start_byte
+
+        # Signals of up to 64 bits not aligned to bytes may span 9 bytes, combined from the first 8 and the last byte
+        head = data[:, :8]
+        weights = np.arange(head.shape[1], dtype=np.uint64) * np.uint64(8)
+        if not self.little_endian:
+            weights = weights[::-1]
+        value = np.bitwise_or.reduce(head << weights, axis=1)
+
+        if byte_count > 8:
+            tail = data[:, 8]
+            if self.little_endian:
+                value = (value >> np.uint64(self.shift)) | (tail << np.uint64(64 - self.shift))
+            else:
+                value = (value << np.uint64(8 - self.shift)) | (tail >> np.uint64(self.shift))
+        else:
+            value = value >> np.uint64(self.shift)
+
+        return value & np.uint64(self.mask)
+
+    def physical(self, raw: np.ndarray) -> np.ndarray:
+        """Physical values (float) from raw values"""
+        if self.is_float:
+            if self.size == 32:
+                # Payloads may contain signaling NaNs
+                with np.errstate(invalid="ignore"):
+                    value = raw.astype(np.uint32).view(np.float32).astype(np.float64)
+            elif self.size == 64:
+                value = raw.view(np.float64)
+            else:
+                raise RuntimeError("Signal should be decoded as float, but is not 32 or 64 bits wide")
+        elif self.signed:
+            sign = (raw >> np.uint64(self.size - 1)) & np.uint64(1)
+            extension = np.uint64(~self.mask & 0xFFFFFFFFFFFFFFFF)
+            value = np.where(sign == 1, raw | extension, raw).view(np.int64)
+        else:
+            value = raw
+
+        value = value.astype(np.float64)
+        if self.factor != 1:
+            value = value * self.factor
+        if self.offset != 0:
+            value = value + self.offset
+
+        return value
+
+
+@dataclass
+class CompiledMultiplexer:
+    """
+    A multiplexer signal with the (compiled) signals and nested multiplexers of each multiplexer value.
+    """
+    signal: CompiledSignal
+    groups: dict = field(default_factory=dict)
+
+
+@dataclass
+class CompiledFrame:
+    frame_id: int
+    signals: list = field(default_factory=list)
+    multiplexers: list = field(default_factory=list)
+
+
+class SignalDecoder:
+    """
+    Vectorized decoder of the requested signals of a DB, operating on RawFrames.
+
+    The signals are compiled once to bit-field extractions (shift, mask, scale and offset) over the payload matrix. All
+    payload lengths are decoded in one pass: a signal is decoded for the frames with payloads covering the signal.
+    Multiplexed signals are decoded for the frames with matching multiplexer values. For J1939 DBs, frames are matched
+    by PGN, and values above the J1939 limit of unsigned signals are discarded (as can_decoder).
+
+    The output matches that of can_decoder.DataFrameDecoder (multiplexer signals are not output themselves).
+    """
+
+    def __init__(self, db, signal_names: [str] = None):
+        """
+        :param db: can_decoder SignalDB
+        :param signal_names: Signals to decode, all signals if None
+        """
+        self.j1939 = db.protocol == "J1939"
+        self._frames = {}
+
+        wanted = None if signal_names is None else set(signal_names)
+
+        def compile_signals(compiled, signals) -> bool:
+            for signal in signals:
+                if signal.is_multiplexer:
+                    multiplexer = CompiledMultiplexer(signal=CompiledSignal.compile(signal))
+                    for value, group in signal.signals.items():
+                        # Signals without multiplexer value (None) are also listed as plain signals of the frame
+                        if value is None:
+                            continue
+                        compiled_group = CompiledFrame(frame_id=compiled.frame_id)
+                        if compile_signals(compiled_group, group):
+                            multiplexer.groups[value] = compiled_group
+                    if len(multiplexer.groups) > 0:
+                        compiled.multiplexers.append(multiplexer)
+                elif wanted is None or signal.name in wanted:
+                    compiled.signals.append(CompiledSignal.compile(signal, self.j1939))
+            return len(compiled.signals) > 0 or len(compiled.multiplexers) > 0
+
+        for frame_id, frame in db.frames.items():
+            compiled = CompiledFrame(frame_id=frame_id)
+            if compile_signals(compiled, frame.signals):
+                # J1939 frames are matched by PGN (later frames with the same PGN take precedence, as can_decoder)
+                self._frames[calculate_pgn(frame_id) if self.j1939 else frame_id] = compiled
+
+    def _keys(self, frames: RawFrames) -> np.ndarray:
+        """Keys matching frames to compiled frames (fused IDE and ID, or PGN for J1939)"""
+        if self.j1939:
+            # Only extended frames can be J1939
+            return calculate_pgns(frames.id, frames.ide)
+        return (frames.ide.astype(np.uint32) << np.uint32(31)) | frames.id
+
+    @property
+    def frame_ids(self) -> [int]:
+        """IDs of the frames containing requested signals (bit 32 cleared), None for J1939 DBs"""
+        return None if self.j1939 else sorted({x & 0x7FFFFFFF for x in self._frames.keys()})
+
+    @property
+    def pgns(self) -> [int]:
+        """PGNs of the frames containing requested signals for J1939 DBs, otherwise None"""
+        return sorted(self._frames.keys()) if self.j1939 else None
+
+    @property
+    def signal_names(self) -> set:
+        """Names of the signals decoded (multiplexer signals are not output themselves)"""
+        def names(compiled):
+            for signal in compiled.signals:
+                yield signal.name
+            for multiplexer in compiled.multiplexers:
+                for group in multiplexer.groups.values():
+                    yield from names(group)
+
+        return {name for compiled in self._frames.values() for name in names(compiled)}
+
+    def matches(self, frames: RawFrames) -> np.ndarray:
+        """Mask of the frames containing requested signals"""
+        return np.isin(self._keys(frames), np.fromiter(self._frames.keys(), dtype=np.uint32, count=len(self._frames)))
+
+    def decode(self, frames: RawFrames) -> dict:
+        """
+        Decode frames. Returns a dict with (timestamps, physical values, raw values, frame IDs) arrays per signal name.
+        """
+        result = {}
+        keys = self._keys(frames)
+
+        # Frames are grouped by sorting the keys once (instead of comparing all frames with each key)
+        order = np.argsort(keys, kind="stable")
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        for key, start, end in zip(unique_keys.tolist(), starts, ends):
+            compiled = self._frames.get(key)
+            if compiled is None:
+                continue
+            indices = order[start:end]
+            self._decode_group(compiled, frames, indices, result)
+
+        # Concatenate the parts of each signal (from several frames or multiplexer values), ordered by time
+        for name, parts in result.items():
+            timestamps, values, raws, ids = (np.concatenate(x) for x in zip(*parts))
+            order = np.argsort(timestamps, kind="stable")
+            result[name] = (timestamps[order], values[order], raws[order], ids[order])
+
+        return result
+
+    def _decode_group(self, compiled: CompiledFrame, frames: RawFrames, indices: np.ndarray, result: dict):
+        data = frames.data[indices]
+        lengths = frames.length[indices]
+
+        for signal in compiled.signals:
+            # Only frames with payloads covering the signal
+            valid = lengths >= signal.stop_byte
+            if not valid.all():
+                if not valid.any():
+                    continue
+                signal_indices, signal_data = indices[valid], data[valid]
+            else:
+                signal_indices, signal_data = indices, data
+
+            raw = signal.raw(signal_data)
+            if signal.limit is not None:
+                valid = raw < np.uint64(signal.limit)
+                signal_indices, raw = signal_indices[valid], raw[valid]
+                if len(raw) == 0:
+                    continue
+
+            result.setdefault(signal.name, []).append((frames.timestamp[signal_indices],
+                                                       signal.physical(raw),
+                                                       raw,
+                                                       frames.id[signal_indices]))
+
+        for multiplexer in compiled.multiplexers:
+            valid = lengths >= multiplexer.signal.stop_byte
+            mux_indices = indices[valid]
+            mux_values = multiplexer.signal.raw(data[valid])
+            for value, group in multiplexer.groups.items():
+                group_indices = mux_indices[mux_values == np.uint64(value)]
+                if len(group_indices) > 0:
+                    self._decode_group(group, frames, group_indices, result)
+
+    def decode_frame(self, frames: RawFrames) -> pd.DataFrame:
+        """
+        Decode frames to a data frame as can_decoder.DataFrameDecoder (UTC TimeStamp index, "CAN ID", "Signal",
+        "Raw Value" and "Physical Value" columns), ordered by time.
+        """
+        decoded = self.decode(frames)
+        if len(decoded) == 0:
+            return pd.DataFrame()
+
+        names = list(decoded.keys())
+        timestamps, values, raws, ids = (np.concatenate(x) for x in zip(*decoded.values()))
+        signal = pd.Categorical.from_codes(np.repeat(np.arange(len(names)), [len(x[0]) for x in decoded.values()]),
+                                           categories=names)
+        order = np.argsort(timestamps, kind="stable")
+
+        index = pd.DatetimeIndex(timestamps[order].astype("datetime64[ns]"), name="TimeStamp").tz_localize("UTC")
+        return pd.DataFrame({"CAN ID": ids[order] & np.uint32(0x1FFFFFFF),
+                             "Signal": np.asarray(signal)[order],
+                             "Raw Value": raws[order],
+                             "Physical Value": values[order]}, index=index)
+
+
+# Compiled decoders, per DB and requested signals
+_decoders = {}
+_decoders_lock = threading.Lock()
+_DECODERS_MAX = 64
+
+
+def get_decoder(db, signal_names: [str] = None) -> SignalDecoder:
+    """
+    Returns a (cached) decoder of the signals of a DB.
+    """
+    key = (id(db), None if signal_names is None else tuple(sorted(set(signal_names))))
+    with _decoders_lock:
+        entry = _decoders.get(key)
+        if entry is not None and entry[0] is db:
+            return entry[1]
+
+    decoder = SignalDecoder(db, signal_names)
+
+    with _decoders_lock:
+        if len(_decoders) >= _DECODERS_MAX:
+            _decoders.pop(next(iter(_decoders)))
+        _decoders[key] = (db, decoder)
+
+    return decoder
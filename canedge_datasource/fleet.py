@@ -0,0 +1,355 @@
+import contextvars
+import fnmatch
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+from can_decoder import SignalDB
+
+from canedge_datasource.cancel import CancelToken, QueryCancelled
+from canedge_datasource.decoded import DecodedCache
+from canedge_datasource.deadline import Deadline, add_notice
+from canedge_datasource.enums import CanedgeInterface, CanedgeChannel
+from canedge_datasource.memory import MemoryBudget, MemoryGuard
+from canedge_datasource.metrics import QUERIES_GUARDED, timer
+from canedge_datasource.presence import PresenceIndex
+from canedge_datasource.profiling import active_traces, activate
+from canedge_datasource.raw_frames import to_epoch_ns
+from canedge_datasource.signal import SignalQuery, iter_signal_data
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Centroids kept per bucket for percentile aggregates (see BucketAggregate)
+SKETCH_SIZE = 64
+
+# Aggregates besides percentiles (p0 to p100, e.g. p95 or p99.9)
+AGGREGATES = ("min", "max", "mean", "count")
+
+_PERCENTILE = re.compile(r"^p(\d+(\.\d+)?)$")
+
+
+@dataclass
+class FleetQuery:
+    """
+    Signal aggregated across the devices matching a list of patterns (e.g. "*" or "AABB*"). One series per aggregate,
+    named by the target of the same position. The data limit of each device (in MB) is at most the limit of the
+    request, which applies if None.
+    """
+    refid: str
+    targets: tuple
+    devices: tuple
+    itf: CanedgeInterface
+    chn: CanedgeChannel
+    db: SignalDB
+    signal_name: str
+    interval_ms: int
+    aggregates: tuple
+    limit_mb: float = None
+
+
+def parse_aggregate(name: str) -> str:
+    """Normalizes an aggregate name (min, max, mean, count or a percentile, e.g. p95). Raises ValueError if unknown"""
+    name = name.strip().lower()
+    if name == "median":
+        name = "p50"
+    match = _PERCENTILE.match(name)
+    if name not in AGGREGATES and (match is None or float(match.group(1)) > 100):
+        raise ValueError(f"Unknown aggregate: {name}")
+    return name
+
+
+def match_devices(patterns: [str], devices: [str]) -> [str]:
+    """Devices matching any of the patterns (shell style wildcards), in the order listed"""
+    return [x for x in devices if any(fnmatch.fnmatchcase(x, pattern) for pattern in patterns)]
+
+
+class BucketAggregate:
+    """
+    Partial aggregates of samples per time bucket: count, sum, min and max, and optionally a sketch of SKETCH_SIZE
+    centroids per bucket for percentiles.
+
+    The sketch is a merging digest (as t-digest, with clusters of equal weight): each centroid is the mean and the
+    weight of a run of samples adjacent in value. When samples or sketches are merged, the centroids are sorted and
+    clustered again by their position in the cumulative weight. The weights are kept exactly, such that the rank of a
+    centroid is only off by the spread of the clusters it is merged from, and the error does not build up with the
+    number of merges. Percentiles are interpolated between the centroids (at the middle of their weight). The rank
+    error stays within about 1 / SKETCH_SIZE, also when merging the aggregates of hundreds of devices.
+
+    Aggregates of the same buckets are merged (e.g. the aggregates of several devices). The size is bounded by the
+    number of buckets, regardless of the number of samples and aggregates merged. Min, max, mean and count are exact,
+    percentiles are approximate.
+    """
+
+    def __init__(self, origin_ns: int, interval_ns: int, buckets: int, sketch: bool = False):
+        """
+        :param origin_ns: Start of the first bucket in ns since epoch
+        :param interval_ns: Bucket length in ns
+        :param buckets: Number of buckets. Samples outside of the buckets are ignored
+        :param sketch: Keep a sketch for percentiles
+        """
+        self.origin_ns = origin_ns
+        self.interval_ns = interval_ns
+        self.count = np.zeros(buckets, dtype=np.int64)
+        self.sum = np.zeros(buckets, dtype=np.float64)
+        self.min = np.full(buckets, np.inf)
+        self.max = np.full(buckets, -np.inf)
+
+        # Centroids per bucket, sorted, with their weights (empty slots have weight 0 and are sorted last)
+        self._values = np.full((buckets, SKETCH_SIZE), np.inf) if sketch else None
+        self._weights = np.zeros((buckets, SKETCH_SIZE)) if sketch else None
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.count, self.sum, self.min, self.max, self._values, self._weights]
+        return sum(x.nbytes for x in arrays if x is not None)
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        """Add samples (timestamps in ns since epoch). NaN values are ignored"""
+        buckets = (np.asarray(timestamps, dtype=np.int64) - self.origin_ns) // self.interval_ns
+        values = np.asarray(values, dtype=np.float64)
+
+        valid = (buckets >= 0) & (buckets < len(self.count)) & ~np.isnan(values)
+        buckets, values = buckets[valid], values[valid]
+        if len(values) == 0:
+            return
+
+        # Group the samples by bucket, sorted by value within each bucket for the sketch
+        order = np.lexsort((values, buckets)) if self._values is not None else np.argsort(buckets, kind="stable")
+        buckets, values = buckets[order], values[order]
+        rows, starts = np.unique(buckets, return_index=True)
+        counts = np.diff(np.append(starts, len(values)))
+
+        self.count[rows] += counts
+        self.sum[rows] += np.add.reduceat(values, starts)
+        self.min[rows] = np.minimum(self.min[rows], np.minimum.reduceat(values, starts))
+        self.max[rows] = np.maximum(self.max[rows], np.maximum.reduceat(values, starts))
+
+        if self._values is not None:
+            # Samples clustered by rank within their bucket
+            groups = np.repeat(np.arange(len(rows)), counts)
+            ranks = np.arange(len(values)) - starts[groups]
+            clusters = ((ranks + 0.5) / counts[groups] * SKETCH_SIZE).astype(np.int64)
+            self._merge_sketch(rows, *_centroids(groups, clusters, values, np.ones(len(values)), len(rows)))
+
+    def merge(self, other: "BucketAggregate"):
+        """Merge the aggregates of the same buckets"""
+        rows = np.flatnonzero(other.count)
+        if len(rows) == 0:
+            return
+
+        self.count[rows] += other.count[rows]
+        self.sum[rows] += other.sum[rows]
+        self.min[rows] = np.minimum(self.min[rows], other.min[rows])
+        self.max[rows] = np.maximum(self.max[rows], other.max[rows])
+
+        if self._values is not None and other._values is not None:
+            self._merge_sketch(rows, other._values[rows], other._weights[rows])
+
+    def series(self, aggregate: str) -> (list, list):
+        """Aggregated value of the buckets with samples, as lists of timestamps (start of the bucket in ms) and values"""
+        rows = np.flatnonzero(self.count)
+        timestamps = (self.origin_ns + rows * self.interval_ns) / 10 ** 6
+
+        if aggregate == "min":
+            values = self.min[rows]
+        elif aggregate == "max":
+            values = self.max[rows]
+        elif aggregate == "mean":
+            values = self.sum[rows] / self.count[rows]
+        elif aggregate == "count":
+            values = self.count[rows].astype(np.float64)
+        else:
+            fraction = float(_PERCENTILE.match(aggregate).group(1)) / 100
+            values = _weighted_quantiles(self._values[rows], self._weights[rows], np.array([fraction]))[:, 0]
+
+            # The extremes are exact
+            values = np.clip(values, self.min[rows], self.max[rows])
+            if fraction == 0:
+                values = self.min[rows]
+            elif fraction == 1:
+                values = self.max[rows]
+
+        return timestamps.tolist(), values.tolist()
+
+    def _merge_sketch(self, rows: np.ndarray, values: np.ndarray, weights: np.ndarray):
+        """Merge centroids (with weights) into the sketch of the rows, clustered back to SKETCH_SIZE centroids"""
+        values = np.concatenate([self._values[rows], values], axis=1)
+        weights = np.concatenate([self._weights[rows], weights], axis=1)
+
+        order = np.argsort(values, axis=1, kind="stable")
+        values, weights = np.take_along_axis(values, order, axis=1), np.take_along_axis(weights, order, axis=1)
+
+        # Centroids clustered by the position of the middle of their weight
+        total = weights.sum(axis=1, keepdims=True)
+        positions = (np.cumsum(weights, axis=1) - weights / 2) / np.where(total > 0, total, 1)
+        clusters = np.minimum((positions * SKETCH_SIZE).astype(np.int64), SKETCH_SIZE - 1)
+        groups = np.repeat(np.arange(len(rows))[:, None], values.shape[1], axis=1)
+
+        valid = weights > 0
+        self._values[rows], self._weights[rows] = _centroids(groups[valid], clusters[valid], values[valid],
+                                                             weights[valid], len(rows))
+
+
+def _centroids(groups: np.ndarray, clusters: np.ndarray, values: np.ndarray, weights: np.ndarray,
+               rows: int) -> (np.ndarray, np.ndarray):
+    """
+    Weighted means and weights of the values per row (group) and cluster, as (rows, SKETCH_SIZE) arrays sorted by row.
+    Clusters without values are empty slots (weight 0, sorted last).
+    """
+    slots = groups * SKETCH_SIZE + clusters
+    sums = np.bincount(slots, values * weights, minlength=rows * SKETCH_SIZE).reshape(rows, SKETCH_SIZE)
+    totals = np.bincount(slots, weights, minlength=rows * SKETCH_SIZE).reshape(rows, SKETCH_SIZE)
+
+    # Means of runs of values adjacent in value are in order. Empty slots are moved last
+    centroids = np.where(totals > 0, sums / np.where(totals > 0, totals, 1), np.inf)
+    order = np.argsort(centroids, axis=1, kind="stable")
+    return np.take_along_axis(centroids, order, axis=1), np.take_along_axis(totals, order, axis=1)
+
+
+def _weighted_quantiles(values: np.ndarray, weights: np.ndarray, fractions: np.ndarray) -> np.ndarray:
+    """
+    Weighted quantiles of each row of values sorted by row (empty slots of weight 0 last). Each value is placed at the
+    middle of its weight in the cumulative weight, and quantiles are interpolated linearly between values (the first
+    and last values below and above these). The rows are searched at once, by offsetting the positions of each row.
+    """
+    rows, width = values.shape
+    total = weights.sum(axis=1, keepdims=True)
+    positions = (np.cumsum(weights, axis=1) - weights / 2) / np.where(total > 0, total, 1)
+    positions = np.where(weights > 0, positions, 1.5)
+    filled = (weights > 0).sum(axis=1)[:, None]
+
+    offsets = 2 * np.arange(rows)[:, None]
+    upper = np.searchsorted((positions + offsets).ravel(), (fractions[None, :] + offsets).ravel())
+    upper = np.clip(upper.reshape(rows, len(fractions)) - offsets // 2 * width, 1, np.maximum(filled - 1, 1))
+    lower = upper - 1
+
+    position_lower, position_upper = [np.take_along_axis(positions, x, axis=1) for x in [lower, upper]]
+    value_lower, value_upper = [np.take_along_axis(values, x, axis=1) for x in [lower, upper]]
+    span = np.where(position_upper > position_lower, position_upper - position_lower, 1)
+    step = np.clip((fractions[None, :] - position_lower) / span, 0, 1)
+
+    # Rows with a single value
+    single = filled <= 1
+    return np.where(single, values[:, :1], value_lower + step * np.where(single, 0, value_upper - value_lower))
+
+
+def fleet_phy_data(fs, fleet_queries: [FleetQuery], start_date: datetime, stop_date: datetime, limit_mb, passwords,
+                   max_workers: int = 4, cancel: CancelToken = None, deadline_s: float = None,
+                   max_data_points: int = None, presence: PresenceIndex = None, chunk_rows: int = None,
+                   memory_guard: MemoryGuard = None, decoded_cache: DecodedCache = None,
+                   max_query_mb: float = None) -> list:
+    """
+    Returns time series of signals aggregated across fleets of devices, one series per aggregate.
+
+    The devices of a query are processed in parallel by max_workers threads, each with its own data limit (limit_mb per
+    device, or the lower limit of the query), and the deadline shared by all devices. The aggregates of a device are
+    merged into the fleet aggregates as soon as the device is done, such that the memory used is bounded by the number
+    of buckets and workers, regardless of the number of devices.
+
+    Buckets are of the query interval (aligned to the epoch), made coarser if needed to return at most max_data_points
+    per series. Devices with skipped data are reported as notices.
+
+    With max_query_mb, the devices in flight share the memory ceiling of the query: the files loaded and the aggregates
+    held by all devices are accounted together, and files not expected to fit are skipped.
+
+    Returns as a list of dicts, ordered as the queries and aggregates, as time_series_phy_data.
+    """
+    result = []
+    deadline = Deadline(deadline_s)
+    memory = MemoryBudget(max_query_mb)
+    start_ns, stop_ns = to_epoch_ns(start_date), to_epoch_ns(stop_date)
+
+    devices = None
+    for fleet_query in fleet_queries:
+
+        entries = [{'refId': fleet_query.refid, 'target': x, 'datapoints': []} for x in fleet_query.targets]
+        result.extend(entries)
+
+        # Process memory ceiling. Reject the query if no memory is available
+        if memory_guard is not None and not memory_guard.admits(1):
+            notice = f"Rejected (process memory {memory_guard.limit_mb} MB)"
+            logger.warning(notice)
+            QUERIES_GUARDED.inc(action="rejected")
+            for entry in entries:
+                add_notice(entry, notice)
+            continue
+
+        if devices is None:
+            with timer("listing"):
+                devices = list(fs.get_device_ids())
+        fleet_devices = match_devices(fleet_query.devices, devices)
+
+        # Buckets aligned to the epoch, covering the time range
+        interval_ns = max(int(fleet_query.interval_ms), 1) * 10 ** 6
+        if max_data_points:
+            interval_ns = max(interval_ns, math.ceil((stop_ns - start_ns) / int(max_data_points)))
+        origin_ns = start_ns - start_ns % interval_ns
+        buckets = (stop_ns - origin_ns) // interval_ns + 1
+        sketch = any(x not in AGGREGATES for x in fleet_query.aggregates)
+        device_limit_mb = limit_mb if fleet_query.limit_mb is None else min(fleet_query.limit_mb, limit_mb)
+
+        def aggregate_device(device: str, traces: list) -> (BucketAggregate, set):
+            signal_query = SignalQuery(refid=fleet_query.refid, target="", device=device, itf=fleet_query.itf,
+                                       chn=fleet_query.chn, db=fleet_query.db, signal_name=fleet_query.signal_name,
+                                       interval_ms=fleet_query.interval_ms)
+            # The aggregate is held until merged into the fleet aggregate
+            aggregate = BucketAggregate(origin_ns, interval_ns, buckets, sketch)
+            memory.add(aggregate.nbytes)
+            skipped = set()
+            with activate(traces):
+                try:
+                    for chunk in iter_signal_data(fs, [signal_query], start_date, stop_date, device_limit_mb,
+                                                  passwords, cancel=cancel, deadline=deadline, presence=presence,
+                                                  chunk_rows=chunk_rows, memory_guard=memory_guard,
+                                                  decoded_cache=decoded_cache, skipped=skipped, memory=memory):
+                        with timer("aggregate", device):
+                            aggregate.add(*chunk[fleet_query.signal_name])
+                except QueryCancelled:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Device: {device} - Fleet query failed: {e}")
+                    skipped.add("error")
+            return aggregate, skipped
+
+        fleet = BucketAggregate(origin_ns, interval_ns, buckets, sketch)
+        memory.add(fleet.nbytes)
+        incomplete, reasons = 0, set()
+
+        # Keep at most max_workers devices in flight, such that at most that many device aggregates are held. Each task
+        # runs in a copy of the context of the request (application context and current endpoint)
+        traces = active_traces()
+        remaining = iter(fleet_devices)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fleet") as executor:
+            pending = set()
+            while True:
+                for device in remaining:
+                    pending.add(executor.submit(contextvars.copy_context().run, aggregate_device, device, traces))
+                    if len(pending) >= max_workers:
+                        break
+                if len(pending) == 0:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    aggregate, skipped = future.result()
+                    fleet.merge(aggregate)
+                    memory.release(aggregate.nbytes)
+                    if len(skipped) > 0:
+                        incomplete += 1
+                        reasons.update(skipped)
+
+        logger.info(f"Fleet query of {fleet_query.signal_name} across {len(fleet_devices)} devices "
+                    f"({buckets} buckets, {fleet.nbytes / 2 ** 20:.1f} MB), peak memory: {memory.peak_mb:.1f} MB")
+
+        for entry, aggregate in zip(entries, fleet_query.aggregates):
+            timestamps, values = fleet.series(aggregate)
+            entry["datapoints"] = list(zip(values, timestamps))
+            if incomplete > 0:
+                add_notice(entry, f"Partial data ({', '.join(sorted(reasons))}), {incomplete} of "
+                                  f"{len(fleet_devices)} devices incomplete")
+        memory.release(fleet.nbytes)
+
+    return result
@@ -0,0 +1,241 @@
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+from can_decoder import SignalDB
+
+from canedge_datasource.cancel import CancelToken
+from canedge_datasource.decoded import DecodedCache
+from canedge_datasource.deadline import Deadline, add_notice
+from canedge_datasource.enums import CanedgeInterface, CanedgeChannel
+from canedge_datasource.memory import MemoryBudget, MemoryGuard
+from canedge_datasource.metrics import QUERIES_GUARDED, timer
+from canedge_datasource.presence import PresenceIndex
+from canedge_datasource.signal import SignalQuery, iter_signal_data
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Mean earth radius in m (tracks are projected to a plane around their mean latitude for the simplification)
+EARTH_RADIUS_M = 6371000
+
+# Max age in s of the longitude aligned to a latitude (when decoded from separate frames)
+ALIGN_MAX_S = 1
+
+# A stop is a period of at least STOP_S seconds with the position moving less than STOP_RADIUS_M
+STOP_S = 60
+STOP_RADIUS_M = 25
+
+# Max number of positions returned if the request does not set maxDataPoints
+DEFAULT_MAX_POINTS = 1000
+
+
+@dataclass
+class GeoQuery:
+    """
+    Track of a device from latitude and longitude signals (in degrees). The latitude and longitude series are named by
+    the targets.
+    """
+    refid: str
+    targets: tuple
+    device: str
+    itf: CanedgeInterface
+    chn: CanedgeChannel
+    db: SignalDB
+    latitude: str
+    longitude: str
+    max_data_points: int = None
+    tolerance_m: float = None
+
+
+def align_track(lat_timestamps: np.ndarray, lat: np.ndarray, lon_timestamps: np.ndarray,
+                lon: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Aligns the longitudes to the latitudes (the last longitude at or before each latitude, at most ALIGN_MAX_S older).
+    Returns the timestamps, latitudes and longitudes of the track. Positions without a longitude and invalid positions
+    (NaN or out of range) are dropped.
+    """
+    index = np.searchsorted(lon_timestamps, lat_timestamps, side="right") - 1
+    valid = index >= 0
+    valid[valid] = lat_timestamps[valid] - lon_timestamps[index[valid]] <= ALIGN_MAX_S * 10 ** 9
+
+    timestamps, lat, lon = lat_timestamps[valid], lat[valid], lon[index[valid]]
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    return timestamps[valid], lat[valid], lon[valid]
+
+
+def simplify_track(timestamps: np.ndarray, lat: np.ndarray, lon: np.ndarray, max_points: int = None,
+                   tolerance_m: float = None) -> np.ndarray:
+    """
+    Indices of the positions kept when simplifying a track (Douglas-Peucker). The start and end of the track and of
+    each stop are always kept, such that stops stay visible (with their arrival and departure times).
+
+    The tolerance defaults to the extent of the track divided by max_points, about a pixel when the map is zoomed to
+    the track. It is doubled until at most max_points positions are kept (besides the stops).
+    """
+    if len(timestamps) <= 2:
+        return np.arange(len(timestamps))
+
+    max_points = max_points or DEFAULT_MAX_POINTS
+    x, y = _project(lat, lon)
+    keep = find_stops(timestamps, x, y)
+
+    if tolerance_m is None:
+        tolerance_m = np.hypot(np.ptp(x), np.ptp(y)) / max_points
+
+    mask = douglas_peucker(x, y, tolerance_m, keep)
+    while tolerance_m > 0 and mask.sum() > max(max_points, keep.sum() + 2):
+        tolerance_m *= 2
+        mask = douglas_peucker(x, y, tolerance_m, keep)
+
+    return np.flatnonzero(mask)
+
+
+def find_stops(timestamps: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Mask of the first and last positions of each stop (positions in m). A position starts a stationary period if the
+    first position at least STOP_S later is within STOP_RADIUS_M. Overlapping stationary periods form a stop (also
+    covering gaps in the data, e.g. while parked).
+    """
+    count = len(timestamps)
+    later = np.searchsorted(timestamps, timestamps + STOP_S * 10 ** 9, side="left")
+    start = np.flatnonzero(later < count)
+    start = start[np.hypot(x[later[start]] - x[start], y[later[start]] - y[start]) <= STOP_RADIUS_M]
+
+    # Positions covered by a stationary period
+    coverage = np.zeros(count + 1, dtype=np.int64)
+    np.add.at(coverage, start, 1)
+    np.add.at(coverage, later[start] + 1, -1)
+    stopped = np.cumsum(coverage[:-1]) > 0
+
+    edges = np.diff(np.concatenate([[False], stopped, [False]]).astype(np.int8))
+    keep = np.zeros(count, dtype=bool)
+    keep[np.flatnonzero(edges == 1)] = True
+    keep[np.flatnonzero(edges == -1) - 1] = True
+    return keep
+
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float, keep: np.ndarray = None) -> np.ndarray:
+    """
+    Mask of the points kept by Douglas-Peucker simplification of a line with the tolerance (max distance of a removed
+    point to the simplified line). The first and last points and the points in keep are always kept, and the line is
+    simplified between these.
+    """
+    mask = np.zeros(len(x), dtype=bool) if keep is None else keep.copy()
+    if len(x) == 0:
+        return mask
+    mask[0] = mask[-1] = True
+
+    # Segments still to simplify (iterative, long tracks would exceed the recursion limit)
+    anchors = np.flatnonzero(mask)
+    segments = list(zip(anchors[:-1], anchors[1:]))
+    while len(segments) > 0:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length = np.hypot(dx, dy)
+        distances = np.abs(dx * py - dy * px) / length if length > 0 else np.hypot(px, py)
+
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            mask[split] = True
+            segments.extend([(first, split), (split, last)])
+
+    return mask
+
+
+def _project(lat: np.ndarray, lon: np.ndarray) -> (np.ndarray, np.ndarray):
+    """Equirectangular projection in m around the mean latitude"""
+    lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+    return EARTH_RADIUS_M * lon_rad * np.cos(np.mean(lat_rad)), EARTH_RADIUS_M * lat_rad
+
+
+def geo_phy_data(fs, geo_queries: [GeoQuery], start_date: datetime, stop_date: datetime, limit_mb, passwords,
+                 cancel: CancelToken = None, deadline_s: float = None, presence: PresenceIndex = None,
+                 chunk_rows: int = None, memory_guard: MemoryGuard = None, decoded_cache: DecodedCache = None,
+                 max_query_mb: float = None) -> list:
+    """
+    Returns tracks for map panels, as latitude and longitude series with the same timestamps.
+
+    The latitude and longitude signals are decoded together at full resolution, aligned to one track and simplified
+    (see simplify_track), instead of being resampled separately per interval. Files are processed as for time series
+    (data limit, deadline, decoded cache), and skipped files are reported as notices.
+
+    With max_query_mb, the positions held at full resolution are accounted (per query), and the remaining files are
+    skipped once the ceiling is exceeded. The track of the positions decoded so far is returned, with a notice.
+
+    Returns as a list of dicts, two per query (latitude, longitude), as time_series_phy_data.
+    """
+    result = []
+    deadline = Deadline(deadline_s)
+
+    for geo_query in geo_queries:
+
+        entries = [{'refId': geo_query.refid, 'target': x, 'datapoints': []} for x in geo_query.targets]
+        result.extend(entries)
+
+        # Process memory ceiling. Reject the query if no memory is available
+        if memory_guard is not None and not memory_guard.admits(1):
+            notice = f"Rejected (process memory {memory_guard.limit_mb} MB)"
+            logger.warning(notice)
+            QUERIES_GUARDED.inc(action="rejected")
+            for entry in entries:
+                add_notice(entry, notice)
+            continue
+
+        signal_queries = [SignalQuery(refid=geo_query.refid, target=target, device=geo_query.device,
+                                      itf=geo_query.itf, chn=geo_query.chn, db=geo_query.db, signal_name=signal,
+                                      interval_ms=0)
+                          for target, signal in zip(geo_query.targets, [geo_query.latitude, geo_query.longitude])]
+
+        chunks = {geo_query.latitude: [], geo_query.longitude: []}
+        skipped = set()
+        memory = MemoryBudget(max_query_mb)
+        for chunk in iter_signal_data(fs, signal_queries, start_date, stop_date, limit_mb, passwords, cancel=cancel,
+                                      deadline=deadline, presence=presence, chunk_rows=chunk_rows,
+                                      memory_guard=memory_guard, decoded_cache=decoded_cache, skipped=skipped,
+                                      memory=memory):
+            for name, arrays in chunk.items():
+                chunks[name].append(arrays)
+                memory.add(sum(x.nbytes for x in arrays))
+
+            # Stop once the memory ceiling is exceeded
+            if memory.exceeded:
+                logger.info(f"Device: {geo_query.device} - Skipping remaining files (memory {max_query_mb} MB)")
+                skipped.add(f"memory {max_query_mb} MB")
+                break
+
+        with timer("geo", geo_query.device):
+            (lat_timestamps, lat), (lon_timestamps, lon) = [_concatenate(chunks[x]) for x in
+                                                            [geo_query.latitude, geo_query.longitude]]
+            timestamps, lat, lon = align_track(lat_timestamps, lat, lon_timestamps, lon)
+            index = simplify_track(timestamps, lat, lon, geo_query.max_data_points, geo_query.tolerance_m)
+
+        logger.info(f"Device: {geo_query.device} - Track of {len(timestamps)} positions simplified to {len(index)}, "
+                    f"peak memory: {memory.peak_mb:.1f} MB")
+
+        timestamps_ms = (timestamps[index] / 10 ** 6).tolist()
+        entries[0]["datapoints"] = list(zip(lat[index].tolist(), timestamps_ms))
+        entries[1]["datapoints"] = list(zip(lon[index].tolist(), timestamps_ms))
+
+        if len(skipped) > 0:
+            for entry in entries:
+                add_notice(entry, f"Partial data ({', '.join(sorted(skipped))})")
+
+    return result
+
+
+def _concatenate(chunks: list) -> (np.ndarray, np.ndarray):
+    """Concatenates chunks of (timestamps, values), ordered by time"""
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+    timestamps = np.concatenate([x[0] for x in chunks]).astype(np.int64)
+    values = np.concatenate([x[1] for x in chunks]).astype(np.float64)
+    if np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+    return timestamps, values
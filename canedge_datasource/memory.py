@@ -0,0 +1,127 @@
+import math
+import os
+import threading
+import numpy as np
+
+# Not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Approximate size of a data point in the response (a list holding a tuple of two floats)
+DATAPOINT_BYTES = 120
+
+# Approximate ratio of the memory used while loading a log file (mdf_iter data frame with a Python object per payload)
+# to the size of the file
+LOAD_EXPANSION = 10
+
+# Share of the available process memory the data points of a query may use (the rest is left for loading files)
+DATAPOINTS_SHARE = 0.5
+
+
+class MemoryBudget:
+    """
+    Memory ceiling of a query. The memory held by the query is accounted explicitly (loaded frames, decoded chunks and
+    data points in the response). A ceiling of None or 0 is never exceeded. The budget may be shared by the threads of
+    a query (e.g. the devices of a fleet query).
+    """
+
+    def __init__(self, limit_mb: float = None):
+        self.limit_mb = limit_mb
+        self._limit = int(limit_mb * 2 ** 20) if limit_mb else None
+        self._lock = threading.Lock()
+        self.used = 0
+        self.peak = 0
+
+    def add(self, nbytes: int):
+        with self._lock:
+            self.used += int(nbytes)
+            self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.used = max(self.used - int(nbytes), 0)
+
+    def admits(self, nbytes: int) -> bool:
+        """True if nbytes more are expected to fit below the ceiling"""
+        return self._limit is None or self.used + int(nbytes) <= self._limit
+
+    @property
+    def exceeded(self) -> bool:
+        return self._limit is not None and self.used > self._limit
+
+    @property
+    def peak_mb(self) -> float:
+        return self.peak / 2 ** 20
+
+
+class MemoryGuard:
+    """
+    Memory ceiling of the process, shared by all queries. Queries are checked against the memory available below the
+    ceiling (the ceiling less the resident memory of the process) before they add to it: a query is rejected if no
+    memory is available, its sampling is made coarser if its data points would not fit, and files are skipped if not
+    expected to fit when loaded. A ceiling of None or 0 is never reached. The ceiling is not applied if the resident
+    memory is not available (reported as 0).
+    """
+
+    def __init__(self, limit_mb: float = None, rss=None):
+        """
+        :param limit_mb: Ceiling in MB
+        :param rss: Optional function returning the resident memory of the process in bytes
+        """
+        self.limit_mb = limit_mb
+        self._limit = int(limit_mb * 2 ** 20) if limit_mb else None
+        self._rss = rss or process_rss
+
+        if self._limit is not None and self._rss() == 0:
+            logger.warning(f"Process memory not available, the ceiling of {limit_mb} MB is not applied")
+
+    @property
+    def available(self) -> int:
+        """Memory available below the ceiling in bytes, None if no ceiling"""
+        if self._limit is None:
+            return None
+        rss = self._rss()
+        if rss == 0:
+            return None
+        return max(self._limit - rss, 0)
+
+    def admits(self, nbytes: int) -> bool:
+        """True if nbytes are expected to fit below the ceiling"""
+        available = self.available
+        return available is None or nbytes <= available
+
+    def interval_factor(self, datapoints: int) -> int:
+        """
+        Factor by which to make the sampling intervals of a query coarser, such that the data points fit in their share
+        of the available memory (1 if these fit).
+        """
+        available = self.available
+        if available is None or datapoints == 0:
+            return 1
+        return max(math.ceil(datapoints * DATAPOINT_BYTES / max(available * DATAPOINTS_SHARE, 1)), 1)
+
+
+def process_rss() -> int:
+    """
+    Resident set size of the process in bytes (peak RSS where the current RSS is not available, 0 if neither is, e.g.
+    on Windows)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def decoded_nbytes(decoded: dict) -> int:
+    """Size of decoded signal arrays (as returned by SignalDecoder.decode) in bytes"""
+    return sum(x.nbytes for arrays in decoded.values() for x in arrays if isinstance(x, np.ndarray))
@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bytes read from the start of a log file to extract the header information. If the header can not be parsed from
+# this range (e.g. compressed or encrypted data), the full file is read instead
+HEADER_BYTES = 256 * 1024
+
+# Max number of log files kept in the cache (least recently used are dropped)
+MAX_ENTRIES = 100000
+
+# The persisted cache is compacted (rewritten with the latest entry per log file) when it holds more lines than this
+# factor times the entries
+COMPACT_FACTOR = 2
+
+
+@dataclass
+class LogFileMetadata:
+    """
+    Header information of a log file.
+    """
+    path: str
+    version: str
+    size: int
+    start_epoch_ns: int
+    meta: dict
+
+    def get(self, name: str, default=None):
+        """Get a raw meta data value, e.g. "HDcomment.File Information.session" """
+        return self.meta.get(name, default)
+
+
+class MetadataStore:
+    """
+    Extracts and caches log file header information (first measurement time and HD comment meta data).
+
+    Only the start of each file is fetched, and the extracted fields are cached per path and file version (ETag), such
+    that annotations and file info tables do not need to download full log files. Optionally, the cache is persisted as
+    JSON lines in a file, such that it survives restarts.
+
+    The cache holds at most max_entries log files (least recently used are dropped). New entries are appended to the
+    file, which is compacted to the entries of the cache when loaded and when it holds COMPACT_FACTOR times more lines.
+    """
+
+    def __init__(self, fs, path: str = None, max_workers: int = 8, max_entries: int = MAX_ENTRIES):
+        """
+        :param fs: FS mounted in CANedge "root"
+        :param path: Optional path of file to persist the cache in
+        :param max_workers: Max number of files read in parallel
+        :param max_entries: Max number of log files in the cache
+        """
+        self._fs = fs
+        self._path = path
+        self._max_workers = max_workers
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._lines = 0
+
+        if self._path is not None and os.path.isfile(self._path):
+            self._load()
+            self._compact()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, log_file: str, passwords: dict) -> LogFileMetadata:
+        return self.get_many([log_file], passwords)[0]
+
+    def get_many(self, log_files: [str], passwords: dict) -> [LogFileMetadata]:
+        """
+        Gets the header information of log files. Files not in the cache are read in parallel.
+        Returns a list ordered as the log files, with None for files which could not be read.
+        """
+        if len(log_files) == 0:
+            return []
+
+        # File versions from listings (one request per folder)
+        infos = self._fs.get_file_infos(log_files)
+
+        result = {}
+        missing = []
+        with self._lock:
+            for log_file in log_files:
+                info = infos[log_file]
+                entry = self._entries.get(log_file)
+                if entry is not None and entry.version == self._fs.get_file_version(info):
+                    self._entries.move_to_end(log_file)
+                    result[log_file] = entry
+                else:
+                    missing.append(log_file)
+
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=min(self._max_workers, len(missing))) as executor:
+                entries = list(executor.map(lambda x: self._read(x, infos[x], passwords), missing))
+
+            entries = [x for x in entries if x is not None]
+            with self._lock:
+                for entry in entries:
+                    self._add(entry)
+                    result[entry.path] = entry
+                if self._lines + len(entries) > COMPACT_FACTOR * max(len(self._entries), 1):
+                    self._compact()
+                else:
+                    self._save(entries)
+
+        return [result.get(x) for x in log_files]
+
+    def _read(self, log_file: str, info: dict, passwords: dict):
+        try:
+            try:
+                start_epoch_ns, meta = self._read_header(log_file, passwords, HEADER_BYTES)
+            except Exception:
+                # Header not parsable from the first bytes, read the full file
+                logger.debug(f"File: {log_file} - Reading full file for meta data")
+                start_epoch_ns, meta = self._read_header(log_file, passwords, None)
+        except Exception as e:
+            logger.warning(f"File: {log_file} - Could not extract meta data: {e}")
+            return None
+
+        return LogFileMetadata(path=log_file,
+                               version=self._fs.get_file_version(info),
+                               size=info["size"],
+                               start_epoch_ns=start_epoch_ns,
+                               meta=meta)
+
+    def _read_header(self, log_file: str, passwords: dict, length: int = None) -> (int, dict):
+        with self._fs.open(log_file, "rb", block_size=length or HEADER_BYTES) as handle:
+            data = handle.read(length) if length is not None else handle.read()
+
+        # Imported on first use, such that the store is created without importing pandas
+        import mdf_iter
+        mdf_file = mdf_iter.MdfFile(io.BytesIO(data), passwords=passwords)
+        start_epoch_ns = int(mdf_file.get_first_measurement())
+        meta = {k: v.get("value_raw") for k, v in mdf_file.get_metadata().items()}
+
+        if start_epoch_ns <= 0:
+            raise ValueError("No measurement found")
+
+        return start_epoch_ns, meta
+
+    def _add(self, entry: LogFileMetadata):
+        self._entries[entry.path] = entry
+        self._entries.move_to_end(entry.path)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self):
+        with open(self._path, "r") as fp:
+            for line in fp:
+                try:
+                    self._add(LogFileMetadata(**json.loads(line)))
+                except (ValueError, TypeError):
+                    continue
+        logger.info(f"Loaded meta data of {len(self._entries)} log files")
+
+    def _compact(self):
+        """Rewrites the file with the entries of the cache (the latest entry per log file)"""
+        if self._path is None:
+            return
+        try:
+            with open(self._path + ".tmp", "w") as fp:
+                for entry in self._entries.values():
+                    fp.write(json.dumps(asdict(entry)) + "\n")
+            os.replace(self._path + ".tmp", self._path)
+            self._lines = len(self._entries)
+        except OSError as e:
+            logger.warning(f"Unable to persist meta data: {e}")
+
+    def _save(self, entries: [LogFileMetadata]):
+        if self._path is None or len(entries) == 0:
+            return
+        try:
+            with open(self._path, "a") as fp:
+                for entry in entries:
+                    fp.write(json.dumps(asdict(entry)) + "\n")
+            self._lines += len(entries)
+        except OSError as e:
+            logger.warning(f"Unable to persist meta data: {e}")
@@ -0,0 +1,268 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import Blueprint, Response, has_request_context, request
+from flask_caching.backends import SimpleCache
+from canedge_datasource import profiling
+from canedge_datasource.memory import process_rss
+
+import logging
+logger = logging.getLogger(__name__)
+
+metrics = Blueprint('metrics', __name__)
+
+# Metrics are labelled by device only if enabled, as fleets of thousands of devices multiply the number of series
+_device_labels = False
+
+
+def enable_device_labels(enabled: bool = True):
+    """Enable the device label of the metrics (one series per device). Set at startup, before any values"""
+    global _device_labels
+    _device_labels = enabled
+
+
+class Metric:
+    """
+    A metric with labels, rendered in the Prometheus text format. Values are kept per combination of label values.
+    The device label is only used if enabled (see enable_device_labels).
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names: [str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self._label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    @property
+    def label_names(self) -> tuple:
+        return tuple(x for x in self._label_names if x != "device" or _device_labels)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(x, "")) for x in self.label_names)
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{self._format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: [str] = (), function=None):
+        """
+        :param function: Optional function returning the (unlabelled) value when rendered
+        """
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> [str]:
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logger.debug(f"Metric {self.name} not available: {e}")
+        return super().render()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: [str] = (), buckets: [float] = ()):
+        super().__init__(name, documentation, label_names)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> [str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+# Time per processing stage (listing, fetch, parse, tp, decode, resample, serialize)
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "canedge_stage_seconds", "Time spent per processing stage in seconds", ["stage", "endpoint", "device"],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]))
+
+FETCH_BYTES = REGISTRY.register(Histogram(
+    "canedge_fetch_bytes", "Size of log files fetched in bytes", ["endpoint", "device"],
+    buckets=[2 ** x for x in range(16, 30, 2)]))
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "canedge_cache_requests_total", "Cache lookups per namespace and result (hit, miss)", ["namespace", "result"]))
+
+CACHE_EVICTIONS = REGISTRY.register(Counter(
+    "canedge_cache_evictions_total", "Cache entries evicted per namespace", ["namespace"]))
+
+FILES_SKIPPED = REGISTRY.register(Counter(
+    "canedge_files_skipped_total", "Log files skipped per reason (limit, deadline, memory, process_memory, presence)",
+    ["reason", "device"]))
+
+QUERY_PEAK_MEMORY = REGISTRY.register(Histogram(
+    "canedge_query_peak_memory_bytes", "Peak memory held by a query (frames, decoded data and data points) in bytes",
+    ["endpoint"], buckets=[2 ** x for x in range(20, 34)]))
+
+QUERIES_GUARDED = REGISTRY.register(Counter(
+    "canedge_queries_guarded_total", "Queries rejected or degraded by the process memory ceiling", ["action"]))
+
+QUERY_GATE_USERS = REGISTRY.register(Gauge(
+    "canedge_query_gate_users", "Queries currently admitted by the query gate"))
+
+PROCESS_RSS = REGISTRY.register(Gauge(
+    "process_resident_memory_bytes", "Resident memory size in bytes", function=process_rss))
+
+
+def current_endpoint() -> str:
+    """Path of the request being processed, "background" outside of requests"""
+    return request.path if has_request_context() else "background"
+
+
+@contextmanager
+def timer(stage: str, device: str = ""):
+    """Measures the time of a processing stage (also recorded in the traces of profiled requests)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage, endpoint=current_endpoint(), device=device or "")
+        profiling.record_stage(stage, elapsed)
+
+
+# Cache namespace of the current thread (stack, as cached functions may be nested)
+_namespace = threading.local()
+
+
+@contextmanager
+def cache_namespace(namespace: str):
+    """Attributes the cache lookups and entries of the enclosed (memoized) calls to a namespace"""
+    stack = getattr(_namespace, "stack", None)
+    if stack is None:
+        stack = _namespace.stack = []
+    stack.append(namespace)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def _current_namespace() -> str:
+    stack = getattr(_namespace, "stack", None)
+    return stack[-1] if stack else "other"
+
+
+class InstrumentedSimpleCache(SimpleCache):
+    """
+    SimpleCache counting hits, misses and evictions per namespace (see cache_namespace).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Namespace per key, accessed by the request threads
+        self._namespaces = {}
+        self._namespaces_lock = threading.RLock()
+
+    def get(self, key):
+        found = key in self._cache
+        result = super().get(key)
+
+        # Lookups of the memoize version keys are not counted
+        if not key.endswith("_memver"):
+            hit = found and result is not None
+            with self._namespaces_lock:
+                namespace = self._namespaces.get(key, _current_namespace())
+            CACHE_REQUESTS.inc(namespace=namespace, result="hit" if hit else "miss")
+            profiling.record_cache(namespace, "hit" if hit else "miss")
+        return result
+
+    def set(self, key, value, timeout=None):
+        # Pruning (on set) and the namespace of the key are consistent across threads
+        with self._namespaces_lock:
+            self._namespaces[key] = _current_namespace()
+            return super().set(key, value, timeout)
+
+    def delete(self, key):
+        with self._namespaces_lock:
+            self._namespaces.pop(key, None)
+            return super().delete(key)
+
+    def _prune(self):
+        with self._namespaces_lock:
+            before = set(self._cache.keys())
+            super()._prune()
+            for key in before.difference(self._cache.keys()):
+                CACHE_EVICTIONS.inc(namespace=self._namespaces.pop(key, "other"))
+
+
+@metrics.route('/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Metrics in the Prometheus text format
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,182 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import groupby
+from canedge_datasource.cancel import CancelToken, CancelGroup
+from canedge_datasource.profiling import RequestTrace, active_traces, activate
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PlannerJob:
+    """
+    A single time series request waiting to be processed as part of a batch.
+    """
+    signal_queries: list
+    start_date: datetime
+    stop_date: datetime
+    options: dict
+    cancel: CancelToken = None
+    traces: [RequestTrace] = field(default_factory=list)
+    done: threading.Event = field(default_factory=threading.Event)
+    result: list = None
+    error: Exception = None
+
+    def key(self):
+        return self.start_date, self.stop_date, tuple(sorted(self.options.items()))
+
+
+class QueryPlanner:
+    """
+    Merges concurrent time series requests into as few processing runs as possible.
+
+    Grafana sends one request per panel. The first request admitted opens a short batching window, and requests
+    admitted within the window are collected and processed together. Requests sharing time range and options are
+    merged into a single run, such that each log file is loaded and decoded once for all panels. The results are split
+    and returned to each original request.
+
+    Requests arriving after the window has closed are rejected while the batch is processed (server busy). With a
+    window of 0 ms, only a single request is processed at a time. A request admitted within the window which is
+    submitted after the batch has been taken is processed in a later batch, once the running batch is done (batches are
+    never processed concurrently).
+    """
+
+    def __init__(self, process, window_ms: int = 0):
+        """
+        :param process: Function processing a list of signal queries (signal_queries, start_date, stop_date, **options)
+        :param window_ms: Batching window in ms
+        """
+        self._process = process
+        self._window_s = max(window_ms, 0) / 1000
+        self._lock = threading.Condition()
+        self._users = 0
+        self._opened = 0.0
+        self._batch = None
+        self._running = False
+
+    @property
+    def users(self) -> int:
+        """Number of requests currently admitted"""
+        return self._users
+
+    def try_acquire(self, timeout: float = 0) -> bool:
+        """
+        Admit a request if idle or if the batching window is still open. Optionally wait up to timeout seconds for the
+        server to become idle (e.g. when a superseded query is being cancelled).
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if self._users == 0:
+                    self._opened = now
+                    break
+                elif now - self._opened < self._window_s:
+                    break
+                elif now >= deadline:
+                    return False
+                self._lock.wait(deadline - now)
+            self._users += 1
+            return True
+
+    def release(self):
+        """
+        Release an admitted request.
+        """
+        with self._lock:
+            self._users = max(self._users - 1, 0)
+            self._lock.notify_all()
+
+    def submit(self, signal_queries: list, start_date: datetime, stop_date: datetime, cancel: CancelToken = None,
+               **options) -> list:
+        """
+        Add signal queries to the current batch and wait for the result. The first request of a batch becomes the
+        leader, which waits for the window to close and processes the batch on behalf of all requests.
+
+        A batch is cancelled once all of its requests are cancelled. A cancelled request which is not the leader
+        returns immediately.
+        """
+        job = PlannerJob(signal_queries=signal_queries, start_date=start_date, stop_date=stop_date, options=options,
+                         cancel=cancel, traces=active_traces())
+
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = []
+            self._batch.append(job)
+            window_end = self._opened + self._window_s
+
+        if leader:
+            # Collect requests until the window closes, and until the running batch is done (if submitted late)
+            time.sleep(max(window_end - time.monotonic(), 0))
+            with self._lock:
+                while self._running:
+                    self._lock.wait()
+                batch, self._batch = self._batch, None
+                self._running = True
+            try:
+                self._run(batch)
+            finally:
+                with self._lock:
+                    self._running = False
+                    self._lock.notify_all()
+        else:
+            while not job.done.wait(0.1):
+                if cancel is not None:
+                    cancel.check()
+
+        if job.error is not None:
+            raise job.error
+
+        # The leader may have completed the batch for others after being cancelled itself
+        if cancel is not None:
+            cancel.check()
+
+        return job.result
+
+    def _run(self, batch: [PlannerJob]):
+
+        # Jobs with the same time range and options can be merged into one run
+        batch = sorted(batch, key=lambda x: repr(x.key()))
+        for _, jobs in groupby(batch, lambda x: repr(x.key())):
+
+            jobs = list(jobs)
+            signal_queries = [x for job in jobs for x in job.signal_queries]
+
+            if len(jobs) > 1:
+                logger.info(f"Merged {len(jobs)} requests into one run ({len(signal_queries)} signal queries)")
+
+            # Each request brings its own data budget. As log files are loaded once for all merged requests, the
+            # total amount of data processed never exceeds that of processing the requests one by one. The memory
+            # ceiling bounds the peak memory of a run, and is not scaled
+            options = dict(jobs[0].options)
+            if options.get("limit_mb"):
+                options["limit_mb"] = options["limit_mb"] * len(jobs)
+
+            # The run is cancelled once all requests are abandoned
+            tokens = [job.cancel for job in jobs if job.cancel is not None]
+            if len(tokens) > 0:
+                options["cancel"] = CancelGroup(tokens) if len(tokens) > 1 else tokens[0]
+
+            try:
+                # The work of the run is recorded in the traces of all merged requests (if profiled)
+                with activate([x for job in jobs for x in job.traces]):
+                    result = self._process(signal_queries=signal_queries,
+                                           start_date=jobs[0].start_date,
+                                           stop_date=jobs[0].stop_date,
+                                           **options)
+
+                # The result is ordered as the signal queries. Split it back to the requests
+                offset = 0
+                for job in jobs:
+                    job.result = result[offset:offset + len(job.signal_queries)]
+                    offset += len(job.signal_queries)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            finally:
+                for job in jobs:
+                    job.done.set()
@@ -0,0 +1,210 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from canedge_datasource import signal
+from canedge_datasource.decoder import get_decoder
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface
+from canedge_datasource.memory import MemoryGuard
+from canedge_datasource.metrics import timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Niceness of the pre-decoder threads (where supported)
+NICENESS = 19
+
+# Interval in seconds between checks whether queries are still running, while waiting for these
+BUSY_WAIT_S = 0.1
+
+
+@dataclass
+class PreDecodeTarget:
+    """
+    DB with the signals to pre-decode (None for all signals of the DB).
+    """
+    db: str
+    signals: tuple = None
+
+
+def parse_targets(specs: [str]) -> [PreDecodeTarget]:
+    """Parses pre-decode targets given as a DB name, optionally with signals, e.g. "canmod-gps:Speed,Latitude" """
+    targets = []
+    for spec in specs:
+        db, _, signals = spec.partition(":")
+        signals = tuple(x.strip() for x in signals.split(",") if x.strip() != "")
+        targets.append(PreDecodeTarget(db=db.strip().lower(), signals=signals if len(signals) > 0 else None))
+    return targets
+
+
+class PreDecoder:
+    """
+    Processes newly uploaded log files in the background, such that the first queries of a new period hit warm data.
+
+    New log files are found through incremental listings (only the sessions and splits after the last file seen of each
+    device are listed). Uploaded objects are complete, such that listed files are closed splits. For each new file, the
+    header is read to the meta data store, the CAN IDs are recorded in the presence index, and the signals of the
+    configured DBs are decoded to the decoded cache (per interface and channel).
+
+    Files are processed with a limited number of low priority threads, and processing waits while queries are running,
+    such that the pre-decoder uses spare CPU only. On the first poll, only the most recent files of each device are
+    processed. As for queries, files larger than the data limit or not expected to fit below the process memory ceiling
+    when loaded are skipped (these are decoded by the queries instead).
+    """
+
+    def __init__(self, fs, dbs, targets: [PreDecodeTarget], passwords: dict, metadata, presence, decoded_cache,
+                 interval_s: float = 60, max_workers: int = 1, busy=None, backlog: int = 1, limit_mb: float = None,
+                 memory_guard: MemoryGuard = None):
+        """
+        :param fs: FS mounted in CANedge "root"
+        :param dbs: DBs by name
+        :param targets: DBs and signals to decode
+        :param passwords: Log file passwords
+        :param metadata: MetadataStore to fill
+        :param presence: PresenceIndex to fill
+        :param decoded_cache: DecodedCache to fill
+        :param interval_s: Interval between polls for new files in seconds
+        :param max_workers: Max number of files processed in parallel
+        :param busy: Optional function returning True while queries are running
+        :param backlog: Number of most recent files of each device processed on the first poll
+        :param limit_mb: Optional max size of the files processed in MB
+        :param memory_guard: Optional process memory ceiling, checked before loading each file
+        """
+        self.passwords = passwords
+        self._fs = fs
+        self._dbs = dbs
+        self._targets = targets
+        self._metadata = metadata
+        self._presence = presence
+        self._decoded_cache = decoded_cache
+        self._interval_s = interval_s
+        self._max_workers = max_workers
+        self._busy = busy or (lambda: False)
+        self._backlog = backlog
+        self._limit_mb = limit_mb
+        self._memory_guard = memory_guard
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_seen = {}
+
+    def start(self):
+        """Start polling for new files in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pre-decoder", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        _lower_priority()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Pre-decoding failed: {e}")
+            self._stop.wait(self._interval_s)
+
+    def poll(self) -> int:
+        """Processes the files uploaded since the last poll. Returns the number of files processed"""
+        started = time.time()
+
+        new_files = []
+        for device in self._fs.get_device_ids():
+            new_files.extend((device, x) for x in self._new_files(device))
+
+        if len(new_files) == 0:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="pre-decoder",
+                                initializer=_lower_priority) as executor:
+            processed = sum(executor.map(lambda x: self._process(*x), new_files))
+
+        logger.info(f"Pre-decoded {processed} of {len(new_files)} new files in {time.time() - started:.1f} s")
+        return processed
+
+    def _new_files(self, device: str) -> [str]:
+        """Files of a device after the last file seen, oldest first"""
+        last_seen = self._last_seen.get(device)
+
+        files = []
+        for session, _ in self._fs.get_device_sessions(device, reverse=True):
+            if last_seen is not None and int(session) < last_seen[0]:
+                break
+            for split, log_file in self._fs.get_device_splits(device, session, reverse=True):
+                position = (int(session), int(split))
+                if (last_seen is not None and position <= last_seen) or \
+                        (last_seen is None and len(files) >= self._backlog):
+                    break
+                files.append((position, log_file))
+            if last_seen is None and len(files) >= self._backlog:
+                break
+
+        if len(files) > 0:
+            self._last_seen[device] = max(x[0] for x in files)
+
+        return [x[1] for x in reversed(files)]
+
+    def _process(self, device: str, log_file: str) -> bool:
+
+        # Leave the CPU to queries
+        while self._busy() and not self._stop.is_set():
+            self._stop.wait(BUSY_WAIT_S)
+        if self._stop.is_set():
+            return False
+
+        passwords = self.passwords
+        try:
+            self._metadata.get(log_file, passwords)
+
+            # Skip files exceeding the data limit, or not expected to fit below the process memory ceiling when loaded
+            skip = signal._skip_reason(memory_guard=self._memory_guard, file_size=self._fs.stat(log_file)["size"],
+                                       limit_mb=self._limit_mb)
+            if skip is not None:
+                logger.info(f"File: {log_file} - Not pre-decoded ({skip[1]})")
+                return False
+
+            itf_used = [CanedgeInterface.CAN, CanedgeInterface.LIN]
+            _, frames_can, frames_lin, can_ids = signal.read_log_file(self._fs, log_file, itf_used, passwords)
+            if can_ids is not None and not self._presence.has(device, log_file):
+                self._presence.record(device, log_file, can_ids)
+
+            with timer("predecode", device):
+                for target in self._targets:
+                    db_entry = self._dbs.get(target.db)
+                    if db_entry is None:
+                        continue
+                    self._decode(log_file, db_entry["db"], target.signals, CanedgeInterface.CAN, frames_can)
+                    self._decode(log_file, db_entry["db"], target.signals, CanedgeInterface.LIN, frames_lin)
+        except Exception as e:
+            logger.warning(f"File: {log_file} - Pre-decoding failed: {e}")
+            return False
+
+        logger.debug(f"File: {log_file} - Pre-decoded")
+        return True
+
+    def _decode(self, log_file: str, db, signal_names: tuple, itf: CanedgeInterface, frames):
+        decoder = get_decoder(db, signal_names)
+        frames = frames[decoder.matches(frames)]
+
+        # All channels are cached, such that queries of channels without data are also served from the cache
+        for chn in CanedgeChannel:
+            frames_chn = frames[frames.channel == int(chn)]
+            decoded = decoder.decode(frames_chn) if len(frames_chn) > 0 else {}
+
+            # Copies, such that the cached arrays do not hold on to the larger decoded arrays
+            self._decoded_cache.put(log_file, db, itf, int(chn), decoder.signal_names,
+                                    {k: (v[0].copy(), v[1].copy()) for k, v in decoded.items()})
+
+
+def _lower_priority():
+    """Lowers the scheduling priority of the calling thread (Linux, where priorities are per thread)"""
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICENESS)
+    except OSError as e:
+        logger.debug(f"Unable to lower the pre-decoder priority: {e}")
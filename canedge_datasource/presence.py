@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PresenceIndex:
+    """
+    Keeps track of the CAN frame IDs seen in each log file of a device, recorded as files are loaded.
+
+    Used to limit signal searches to the signals actually logged by a device. Only the most recently recorded files of each
+    device are kept, to bound memory usage.
+    """
+
+    def __init__(self, max_files_per_device: int = 1000):
+        """
+        :param max_files_per_device: Max number of files kept per device
+        """
+        self._max_files = max_files_per_device
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def has(self, device: str, log_file: str) -> bool:
+        """True if the log file has been recorded"""
+        with self._lock:
+            return log_file in self._devices.get(device, {})
+
+    def record(self, device: str, log_file: str, ids):
+        """
+        Record the frame IDs seen in a log file.
+        :param ids: Array of frame IDs (may contain duplicates)
+        """
+        ids = frozenset(np.unique(np.asarray(ids, dtype=np.uint32)).tolist())
+
+        with self._lock:
+            files = self._devices.setdefault(device, OrderedDict())
+            files[log_file] = ids
+            files.move_to_end(log_file)
+            while len(files) > self._max_files:
+                files.popitem(last=False)
+
+    def file_ids(self, device: str, log_file: str) -> frozenset:
+        """Frame IDs seen in a log file, None if the file has not been recorded"""
+        with self._lock:
+            return self._devices.get(device, {}).get(log_file)
+
+    def ids(self, device: str) -> set:
+        """Frame IDs seen in the recorded files of a device, None if no files recorded"""
+        with self._lock:
+            files = self._devices.get(device)
+            if not files:
+                return None
+            return set().union(*files.values())
@@ -0,0 +1,226 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Endpoints which can be profiled
+PROFILED_ENDPOINTS = ["/query", "/annotations", "/search"]
+
+# Request keys which change between otherwise identical requests
+VOLATILE_KEYS = ["requestId", "startTime"]
+
+
+class RequestTrace:
+    """
+    Trace of a request: the time spent in each processing stage, the log files processed or skipped, and the cache
+    lookups. Stages, files and cache lookups are recorded by the code doing the work (see record_stage, record_file and
+    record_cache), for the traces active in the thread.
+    """
+
+    def __init__(self, endpoint: str, request: dict, debug: bool = False):
+        self.endpoint = endpoint
+        self.request = request
+        self.debug = debug
+        self.started = time.time()
+        self.duration_s = None
+        self.profile = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._files = []
+        self._cache = {}
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            count, total = self._stages.get(stage, (0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds)
+
+    def add_file(self, log_file: str, device: str, status: str):
+        with self._lock:
+            self._files.append((log_file, device, status, time.perf_counter()))
+
+    def add_cache(self, namespace: str, result: str):
+        with self._lock:
+            key = f"{namespace}:{result}"
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def finish(self):
+        self.duration_s = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        """
+        The trace as a dict. The time of a file is the time from starting the file to starting the next (or the end).
+        """
+        with self._lock:
+            end = self._start + self.duration_s if self.duration_s is not None else time.perf_counter()
+            files = []
+            for index, (log_file, device, status, start) in enumerate(self._files):
+                stop = self._files[index + 1][3] if index + 1 < len(self._files) else end
+                files.append({"file": log_file, "device": device, "status": status,
+                              "seconds": round(max(stop - start, 0), 6)})
+
+            return {"time": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                    "endpoint": self.endpoint,
+                    "duration_s": None if self.duration_s is None else round(self.duration_s, 6),
+                    "debug": self.debug,
+                    "stages": {k: {"count": c, "seconds": round(s, 6)} for k, (c, s) in sorted(self._stages.items())},
+                    "files": files,
+                    "cache": dict(sorted(self._cache.items())),
+                    "request": self.request}
+
+
+class Profiler:
+    """
+    Opt-in profiling of requests. A request is traced if a slow query threshold is set, or if any of its targets has a
+    debug field (e.g. {"device": "AABBCCDD", ..., "debug": true}).
+
+    Traces of requests taking longer than the threshold, and of debug requests, are written to the slow query log as
+    JSON lines, with the normalized request such that it can be replayed. Debug requests bypass the request caches, and
+    are also profiled with cProfile if a profile directory is set (one .prof file per request).
+    """
+
+    def __init__(self, threshold_s: float = 0, log_path: str = None, profile_dir: str = None):
+        """
+        :param threshold_s: Requests taking longer are logged (0 to only trace debug requests)
+        :param log_path: Path of the slow query log (JSON lines). If None, entries are logged as warnings
+        :param profile_dir: Directory for cProfile dumps of debug requests (None to disable)
+        """
+        self.threshold_s = threshold_s
+        self.log_path = log_path
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self, endpoint: str, request: dict) -> "RequestTrace":
+        """
+        Starts tracing a request in the current thread. Returns the trace, or None if the request is not traced.
+        """
+        if endpoint not in PROFILED_ENDPOINTS:
+            return None
+
+        debug = is_debug_request(request)
+        if not debug and not self.threshold_s:
+            return None
+
+        trace = RequestTrace(endpoint, normalize_request(request), debug=debug)
+        if debug and self.profile_dir is not None:
+            trace.profile = cProfile.Profile()
+            trace.profile.enable()
+
+        _local.traces = [trace]
+        return trace
+
+    def finish(self, trace: RequestTrace, status: int = None):
+        """
+        Stops tracing a request. Writes the trace to the slow query log if slow or requested.
+        """
+        _local.traces = []
+        trace.finish()
+
+        profile_path = None
+        if trace.profile is not None:
+            trace.profile.disable()
+            profile_path = os.path.join(self.profile_dir,
+                                        f"{trace.started:.6f}{trace.endpoint.replace('/', '_')}.prof")
+            try:
+                trace.profile.dump_stats(profile_path)
+            except OSError as e:
+                logger.warning(f"Unable to write profile: {e}")
+                profile_path = None
+
+        slow = bool(self.threshold_s) and trace.duration_s > self.threshold_s
+        if not slow and not trace.debug:
+            return
+
+        entry = trace.to_dict()
+        entry["status"] = status
+        entry["slow"] = slow
+        entry["profile"] = profile_path
+        line = json.dumps(entry, sort_keys=True, default=str)
+
+        if self.log_path is None:
+            logger.warning(f"Slow query: {line}")
+            return
+
+        try:
+            with self._lock, open(self.log_path, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Unable to write slow query log: {e}")
+
+
+# Traces active in the current thread (several when a batch of merged requests is processed)
+_local = threading.local()
+
+
+def active_traces() -> [RequestTrace]:
+    return getattr(_local, "traces", None) or []
+
+
+@contextmanager
+def activate(traces: [RequestTrace]):
+    """Records the work done in the enclosed block for the traces (e.g. of requests processed together)"""
+    previous = active_traces()
+    _local.traces = [x for x in traces if x is not None]
+    try:
+        yield
+    finally:
+        _local.traces = previous
+
+
+def record_stage(stage: str, seconds: float):
+    for trace in active_traces():
+        trace.add_stage(stage, seconds)
+
+
+def record_file(log_file: str, device: str, status: str):
+    for trace in active_traces():
+        trace.add_file(log_file, device, status)
+
+
+def record_cache(namespace: str, result: str):
+    for trace in active_traces():
+        trace.add_cache(namespace, result)
+
+
+def bypass_cache() -> bool:
+    """True if a debug request is traced, such that the request is processed instead of served from a cache"""
+    return any(x.debug for x in active_traces())
+
+
+def is_debug_request(req: dict) -> bool:
+    """True if a target of a /query, /search or /annotations request has a debug field set"""
+    if not isinstance(req, dict):
+        return False
+
+    targets = [x.get("target") for x in req.get("targets", []) if isinstance(x, dict)]
+    targets.append(req.get("target"))
+    if isinstance(req.get("annotation"), dict):
+        targets.append(req["annotation"].get("query"))
+
+    for target in targets:
+        if not isinstance(target, str) or target == "":
+            continue
+        try:
+            target = json.loads(target)
+        except ValueError:
+            continue
+        if isinstance(target, dict) and target.get("debug"):
+            return True
+
+    return False
+
+
+def normalize_request(req) -> dict:
+    """The request without keys changing between identical requests, as replayed from the slow query log"""
+    if not isinstance(req, dict):
+        return req
+    return {k: v for k, v in req.items() if k not in VOLATILE_KEYS}
@@ -1,10 +1,17 @@
 import json
 from datetime import datetime
 from enum import IntEnum, auto
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, g
 from flask import current_app as app
 from canedge_datasource import cache
+from canedge_datasource.cancel import CancelToken, QueryCancelled
+from canedge_datasource.databases import db_versions
+from canedge_datasource.deadline import is_partial
 from canedge_datasource.enums import CanedgeInterface, CanedgeChannel, SampleMethod
+from canedge_datasource.fleet import FleetQuery, fleet_phy_data, parse_aggregate
+from canedge_datasource.geo import GeoQuery, geo_phy_data
+from canedge_datasource.metrics import cache_namespace, timer
+from canedge_datasource.profiling import bypass_cache
 from canedge_datasource.signal import SignalQuery, time_series_phy_data, table_raw_data, table_fs
 from canedge_datasource.time_range import parse_time_range
 
@@ -13,6 +20,9 @@ logger = logging.getLogger(__name__)
 
 query = Blueprint('query', __name__)
 
+# Target fields controlling how a query is processed. Not part of the target name
+TARGET_OPTIONS = ["deadline", "coverage", "debug", "device_limit", "geo", "tolerance"]
+
 
 class RequestType(IntEnum):
     """
@@ -34,11 +44,19 @@ def _json_target_decode(dct):
         dct["method"] = SampleMethod[dct["method"].upper()]
     if "signal" in dct:
         # Grafana json plugin uses (X|Y|Z) to delimit multiple selections. Split to array
-        dct["signal"] = dct["signal"].replace("(", "").replace(")", "").split("|")
+        dct["signal"] = _split_selection(dct["signal"])
+    if "aggregate" in dct:
+        dct["aggregate"] = _split_selection(dct["aggregate"])
     if "type" in dct:
         dct["type"] = RequestType[dct["type"].upper()]
     return dct
 
+def _split_selection(value) -> [str]:
+    """Splits a multiple selection formatted as (X|Y|Z)"""
+    if isinstance(value, list):
+        return [str(x) for x in value]
+    return str(value).replace("(", "").replace(")", "").split("|")
+
 def _json_decode_target(target):
     # Decode target (the query entered by the user formatted as json)
     try:
@@ -50,6 +68,18 @@ def _json_decode_target(target):
     except Exception as e:
         raise
 
+def _target_dbs(req: dict) -> [str]:
+    """Names of the DBs used by the targets of a request"""
+    names = []
+    for elm in req.get("targets", []):
+        try:
+            target_req = json.loads(elm.get("target", ""))
+        except ValueError:
+            continue
+        if isinstance(target_req, dict) and "db" in target_req:
+            names.append(str(target_req["db"]))
+    return names
+
 @query.route('/query', methods=['POST'])
 def query_view():
     """
@@ -93,15 +123,27 @@ def query_view():
 
     The result of multiselect variables is formatted as e.g. "(AccelerationX|AccelerationY|AccelerationZ)"
 
+    A time-series target with an "aggregate" field is a fleet query. The signal is aggregated per interval across the
+    devices matching the device field (a device, wildcards or a multiselect), one series per aggregate (min, max, mean,
+    count or a percentile e.g. p95). The optional "device_limit" field lowers the data limit of each device in MB, e.g.
+    {"device": "*", "itf": "CAN", "chn": "CH1", "db": "j1939", "signal": "EngineCoolantTemp", "aggregate": "(max|p95)"}
+
+    A time-series target with "geo": true returns a track for map panels. The latitude and longitude signals (in that
+    order) are decoded together, aligned and simplified to about maxDataPoints positions, keeping turns and stops. The
+    optional "tolerance" field sets the simplification tolerance in m, e.g.
+    {"device": "AABBCCDD", "itf": "CAN", "chn": "CH2", "db": "canmod-gps", "signal": "(Latitude|Longitude)", "geo": true}
+
     If one panel contains several queries, then these each becomes an element in "targets". Separate panels generate
     separate independent http requests - each with a unique "panelId".
 
     """
 
     # Caching on a request level. Drastically improves performance when the same panel is loaded twice - e.g. when
-    # annotations are enabled/disabled without changing the view.
-    @cache.memoize(timeout=50)
-    def query_cache(req):
+    # annotations are enabled/disabled without changing the view. Partial results (e.g. deadline hit) are not cached
+    # Debug requests (profiled) are always processed. The versions of the DBs used are part of the key, such that
+    # reloading a DB invalidates the results derived from it
+    @cache.memoize(timeout=50, response_filter=lambda x: not is_partial(x), unless=bypass_cache)
+    def query_cache(req, dbs_in):
 
         res = []
 
@@ -127,13 +169,26 @@ def query_view():
     req_in.pop('requestId', None)
     req_in.pop('startTime', None)
 
-    return jsonify(query_cache(req_in))
+    try:
+        with cache_namespace("query"):
+            res = query_cache(req_in, db_versions(app.dbs, _target_dbs(req_in)))
+    except QueryCancelled:
+        # The client is gone or the query has been superseded. Cancelled queries are not cached
+        logger.info("Query cancelled")
+        res = []
+
+    with timer("serialize"):
+        return jsonify(res)
 
 
 def _query_time_series(req: dict, start_date: datetime, stop_date: datetime) -> list:
 
     # Loop all requested targets
     signal_queries = []
+    fleet_queries = []
+    geo_queries = []
+    deadlines = []
+    coverages = []
     for elm in req["targets"]:
 
         # Decode target
@@ -147,34 +202,188 @@ def _query_time_series(req: dict, start_date: datetime, stop_date: datetime) ->
             logger.warning(f"Target missing required fields: {target_req}")
             continue
 
-        # Check that DB is known
-        if target_req["db"] not in app.dbs.keys():
+        # Check that DB is known (loaded on first use)
+        db_entry = app.dbs.get(target_req["db"])
+        if db_entry is None:
             logger.warning(f"Unknown DB: {target_req['db']}")
             continue
 
+        # Per target override of the deadline
+        if "deadline" in target_req:
+            deadlines.append(float(target_req["deadline"]))
+
+        # Per target override of coverage mode (spread the data budget over the time range)
+        coverage = bool(target_req["coverage"]) if "coverage" in target_req else app.coverage
+
+        # Fleet query, aggregating the signals across the devices matching the device field (e.g. "*")
+        if "aggregate" in target_req:
+            # Per target data limit of each device (in MB), at most the server limit
+            device_limit_mb = min(float(target_req["device_limit"]), app.limit_mb) \
+                if "device_limit" in target_req else None
+            fleet_queries.extend(_fleet_queries(elm["refId"], target_req, db_entry["db"], int(req["intervalMs"]),
+                                                device_limit_mb))
+            continue
+
+        # Geo query, the latitude and longitude signals decoded together to a track simplified for map panels
+        if target_req.get("geo"):
+            geo_query = _geo_query(elm["refId"], target_req, db_entry["db"], req.get("maxDataPoints"))
+            if geo_query is not None:
+                geo_queries.append(geo_query)
+            continue
+
         # If multiple signals in request, add each as signal query
         for signal in target_req["signal"]:
             # Provide a readable unique target name (the list of signals is replaced by the specific signal)
-            target_name = ":".join([str(x) for x in dict(target_req, signal=signal).values()])
+            target_name = ":".join([str(v) for k, v in dict(target_req, signal=signal).items()
+                                    if k not in TARGET_OPTIONS])
 
             signal_queries.append(SignalQuery(refid=elm["refId"],
                                               target=target_name,
                                               device=target_req["device"],
                                               itf=target_req["itf"],
                                               chn=target_req["chn"],
-                                              db=app.dbs[target_req["db"]]["db"],
+                                              db=db_entry["db"],
                                               signal_name=signal,
                                               interval_ms=int(req["intervalMs"]),
                                               method=target_req.get("method", SampleMethod.NEAREST)))
+            coverages.append(coverage)
+
+    # Get signals. Concurrent panel queries are merged by the planner, such that log files are only loaded once
+    # The tightest deadline of the targets applies to the request, otherwise the default deadline
+    deadline_s = min(deadlines) if len(deadlines) > 0 else app.deadline_s
+
+    res = []
+    if len(signal_queries) > 0 or len(fleet_queries) + len(geo_queries) == 0:
+        # The signal queries of each coverage mode are processed in separate runs. If mixed, the data limit is shared
+        # in proportion to the number of signal queries. The result is ordered as the signal queries
+        modes = sorted(set(coverages)) or [app.coverage]
+        results = {}
+        for coverage in modes:
+            indices = [i for i, x in enumerate(coverages) if x == coverage]
+            share = len(indices) / len(signal_queries) if len(modes) > 1 else 1
+
+            # In coverage mode, the number of data points limits the number of files to process
+            max_data_points = int(req["maxDataPoints"]) if coverage and "maxDataPoints" in req else None
+
+            run = app.planner.submit([signal_queries[i] for i in indices], start_date, stop_date,
+                                     cancel=g.get("cancel_token"), limit_mb=round(app.limit_mb * share, 1),
+                                     deadline_s=deadline_s, coverage=coverage, max_data_points=max_data_points,
+                                     chunk_rows=app.chunk_rows, max_query_mb=app.max_query_mb)
+            results.update(zip(indices, run))
+        res = [results[i] for i in range(len(signal_queries))]
+
+    # Fleet queries fan out across devices on their own, each device with its own data limit and all sharing the memory
+    # ceiling of the query
+    if len(fleet_queries) > 0:
+        res = res + fleet_phy_data(fs=app.fs,
+                                   fleet_queries=fleet_queries,
+                                   start_date=start_date,
+                                   stop_date=stop_date,
+                                   limit_mb=app.limit_mb,
+                                   passwords=app.passwords,
+                                   max_workers=app.fleet_workers,
+                                   cancel=g.get("cancel_token"),
+                                   deadline_s=deadline_s,
+                                   max_data_points=int(req["maxDataPoints"]) if "maxDataPoints" in req else None,
+                                   presence=app.presence,
+                                   chunk_rows=app.chunk_rows,
+                                   memory_guard=app.memory_guard,
+                                   decoded_cache=app.decoded_cache,
+                                   max_query_mb=app.max_query_mb)
+
+    if len(geo_queries) > 0:
+        res = res + geo_phy_data(fs=app.fs,
+                                 geo_queries=geo_queries,
+                                 start_date=start_date,
+                                 stop_date=stop_date,
+                                 limit_mb=app.limit_mb,
+                                 passwords=app.passwords,
+                                 cancel=g.get("cancel_token"),
+                                 deadline_s=deadline_s,
+                                 presence=app.presence,
+                                 chunk_rows=app.chunk_rows,
+                                 memory_guard=app.memory_guard,
+                                 decoded_cache=app.decoded_cache,
+                                 max_query_mb=app.max_query_mb)
+
+    return res
+
 
-    # Get signals
+def _geo_query(refid: str, target_req: dict, db, max_data_points) -> GeoQuery:
+    """Geo query of a target, with the latitude and longitude signals (in that order)"""
+    if len(target_req["signal"]) != 2:
+        logger.warning(f"Geo query requires a latitude and a longitude signal: {target_req['signal']}")
+        return None
+
+    targets = tuple(":".join([str(v) for k, v in dict(target_req, signal=signal).items() if k not in TARGET_OPTIONS])
+                    for signal in target_req["signal"])
+    return GeoQuery(refid=refid,
+                    targets=targets,
+                    device=target_req["device"],
+                    itf=target_req["itf"],
+                    chn=target_req["chn"],
+                    db=db,
+                    latitude=target_req["signal"][0],
+                    longitude=target_req["signal"][1],
+                    max_data_points=int(max_data_points) if max_data_points else None,
+                    tolerance_m=float(target_req["tolerance"]) if "tolerance" in target_req else None)
+
+
+def _fleet_queries(refid: str, target_req: dict, db, interval_ms: int, limit_mb: float = None) -> [FleetQuery]:
+    """Fleet queries of a target, one per signal (with one series per aggregate)"""
+    aggregates = []
+    for aggregate in target_req["aggregate"]:
+        try:
+            aggregates.append(parse_aggregate(aggregate))
+        except ValueError as e:
+            logger.warning(e)
+
+    fleet_queries = []
+    for signal in target_req["signal"]:
+        targets = tuple(":".join([str(v) for k, v in dict(target_req, signal=signal, aggregate=aggregate).items()
+                                  if k not in TARGET_OPTIONS]) for aggregate in aggregates)
+        fleet_queries.append(FleetQuery(refid=refid,
+                                        targets=targets,
+                                        devices=tuple(_split_selection(target_req["device"])),
+                                        itf=target_req["itf"],
+                                        chn=target_req["chn"],
+                                        db=db,
+                                        signal_name=signal,
+                                        interval_ms=interval_ms,
+                                        aggregates=tuple(aggregates),
+                                        limit_mb=limit_mb))
+    return fleet_queries
+
+
+def process_signal_queries(signal_queries: [SignalQuery], start_date: datetime, stop_date: datetime,
+                           limit_mb: int, deadline_s: float = None, coverage: bool = False,
+                           max_data_points: int = None, chunk_rows: int = None, max_query_mb: float = None,
+                           cancel: CancelToken = None) -> list:
+    """
+    Processes a (merged) list of signal queries. Called by the query planner.
+    """
     return time_series_phy_data(fs=app.fs,
                                 signal_queries=signal_queries,
                                 start_date=start_date,
                                 stop_date=stop_date,
-                                limit_mb=app.limit_mb,
+                                limit_mb=limit_mb,
                                 passwords=app.passwords,
-                                tp_type=app.tp_type)
+                                tp_type=app.tp_type,
+                                cancel=cancel,
+                                deadline_s=deadline_s,
+                                coverage=coverage,
+                                max_data_points=max_data_points,
+                                presence=app.presence,
+                                chunk_rows=chunk_rows,
+                                max_query_mb=max_query_mb,
+                                memory_guard=app.memory_guard,
+                                decoded_cache=app.decoded_cache)
+
+def _parse_ids(ids) -> [int]:
+    """Parse IDs from a list or comma separated string (decimal or 0x prefixed hex). Raises ValueError if malformed"""
+    ids = ids if isinstance(ids, list) else str(ids).split(",")
+    return [int(str(x).strip(), 0) for x in ids]
+
 
 def _query_table(req: dict, start_date: datetime, stop_date: datetime) -> list:
 
@@ -198,15 +407,30 @@ def _query_table(req: dict, start_date: datetime, stop_date: datetime) -> list:
         request_type = target_req.get("type", RequestType.DATA)
 
         if request_type is RequestType.DATA:
+
+            # IDs to filter by. No data is returned for malformed IDs
+            try:
+                ids = _parse_ids(target_req["id"]) if "id" in target_req else None
+            except ValueError:
+                logger.warning(f"Malformed IDs: {target_req['id']}")
+                return res
+
             res = table_raw_data(fs=app.fs,
                              device=target_req["device"],
                              start_date=start_date,
                              stop_date=stop_date,
                              max_data_points=req["maxDataPoints"],
-                             passwords=app.passwords)
+                             passwords=app.passwords,
+                             cancel=g.get("cancel_token"),
+                             presence=app.presence,
+                             cursor=target_req.get("cursor"),
+                             ids=ids,
+                             chn=target_req.get("chn"),
+                             itf=target_req.get("itf"))
 
         elif request_type is RequestType.INFO:
             res = table_fs(fs=app.fs,
+                           metadata=app.metadata,
                            device=target_req["device"],
                            start_date=start_date,
                            stop_date=stop_date,
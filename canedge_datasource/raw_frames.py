@@ -0,0 +1,201 @@
+from dataclasses import dataclass, fields
+import numpy as np
+import pandas as pd
+from canedge_datasource.signal_index import calculate_pgn, calculate_pgns
+
+
+def payload_matrix(payloads) -> (np.ndarray, np.ndarray):
+    """
+    Packs payloads (sequences of bytes of varying length) into a zero-padded uint8 matrix of shape (N, max length).
+    Returns the matrix and the payload lengths.
+    """
+    lengths = np.fromiter((len(x) for x in payloads), dtype=np.uint16, count=len(payloads))
+    width = int(lengths.max()) if len(lengths) > 0 else 0
+
+    matrix = np.zeros((len(payloads), width), dtype=np.uint8)
+    if width > 0:
+        valid = np.arange(width) < lengths[:, None]
+        matrix[valid] = np.concatenate([np.asarray(x, dtype=np.uint8) for x in payloads])
+
+    return matrix, lengths
+
+
+@dataclass
+class RawFrames:
+    """
+    Raw bus frames as contiguous NumPy columns, as an alternative to the mdf_iter data frames carrying the payload of
+    each frame as a Python object.
+
+    The payloads are held in a zero-padded uint8 matrix, which is as wide as the longest payload (at most 64 bytes for
+    CAN FD), with the payload length of each frame in a separate column. Slicing (e.g. selecting a time interval) returns
+    views without copying data. Filtering with a mask copies the selected rows of the compact columns only.
+
+    Frames are converted to the mdf_iter data frame layout (to_data_frame) where a data frame is needed, e.g. for the
+    TP decoder.
+    """
+    timestamp: np.ndarray   # int64, ns since epoch (UTC)
+    id: np.ndarray          # uint32
+    channel: np.ndarray     # uint8
+    ide: np.ndarray         # uint8
+    dlc: np.ndarray         # uint8
+    length: np.ndarray      # uint16, payload length in bytes (reassembled TP payloads may exceed 64 bytes)
+    data: np.ndarray        # uint8, (N, max payload length)
+
+    @classmethod
+    def empty(cls) -> "RawFrames":
+        return cls(timestamp=np.zeros(0, dtype=np.int64),
+                   id=np.zeros(0, dtype=np.uint32),
+                   channel=np.zeros(0, dtype=np.uint8),
+                   ide=np.zeros(0, dtype=np.uint8),
+                   dlc=np.zeros(0, dtype=np.uint8),
+                   length=np.zeros(0, dtype=np.uint16),
+                   data=np.zeros((0, 0), dtype=np.uint8))
+
+    @classmethod
+    def from_data_frame(cls, df: pd.DataFrame, chunk_rows: int = None) -> "RawFrames":
+        """
+        Create from a mdf_iter CAN or LIN data frame (TimeStamp index). Frames are ordered by time.
+
+        With chunk_rows, the rows are converted in chunks, which bounds the temporary memory used to pack the payloads.
+        """
+        if len(df) == 0:
+            return cls.empty()
+
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind="stable")
+
+        if chunk_rows and len(df) > chunk_rows:
+            return cls.concat([cls.from_data_frame(df.iloc[x:x + chunk_rows]) for x in range(0, len(df), chunk_rows)])
+
+        data, length = payload_matrix(df["DataBytes"].values)
+
+        return cls(timestamp=_to_epoch_ns(df.index),
+                   id=df["ID"].values.astype(np.uint32),
+                   channel=df["BusChannel"].values.astype(np.uint8),
+                   ide=df["IDE"].values.astype(np.uint8) if "IDE" in df else np.zeros(len(df), dtype=np.uint8),
+                   dlc=df["DLC"].values.astype(np.uint8) if "DLC" in df else length.astype(np.uint8),
+                   length=length,
+                   data=data)
+
+    @classmethod
+    def concat(cls, parts: ["RawFrames"]) -> "RawFrames":
+        """
+        Concatenate frames. The payload matrices are padded to the widest.
+        """
+        parts = [x for x in parts if len(x) > 0]
+        if len(parts) == 0:
+            return cls.empty()
+        elif len(parts) == 1:
+            return parts[0]
+
+        data = np.zeros((sum(len(x) for x in parts), max(x.data.shape[1] for x in parts)), dtype=np.uint8)
+        offset = 0
+        for part in parts:
+            data[offset:offset + len(part), :part.data.shape[1]] = part.data
+            offset += len(part)
+
+        columns = {x.name: np.concatenate([getattr(part, x.name) for part in parts]) for x in fields(cls)
+                   if x.name != "data"}
+        return cls(data=data, **columns)
+
+    def to_data_frame(self) -> pd.DataFrame:
+        """
+        Convert to the mdf_iter data frame layout (UTC TimeStamp index, DataBytes as lists of payload bytes).
+        """
+        data_bytes = [None] * len(self)
+        for length in np.unique(self.length):
+            indices = np.flatnonzero(self.length == length)
+            for index, payload in zip(indices.tolist(), self.data[indices, :length].tolist()):
+                data_bytes[index] = payload
+
+        index = pd.DatetimeIndex(self.timestamp.astype("datetime64[ns]"), name="TimeStamp").tz_localize("UTC")
+
+        return pd.DataFrame({"BusChannel": self.channel,
+                             "ID": self.id,
+                             "IDE": self.ide,
+                             "DLC": self.dlc,
+                             "DataLength": self.length,
+                             "DataBytes": data_bytes}, index=index)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, key) -> "RawFrames":
+        """Select frames by slice (view) or by boolean mask / indices (copy)"""
+        return RawFrames(**{x.name: getattr(self, x.name)[key] for x in fields(self)})
+
+    def between(self, start_ns: int, stop_ns: int) -> "RawFrames":
+        """Frames within a time interval (inclusive), as a view"""
+        first = np.searchsorted(self.timestamp, start_ns, side="left")
+        last = np.searchsorted(self.timestamp, stop_ns, side="right")
+        return self[first:last]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the columns in bytes"""
+        return sum(getattr(self, x.name).nbytes for x in fields(self))
+
+
+@dataclass(frozen=True)
+class FramePredicate:
+    """
+    Selection of frames applied when a log file is loaded, such that only the selected frames are converted to RawFrames
+    (time to load tracks the selected traffic rather than the total bus load).
+
+    Frames are selected by channel, by time window and by ID or J1939 PGN (frames matching either the IDs or the PGNs
+    are selected). Criteria set to None select all frames. IDs are compared without the extended bit (bit 32).
+    The fields are tuples, such that a predicate can be part of a cache key.
+    """
+    channels: tuple = None
+    ids: tuple = None
+    pgns: tuple = None
+    start_ns: int = None
+    stop_ns: int = None
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        """Mask of the rows of a mdf_iter data frame matching the predicate"""
+        mask = np.ones(len(df), dtype=bool)
+        if len(df) == 0:
+            return mask
+
+        if self.start_ns is not None or self.stop_ns is not None:
+            timestamps = _to_epoch_ns(df.index)
+            if self.start_ns is not None:
+                mask &= timestamps >= self.start_ns
+            if self.stop_ns is not None:
+                mask &= timestamps <= self.stop_ns
+
+        if self.channels is not None:
+            mask &= np.isin(df["BusChannel"].values, self.channels)
+
+        if self.ids is not None or self.pgns is not None:
+            ids = df["ID"].values.astype(np.uint32)
+            mask_ids = np.zeros(len(df), dtype=bool)
+            if self.ids is not None:
+                mask_ids |= np.isin(ids & np.uint32(0x7FFFFFFF), self.ids)
+            if self.pgns is not None and "IDE" in df:
+                mask_ids |= np.isin(calculate_pgns(ids, df["IDE"].values.astype(np.uint8)), self.pgns)
+            mask &= mask_ids
+
+        return mask
+
+    def matches_ids(self, ids) -> bool:
+        """True if any of the frame IDs (e.g. seen in a log file) may be selected"""
+        if self.ids is None and self.pgns is None:
+            return True
+        if self.ids is not None and not set(self.ids).isdisjoint(x & 0x7FFFFFFF for x in ids):
+            return True
+        # Presence records do not carry IDE. IDs above 11 bits are taken as extended
+        return self.pgns is not None and not set(self.pgns).isdisjoint(calculate_pgn(x) for x in ids if x > 0x7FF)
+
+
+def to_epoch_ns(value) -> int:
+    """Convert a (timezone aware) datetime to ns since epoch"""
+    return pd.Timestamp(value).value
+
+
+def _to_epoch_ns(index: pd.DatetimeIndex) -> np.ndarray:
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.values.astype("datetime64[ns]").view(np.int64)
+
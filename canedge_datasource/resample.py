@@ -0,0 +1,151 @@
+import numpy as np
+from canedge_datasource.enums import SampleMethod
+
+# ns per day, for aligning buckets to the start of the day (as pandas)
+_DAY_NS = 24 * 3600 * 10 ** 9
+
+
+class SignalResampler:
+    """
+    Incremental resampling of a signal, fed with consecutive chunks of (timestamps, values) ordered by time.
+
+    Picks the min, max or nearest value of each interval, equivalent to resampling the concatenated chunks with pandas
+    (resample().min(), max() or nearest() on the values and original timestamps, dropping duplicated timestamps and
+    NaN values). As pandas, the min / max of an interval is reported with the first / last timestamp of the interval.
+
+    Only real data points are returned (no interpolations), and data is never up-sampled. Points are returned as soon as
+    they are final. The last interval is held back until more data arrives or the resampler is flushed.
+    """
+
+    def __init__(self, interval_ms: int, method: SampleMethod, origin_ns: int = None):
+        """
+        :param interval_ms: Resampling interval in ms
+        :param method: SampleMethod
+        :param origin_ns: Alignment of the intervals in ns since epoch. If None, the start of the day of the first
+                          timestamp (UTC)
+        """
+        self.interval_ns = int(interval_ms) * 10 ** 6
+        self.method = method
+        self.origin_ns = origin_ns
+        self._origin = origin_ns
+
+        # Min / max: the pending (last) interval as (bucket, first timestamp, last timestamp, value)
+        self._pending = None
+
+        # Nearest: last sample seen, next bucket without output and last timestamp output
+        self._last = None
+        self._next_bucket = None
+        self._last_output = None
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray) -> (list, list):
+        """
+        Add a chunk of samples (timestamps in ns since epoch). Returns the final points as lists of timestamps (ms since
+        epoch) and values.
+        """
+        if len(timestamps) == 0:
+            return [], []
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        if self._origin is None:
+            self._origin = int(timestamps[0]) - int(timestamps[0]) % _DAY_NS
+
+        if self.method in (SampleMethod.MIN, SampleMethod.MAX):
+            out_timestamps, out_values = self._add_min_max(timestamps, values)
+        else:
+            out_timestamps, out_values = self._add_nearest(timestamps, values)
+
+        return self._output(out_timestamps, out_values)
+
+    def flush(self) -> (list, list):
+        """
+        Returns the points held back, and resets the resampler (e.g. at the end of a continuous segment).
+        """
+        out_timestamps, out_values = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if self._pending is not None:
+            _, first, last, value = self._pending
+            out_timestamps = np.array([first if self.method == SampleMethod.MIN else last], dtype=np.int64)
+            out_values = np.array([value], dtype=np.float64)
+
+        result = self._output(out_timestamps, out_values)
+
+        self._origin = self.origin_ns
+        self._pending = None
+        self._last = None
+        self._next_bucket = None
+        self._last_output = None
+
+        return result
+
+    @property
+    def pending(self) -> bool:
+        """True if points are held back"""
+        return self._pending is not None
+
+    def _buckets(self, timestamps: np.ndarray) -> np.ndarray:
+        return (timestamps - self._origin) // self.interval_ns
+
+    def _add_min_max(self, timestamps: np.ndarray, values: np.ndarray) -> (np.ndarray, np.ndarray):
+        buckets = self._buckets(timestamps)
+        unique_buckets, starts = np.unique(buckets, return_index=True)
+        ends = np.append(starts[1:], len(timestamps))
+
+        # NaN values are ignored, unless all values of an interval are NaN
+        reduce = np.fmin if self.method == SampleMethod.MIN else np.fmax
+        bucket_values = reduce.reduceat(values, starts)
+        bucket_first = timestamps[starts]
+        bucket_last = timestamps[ends - 1]
+
+        # Merge with the pending interval of the previous chunk
+        if self._pending is not None:
+            bucket, first, last, value = self._pending
+            if bucket == unique_buckets[0]:
+                bucket_values[0] = reduce(value, bucket_values[0])
+                bucket_first[0] = first
+            else:
+                unique_buckets = np.insert(unique_buckets, 0, bucket)
+                bucket_values = np.insert(bucket_values, 0, value)
+                bucket_first = np.insert(bucket_first, 0, first)
+                bucket_last = np.insert(bucket_last, 0, last)
+
+        # The last interval may continue in the next chunk
+        self._pending = (unique_buckets[-1], bucket_first[-1], bucket_last[-1], bucket_values[-1])
+
+        out_timestamps = bucket_first[:-1] if self.method == SampleMethod.MIN else bucket_last[:-1]
+        return out_timestamps, bucket_values[:-1]
+
+    def _add_nearest(self, timestamps: np.ndarray, values: np.ndarray) -> (np.ndarray, np.ndarray):
+
+        # The last sample of the previous chunk may be the nearest of the first intervals
+        if self._last is not None:
+            timestamps = np.insert(timestamps, 0, self._last[0])
+            values = np.insert(values, 0, self._last[1])
+
+        first_bucket = self._buckets(timestamps[:1])[0] if self._next_bucket is None else self._next_bucket
+        last_bucket = self._buckets(timestamps[-1:])[0]
+        self._last = (timestamps[-1], values[-1])
+        self._next_bucket = last_bucket + 1
+
+        # Nearest sample of the start of each interval (up to the last sample). Ties go to the later sample (as pandas)
+        labels = self._origin + np.arange(first_bucket, last_bucket + 1, dtype=np.int64) * self.interval_ns
+        right = np.searchsorted(timestamps, labels, side="left")
+        left = np.searchsorted(timestamps, labels, side="right") - 1
+        use_left = (left >= 0) & ((labels - timestamps[np.maximum(left, 0)]) < (timestamps[right] - labels))
+        picked = np.where(use_left, left, right)
+
+        # Drop consecutive picks of the same sample (including the last pick of the previous chunk)
+        out_timestamps = timestamps[picked]
+        keep = np.ones(len(picked), dtype=bool)
+        keep[1:] = out_timestamps[1:] != out_timestamps[:-1]
+        if self._last_output is not None and len(picked) > 0:
+            keep[0] = out_timestamps[0] != self._last_output
+        if len(picked) > 0:
+            self._last_output = out_timestamps[-1]
+
+        return out_timestamps[keep], values[picked][keep]
+
+    @staticmethod
+    def _output(timestamps: np.ndarray, values: np.ndarray) -> (list, list):
+        valid = ~np.isnan(values)
+        return (timestamps[valid] / 10 ** 6).tolist(), values[valid].tolist()
@@ -1,9 +1,13 @@
 import json
-import mdf_iter
+from datetime import datetime, timezone
 from flask import Blueprint, jsonify, request
 from flask import current_app as app
 from canedge_datasource import cache
+from canedge_datasource.databases import db_versions
+from canedge_datasource.metrics import cache_namespace, timer
+from canedge_datasource.profiling import bypass_cache
 from canedge_datasource.enums import CanedgeInterface, CanedgeChannel, SampleMethod
+from canedge_datasource.signal_index import SignalIndex, DEFAULT_LIMIT
 
 import logging
 logger = logging.getLogger(__name__)
@@ -19,21 +23,12 @@ def search_view():
     """
 
     # Caching. Search calls are repeated each time a panel is loaded. Caching reduces communication with the backend
-    @cache.memoize(timeout=50)
-    def search_cache(req):
-
-        def get_logfile_comment(log_file):
-            comment = ""
-            with app.fs.open(log_file, "rb") as handle:
-                try:
-                    meta_data = mdf_iter.MdfFile(handle, passwords=app.passwords).get_metadata()
-                    comment = meta_data.get("HDcomment.File Information.comment", {}).get("value_raw").strip()
-                except:
-                    logger.warning("Could not extract meta data from log file")
-                    pass
-            return comment
+    # The versions of the DBs searched are part of the key, such that reloading a DB invalidates its searches
+    @cache.memoize(timeout=50, unless=bypass_cache)
+    def search_cache(req, dbs_in):
 
         res = []
+        headers = {}
 
         target = req.get("target", "")
         try:
@@ -47,21 +42,16 @@ def search_view():
                 # Return list of devices
                 res = list(app.fs.get_device_ids())
             elif req["search"] == "device_name":
-                # Return list of device ids and meta comments (slow)
-                for device in app.fs.get_device_ids():
-                    # Get most recent log file
-                    try:
-                        log_file, _, _ = next(app.fs.get_device_log_files(device=device, reverse=True), None)
-                        # Get log file comment
-                        if log_file is not None:
-                            comment = " " + get_logfile_comment(log_file)
-                        else:
-                            comment = ""
-                    except:
-                        print(f"Unable to list log files for {device} - review folder structure and log file names")
-                        comment = ""
-
-                    res.append({"text": f"{device}{comment}", "value": device})
+                # Return list of device ids and meta comments, served from the device catalog
+                if app.catalog.updated is not None:
+                    for entry in app.catalog.entries():
+                        comment = f" {entry.comment}" if entry.comment else ""
+                        res.append({"text": f"{entry.device}{comment}", "value": entry.device})
+                    headers["X-Catalog-Updated"] = datetime.fromtimestamp(app.catalog.updated, timezone.utc).isoformat()
+                else:
+                    # Catalog not ready yet, return device ids only
+                    logger.info("Device catalog not ready, returning device ids without comments")
+                    res = [{"text": device, "value": device} for device in app.fs.get_device_ids()]
             elif req["search"] == "itf":
                 # Return list of interfaces
                 res = [x.name for x in CanedgeInterface]
@@ -75,19 +65,84 @@ def search_view():
                 # Return list of sampling methods
                 res = [x.name for x in SampleMethod]
             elif req["search"] == "signal" and "db" in req:
-                # Return list of signals in db
-                db_name = req["db"].lower()
-                if db_name in app.dbs.keys():
-                    res = app.dbs[db_name]["signals"]
+                # Return list of signals in db, optionally matching a query and filtered by frame ID, PGN or device
+                db_entry = app.dbs.get(req["db"].lower())
+                if db_entry is not None:
+                    res, next_cursor = _search_signals(db_entry, req)
+                    if next_cursor is not None:
+                        headers["X-Next-Cursor"] = str(next_cursor)
             else:
                 logger.warning(f"Unknown search: {req}")
 
-        return jsonify(res)
+        with timer("serialize"):
+            return jsonify(res), headers
 
     try:
-        res = search_cache(request.get_json())
+        with cache_namespace("search"):
+            req_in = request.get_json()
+            res = search_cache(req_in, db_versions(app.dbs, _searched_dbs(req_in)))
     except Exception as e:
         logger.warning(f"Failed to search: {e}")
         res = jsonify([])
     finally:
         return res
+
+
+def _searched_dbs(req: dict) -> [str]:
+    """Names of the DBs a search depends on (all DBs for the list of DBs)"""
+    try:
+        req = json.loads(req.get("target", ""))
+    except ValueError:
+        return []
+    if not isinstance(req, dict):
+        return []
+    if req.get("search") == "db":
+        return list(app.dbs.keys())
+    if req.get("search") == "signal" and "db" in req:
+        return [str(req["db"]).lower()]
+    return []
+
+
+def _search_signals(db_entry: dict, req: dict):
+    """
+    {"search": "signal", "db": [DB], "query": [TEXT], "match": [prefix|substring|fuzzy], "limit": [N],
+     "cursor": [CURSOR], "frame": [ID(s)], "pgn": [PGN(s)], "device": [DEVICE]}
+
+    Returns a list of signal names (at most DEFAULT_LIMIT if no limit is requested), and the cursor of the next page
+    (None if no more signals). If a cursor is requested, the list is returned as {"signals": [...], "cursor": [NEXT
+    CURSOR]}, where the next cursor is null when there are no more signals. Truncated plain listings (e.g. of Grafana
+    variables) are logged, and the next cursor is returned in the X-Next-Cursor header.
+    """
+
+    def parse_ints(value):
+        values = value if isinstance(value, list) else str(value).split(",")
+        return [int(str(x).strip(), 0) for x in values]
+
+    # Index built once per DB
+    if "index" not in db_entry:
+        db_entry["index"] = SignalIndex(db_entry["db"])
+    index = db_entry["index"]
+
+    seen_ids = None
+    if "device" in req:
+        seen_ids = app.presence.ids(req["device"])
+        if seen_ids is None:
+            logger.info(f"No IDs recorded for device {req['device']}, not filtering signals by device")
+
+    limit = int(req.get("limit", DEFAULT_LIMIT))
+    signals, cursor = index.search(query=req.get("query", ""),
+                                   match=req.get("match", "substring"),
+                                   limit=limit,
+                                   cursor=int(req.get("cursor") or 0),
+                                   frame_ids=parse_ints(req["frame"]) if "frame" in req else None,
+                                   pgns=parse_ints(req["pgn"]) if "pgn" in req else None,
+                                   seen_ids=seen_ids)
+
+    if "cursor" in req:
+        return {"signals": signals, "cursor": None if cursor is None else str(cursor)}, cursor
+
+    if cursor is not None:
+        logger.warning(f"Signals of {req['db']} truncated to the first {limit}. Search with a query, a device or a "
+                       f"cursor to get the others")
+
+    return signals, cursor
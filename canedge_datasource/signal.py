@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from can_decoder import SignalDB
 from itertools import groupby
 import numpy as np
@@ -10,11 +10,26 @@ from datetime import datetime
 from utils import MultiFrameDecoder
 
 from canedge_datasource import cache
+from canedge_datasource.cancel import CancelToken
+from canedge_datasource.deadline import Deadline, add_notice, format_ranges
+from canedge_datasource.coverage import select_files, get_file_sizes
+from canedge_datasource.presence import PresenceIndex
+from canedge_datasource.raw_frames import RawFrames, FramePredicate, to_epoch_ns
+from canedge_datasource.decoded import DecodedCache
+from canedge_datasource.decoder import get_decoder
+from canedge_datasource.memory import MemoryBudget, MemoryGuard, DATAPOINT_BYTES, LOAD_EXPANSION, decoded_nbytes
+from canedge_datasource.resample import SignalResampler
+from canedge_datasource.metrics import FETCH_BYTES, FILES_SKIPPED, QUERIES_GUARDED, QUERY_PEAK_MEMORY, \
+    cache_namespace, current_endpoint, timer
+from canedge_datasource.profiling import record_file
 from canedge_datasource.enums import CanedgeInterface, CanedgeChannel, SampleMethod
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Rows of the mdf_iter data frames converted to RawFrames at a time
+CONVERT_CHUNK_ROWS = 2 ** 18
+
 
 @dataclass
 class SignalQuery:
@@ -34,7 +49,7 @@ class SignalQuery:
     method: SampleMethod = SampleMethod.NEAREST
 
 
-def table_fs(fs, device, start_date: datetime, stop_date: datetime, max_data_points, passwords) -> list:
+def table_fs(fs, metadata, device, start_date: datetime, stop_date: datetime, max_data_points, passwords) -> list:
     """
     Returns a list of log files as table
     """
@@ -43,25 +58,28 @@ def table_fs(fs, device, start_date: datetime, stop_date: datetime, max_data_poi
     log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
                                               passwords=passwords)
 
+    # Get log file header information (read in parallel and cached)
+    log_files = log_files[:max_data_points]
+    meta_data_list = metadata.get_many(log_files, passwords)
+
     rows = []
-    for log_file in log_files:
+    for log_file, meta_data in zip(log_files, meta_data_list):
 
-        # Get file start time
-        with fs.open(log_file, "rb") as handle:
-            mdf_file = mdf_iter.MdfFile(handle, passwords=passwords)
-            start_epoch_ms = mdf_file.get_first_measurement() / 1000000
-            meta_data = mdf_file.get_metadata()
-
-        # Get size
-        size_mb = fs.size(log_file) >> 20
-        session = meta_data.get("HDcomment.File Information.session", {}).get("value_raw")
-        split = meta_data.get("HDcomment.File Information.split", {}).get("value_raw")
-        config_crc = meta_data.get("HDcomment.Device Information.config crc32 checksum", {}).get("value_raw")
-        hw_rev = meta_data.get("HDcomment.Device Information.hardware version", {}).get("value_raw")
-        fw_rev = meta_data.get("HDcomment.Device Information.firmware version", {}).get("value_raw")
-        storage_free = meta_data.get("HDcomment.Device Information.storage free", {}).get("value_raw")
-        storage_total = meta_data.get("HDcomment.Device Information.storage total", {}).get("value_raw")
-        comment = meta_data.get("HDcomment.File Information.comment", {}).get("value_raw").strip()
+        if meta_data is None:
+            continue
+
+        # Get file start time and size
+        start_epoch_ms = meta_data.start_epoch_ns / 1000000
+        size_mb = meta_data.size >> 20
+
+        session = meta_data.get("HDcomment.File Information.session")
+        split = meta_data.get("HDcomment.File Information.split")
+        config_crc = meta_data.get("HDcomment.Device Information.config crc32 checksum")
+        hw_rev = meta_data.get("HDcomment.Device Information.hardware version")
+        fw_rev = meta_data.get("HDcomment.Device Information.firmware version")
+        storage_free = meta_data.get("HDcomment.Device Information.storage free")
+        storage_total = meta_data.get("HDcomment.Device Information.storage total")
+        comment = (meta_data.get("HDcomment.File Information.comment") or "").strip()
 
         storage_mb = ""
         if storage_free is not None and storage_total is not None:
@@ -71,9 +89,6 @@ def table_fs(fs, device, start_date: datetime, stop_date: datetime, max_data_poi
 
         # {"type": "info", "device":"79A2DD1A"}
 
-        if len(rows) >= max_data_points:
-            break
-
     res = [
         {
                 "type": "table",
@@ -96,79 +111,164 @@ def table_fs(fs, device, start_date: datetime, stop_date: datetime, max_data_poi
     return res
 
 
-def table_raw_data(fs, device, start_date: datetime, stop_date: datetime, max_data_points, passwords) -> list:
-    """
-    Returns raw log file data as table
+def table_raw_data(fs, device, start_date: datetime, stop_date: datetime, max_data_points, passwords,
+                   cancel: CancelToken = None, presence: PresenceIndex = None, cursor: str = None, ids: [int] = None,
+                   chn: CanedgeChannel = None, itf: CanedgeInterface = None) -> list:
     """
+    Returns raw log file data as table.
 
-    # Find log files
-    log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
-                                              passwords=passwords)
-
-    # Load log files one at a time until max_data_points
-    df_raw = pd.DataFrame()
-    for log_file in log_files:
-
-        _, df_raw_can, df_raw_lin, = _load_log_file(fs, log_file, [CanedgeInterface.CAN, CanedgeInterface.LIN],
-                                                    passwords)
-
-        # Add interface column
-        df_raw_can['ITF'] = "CAN"
-        df_raw_lin['ITF'] = "LIN"
-
-        # Lin set extended to 0
-        df_raw_lin['IDE'] = 0
+    Log files are read one at a time until the page of max_data_points rows is full. If more rows are available, a
+    cursor ("log file:row offset") is returned in the "meta" field of the table. Passing the cursor returns the next page
+    without reading the preceding log files.
 
-        # Merge data frames
-        df_raw_chunk = pd.concat([df_raw_can, df_raw_lin])
+    Optionally, rows are filtered by IDs, channel and interface. The row offset of a cursor is relative to the filtered
+    rows of the log file in the time interval, i.e. a cursor is only valid for the same query. No data is returned for a
+    malformed cursor.
+    """
 
-        # Keep only selected time interval (files may contain a bit more at both ends)
-        df_raw_chunk = df_raw_chunk.loc[start_date:stop_date]
+    # Resume from cursor
+    cursor_file, cursor_row = None, 0
+    if cursor:
+        parsed = _parse_cursor(cursor)
+        if parsed is None:
+            logger.warning(f"Device: {device} - Malformed cursor: {cursor}")
+            return None
+        cursor_file, cursor_row = parsed
 
-        # Append
-        df_raw = pd.concat([df_raw, df_raw_chunk])
+    # Find log files
+    with timer("listing", device):
+        log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
+                                                  passwords=passwords)
+    if cursor_file is not None:
+        log_files = [x for x in log_files if x >= cursor_file]
+
+    itf_used = [itf] if itf is not None else [CanedgeInterface.CAN, CanedgeInterface.LIN]
+    start_ns, stop_ns = to_epoch_ns(start_date), to_epoch_ns(stop_date)
+
+    # Rows not matching the filters are skipped when loading the log files
+    predicate = FramePredicate(channels=(int(chn),) if chn is not None else None,
+                               ids=tuple(sorted({x & 0x7FFFFFFF for x in ids})) if ids is not None else None,
+                               start_ns=start_ns,
+                               stop_ns=stop_ns)
+    predicates = tuple((x, predicate) for x in itf_used)
+
+    # Load log files one at a time until the page is full
+    chunks = []
+    rows = 0
+    next_cursor = None
+    for log_file_index, log_file in enumerate(log_files):
+
+        # Stop if the query has been abandoned
+        if cancel is not None:
+            cancel.check()
+
+        # Skip files known not to contain the requested IDs
+        if itf_used == [CanedgeInterface.CAN] and not _may_match(presence, device, log_file, predicate):
+            FILES_SKIPPED.inc(reason="presence", device=device)
+            record_file(log_file, device, "skipped (presence)")
+            continue
+
+        record_file(log_file, device, "processed")
+        _, frames_can, frames_lin, can_ids = _load_log_file(fs, log_file, itf_used, passwords, predicates)
+
+        # Keep track on the IDs seen on the device
+        if presence is not None and can_ids is not None and not presence.has(device, log_file):
+            presence.record(device, log_file, can_ids)
+
+        # The loaded frames are within the time interval (files may contain a bit more at both ends) and match the
+        # filters
+        itf_frames = [("CAN", frames_can), ("LIN", frames_lin)]
+
+        # Skip rows returned on previous pages, and keep only the rows needed to fill the page
+        offset = cursor_row if log_file == cursor_file else 0
+        available = sum(len(x) for _, x in itf_frames) - offset
+        if available <= 0:
+            continue
+
+        remaining = max_data_points - rows
+        if available > remaining or (available == remaining and log_file_index < len(log_files) - 1):
+            next_cursor = f"{log_file}:{offset + remaining}"
+
+        df_raw_chunk = []
+        skip, take = offset, min(available, remaining)
+        for itf_name, frames in itf_frames:
+            skip, frames = max(skip - len(frames), 0), frames[skip:skip + take]
+            take -= len(frames)
+            if len(frames) == 0:
+                continue
 
-        # Max data points reached?
-        if len(df_raw) >= max_data_points:
+            # Payloads formatted as hex strings for the rows on the page only
+            df_raw_chunk.append(pd.DataFrame({
+                "TIME": frames.timestamp / 10 ** 6,
+                "ITF": itf_name,
+                "CHN": frames.channel,
+                "ID": frames.id,
+                "IDE": frames.ide,
+                "NOB": frames.length,
+                "DATA": _format_hex(frames.data, frames.length),
+            }))
+        df_raw_chunk = pd.concat(df_raw_chunk, ignore_index=True) if len(df_raw_chunk) > 1 else df_raw_chunk[0]
+
+        chunks.append(df_raw_chunk)
+        rows += len(df_raw_chunk)
+
+        if rows >= max_data_points:
             break
 
     # Any data in time interval?
-    if len(df_raw) == 0:
+    if rows == 0:
         return None
 
-    # Reset the index to get the timestamp as column
-    df_raw.reset_index(inplace=True)
+    # Concatenate once (instead of growing the table file by file)
+    df_raw = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+    # Column names and types
+    columns = [{"text": x, "type": "time" if x == "TIME" else "string"} for x in list(df_raw.columns)]
+
+    # Return formatted output
+    return [{"type": "table", "columns": columns, "rows": df_raw.values.tolist(), "meta": {"cursor": next_cursor}}]
 
-    # Keep only selected columns
-    df_raw = df_raw[["TimeStamp", 'ITF', 'BusChannel', 'ID', 'IDE', 'DataLength', 'DataBytes']]
 
-    # Rename columns
-    df_raw.rename(columns={"TimeStamp": "TIME", "BusChannel": "CHN", "DataLength": "NOB", 'DataBytes': "DATA"},
-                  inplace=True)
+def _parse_cursor(cursor) -> (str, int):
+    """Log file and row offset of a table cursor ("log file:row offset"), None if malformed"""
+    log_file, _, row = str(cursor).rpartition(":")
+    if log_file == "" or not row.isdigit():
+        return None
+    return log_file, int(row)
 
-    # Cut to max data points
-    df_raw = df_raw[0:max_data_points]
 
-    # Change from datetime to epoch
-    df_raw['TIME'] = df_raw['TIME'].astype(np.int64) / 10 ** 6
+def _format_hex(matrix: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Formats payloads (zero-padded uint8 matrix and payload lengths) as space separated hex strings. The matrix is
+    formatted using a lookup table of hex strings. The padding is formatted as NUL bytes, which are dropped when viewing
+    each row as a single string.
+    """
+    width = matrix.shape[1]
+    if width == 0:
+        return np.full(len(matrix), "", dtype=object)
 
-    # Change "Databytes" from array to hex string
-    df_raw['DATA'] = df_raw['DATA'].apply(lambda data: ' '.join('{:02X}'.format(x) for x in data))
+    valid = np.arange(width) < lengths[:, None]
+    cells = _HEX_TABLE[matrix]
+    cells[~valid] = b""
 
-    # Column names and types
-    columns = [{"text": x, "type": "time" if x == "TIME" else "string"} for x in list(df_raw.columns)]
+    text = cells.view(f"S{3 * width}").ravel().astype(str)
+    return np.char.rstrip(text, " ").astype(object)
 
-    # Return formatted output
-    return [{"type": "table", "columns": columns, "rows": df_raw.values.tolist()}]
+
+# "00 " to "FF " lookup table for formatting payloads
+_HEX_TABLE = np.array([f"{x:02X} ".encode() for x in range(256)], dtype="S3")
 
 
 def time_series_phy_data(fs, signal_queries: [SignalQuery], start_date: datetime, stop_date: datetime, limit_mb,
-                         passwords, tp_type) -> dict:
+                         passwords, tp_type, cancel: CancelToken = None, deadline_s: float = None,
+                         coverage: bool = False, max_data_points: int = None,
+                         presence: PresenceIndex = None, chunk_rows: int = None, max_query_mb: float = None,
+                         memory_guard: MemoryGuard = None, decoded_cache: DecodedCache = None) -> dict:
     """
     Returns time series based on a list of signal queries.
 
     The function is optimized towards:
-    - Low memory usage (only one file loaded at a time).
+    - Low memory usage (only one file loaded at a time, processed in chunks).
     - As few decoding runs as possible (time expensive)
 
     For each device, a log file is only loaded once. To obtain this, the signal requests are first grouped by device ID.
@@ -177,8 +277,42 @@ def time_series_phy_data(fs, signal_queries: [SignalQuery], start_date: datetime
     As a result, it is needed to run the decoder for each combination of db, channel and interface.
     Signals from the same channel and interface can be grouped to process all in one run (applied after device grouping)
 
-    Returns as a list of dicts. Each dict contains the signal "target" name and data points as a list of value (float/str)
-    and timestamp (float) tuples.
+    If a cancel token is provided, it is checked between files and decode groups. QueryCancelled is raised if the query
+    has been abandoned.
+
+    If a deadline (in seconds) is provided, processing stops when it expires and the data processed so far is returned.
+    Time ranges skipped due to the deadline or the data limit are reported as notices in the "meta" field of the
+    affected targets.
+
+    In coverage mode, the data budget is spread over the full time range by processing evenly spaced files (at most one
+    per data point), instead of processing files in order until the budget is used. Zooming in refines the coverage, as
+    fewer files are in range.
+
+    Frames which are not needed by any query (other interfaces, channels and frame IDs, or outside the time interval)
+    are skipped when loading the log files. If a presence index is provided, the CAN IDs seen in each loaded file are
+    recorded in it, and files known not to contain any of the requested frames are not loaded.
+
+    Signals are resampled continuously across the log files of a session (intervals aligned to the epoch), and a None/null
+    data point is inserted at session gaps.
+
+    With chunk_rows, the frames of a file are filtered, decoded and resampled in chunks of at most chunk_rows frames,
+    such that the decoded data held at a time is bounded. The resampled data points are accumulated incrementally
+    (intervals spanning two chunks are completed with the next chunk). With TP decoding, files are processed whole, as
+    TP messages may span chunks.
+
+    With max_query_mb, the memory held by the query (data frames while loading files, loaded frames, decoded chunks and
+    data points) is accounted, and the remaining files are skipped once the ceiling is exceeded. Files not expected to
+    fit when loaded are skipped. The peak is logged and reported in the metrics.
+
+    With a memory guard (process memory ceiling), the query is rejected if the process is at the ceiling, the sampling
+    intervals are made coarser if the data points would not fit below the ceiling, and files not expected to fit when
+    loaded are skipped. Degraded and rejected queries are reported as notices.
+
+    With a decoded cache (filled ahead of queries by the pre-decoder), files with all the requested signals cached are
+    served from the cache, without loading and decoding these. Cached files are not counted in the data limit.
+
+    Returns as a list of dicts, ordered as the signal queries. Each dict contains the signal "target" name and data points
+    as a list of value (float/str) and timestamp (float) tuples.
 
     e.g.
     [
@@ -194,170 +328,632 @@ def time_series_phy_data(fs, signal_queries: [SignalQuery], start_date: datetime
     # Keep track on how much data has been processed (in MB)
     data_processed_mb = 0
 
-    # Group the signal queries by device, such that files from the same device needs to be loaded only once
-    for device, device_group in groupby(signal_queries, lambda x: x.device):
-
-        device_group = list(device_group)
+    # Wall-clock budget. When expired, the remaining files are skipped
+    deadline = Deadline(deadline_s)
+
+    # Memory ceiling. When exceeded, the remaining files are skipped
+    memory = MemoryBudget(max_query_mb)
+
+    start_ns, stop_ns = to_epoch_ns(start_date), to_epoch_ns(stop_date)
+
+    # Process memory ceiling. Reject the query if no memory is available
+    if memory_guard is not None and not memory_guard.admits(1):
+        notice = f"Rejected (process memory {memory_guard.limit_mb} MB)"
+        logger.warning(notice)
+        QUERIES_GUARDED.inc(action="rejected")
+        for entry in result:
+            add_notice(entry, notice)
+        return result
+
+    # Make the sampling coarser if the data points of the query would not fit below the process memory ceiling
+    interval_factor = 1
+    if memory_guard is not None:
+        datapoints = sum((stop_ns - start_ns) // (max(x.interval_ms, 1) * 10 ** 6) + 1 for x in signal_queries)
+        interval_factor = memory_guard.interval_factor(datapoints)
+        if interval_factor > 1:
+            notice = f"Coarser sampling (interval x{interval_factor}, process memory {memory_guard.limit_mb} MB)"
+            logger.info(notice)
+            QUERIES_GUARDED.inc(action="degraded")
+            for entry in result:
+                add_notice(entry, notice)
+
+    # Position of each query in the result (queries from merged requests may share the same target name)
+    result_indices = {id(x): idx for idx, x in enumerate(signal_queries)}
+
+    # Sort the queries by device, interface, channel and db, such that these can be grouped below. Queries merged from
+    # several requests are not necessarily ordered
+    signal_queries = sorted(signal_queries, key=lambda x: (x.device, x.itf.value, int(x.chn), id(x.db)))
 
-        # Find log files
-        log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
-                                                  passwords=passwords)
+    # Group the signal queries by device, such that files from the same device needs to be loaded only once
+    device_groups = [(device, list(device_group)) for device, device_group in groupby(signal_queries, lambda x: x.device)]
+    for device_index, (device, device_group) in enumerate(device_groups):
+
+        # Keep track on time ranges skipped due to the deadline or the data limit
+        skipped_ranges = []
+        skipped_reasons = set()
+        skipped_from = None
+        data_until = start_date
+
+        # Find log files (skip listing if the deadline has already expired)
+        if deadline.expired:
+            log_files = []
+            skipped_from = start_date
+            skipped_reasons.add(f"deadline {deadline_s} s")
+        else:
+            with timer("listing", device):
+                log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
+                                                          passwords=passwords)
+
+        # In coverage mode, select evenly spaced files within the remaining budget (shared by the remaining devices).
+        # Gaps are inserted where files are left out, to show that data is not continuous
+        file_sizes = {}
+        gap_before = set()
+        if coverage and len(log_files) > 0:
+            file_sizes = get_file_sizes(fs, log_files)
+            budget_mb = (limit_mb - data_processed_mb) / (len(device_groups) - device_index)
+            selected = select_files([file_sizes[x] / 2 ** 20 for x in log_files], budget_mb, max_data_points)
+            logger.info(f"Device: {device} - Coverage of {len(selected)} of {len(log_files)} files")
+            gap_before = {log_files[b] for a, b in zip(selected, selected[1:]) if b != a + 1}
+            log_files = [log_files[x] for x in selected]
+
+        # Frames needed by the queries of the device, selected when loading the log files
+        predicates = _query_predicates(device_group, tp_type, start_ns, stop_ns)
+        itf_used = [x.itf for x in device_group]
+
+        # Resample each signal using the specific method and interval. The data of consecutive files is resampled as a
+        # continuous segment until a session gap, with intervals aligned to the epoch (not to the start of each file),
+        # such that intervals spanning two files are not split
+        resamplers = {id(x): SignalResampler(x.interval_ms * interval_factor, x.method, origin_ns=0)
+                      for x in device_group}
+
+        # Queries waiting for a None/null data point, inserted before their first data after a session gap
+        segment_break = False
+        gap_pending = set()
 
         # Load log files one at a time (to reduce memory usage)
         session_previous = None
         for log_file in log_files:
 
+            # Stop if the query has been abandoned
+            if cancel is not None:
+                cancel.check()
+
+            # Skip the remaining files if out of time or if the memory ceiling is exceeded
+            skip = _skip_reason(deadline=deadline, memory=memory)
+            if skip is not None:
+                _skip_file(log_file, device, *skip)
+                skipped_from = data_until if skipped_from is None else skipped_from
+                skipped_reasons.add(skip[1])
+                continue
+
             # Check if log file is in new session
             _, session_current, _, _ = fs.path_to_pars(log_file)
-            new_session = False
+            new_session = log_file in gap_before
             if session_previous is not None and session_previous != session_current:
                 new_session = True
             session_previous = session_current
+            segment_break = segment_break or new_session
+
+            # Skip files known not to contain any of the requested frames (IDs recorded when loaded previously)
+            if all(x == CanedgeInterface.CAN for x in itf_used) and \
+                    not _may_match(presence, device, log_file, dict(predicates)[CanedgeInterface.CAN]):
+                logger.info(f"File: {log_file} - Skipping (no requested frames)")
+                FILES_SKIPPED.inc(reason="presence", device=device)
+                record_file(log_file, device, "skipped (presence)")
+                continue
 
-            # Get size of file
-            file_size_mb = fs.stat(log_file)["size"] >> 20
+            # Serve the file from the decoded cache if all requested signals are cached (TP data is not cached)
+            cached = _get_cached(decoded_cache, log_file, device_group) if tp_type == "" else None
+            if cached is not None:
+                logger.info(f"File: {log_file} - Cached")
+                record_file(log_file, device, "cached")
+
+                # Keep the data within the time interval (as selected when loading the files)
+                for key, (timestamps, values) in cached.items():
+                    mask = (timestamps >= start_ns) & (timestamps <= stop_ns)
+                    cached[key] = (timestamps[mask], values[mask])
+
+                cached_timestamps = [x[0] for x in cached.values() if len(x[0]) > 0]
+                if len(cached_timestamps) == 0:
+                    continue
+
+                if skipped_from is not None:
+                    skipped_ranges.append((skipped_from, pd.Timestamp(min(x[0] for x in cached_timestamps), tz="UTC")))
+                    skipped_from = None
+                data_until = pd.Timestamp(max(x[-1] for x in cached_timestamps), tz="UTC")
+
+                if segment_break:
+                    segment_break = False
+                    _flush_resamplers(resamplers, device_group, result, result_indices, memory)
+                    gap_pending = {id(x) for x in device_group}
+
+                with timer("resample", device):
+                    for _, decode_group in groupby(device_group, lambda x: (x.itf, x.chn, x.db)):
+                        decode_group = list(decode_group)
+                        if all(len(cached[id(x)][0]) == 0 for x in decode_group):
+                            continue
+
+                        for signal_group in decode_group:
+                            if id(signal_group) in gap_pending:
+                                gap_pending.discard(id(signal_group))
+                                result[result_indices[id(signal_group)]]["datapoints"].extend([[None, None]])
+
+                            timestamps, values = resamplers[id(signal_group)].add(*cached[id(signal_group)])
+                            _add_datapoints(result[result_indices[id(signal_group)]], timestamps, values, memory)
+                continue
 
-            # Check if we have reached the limit of data processed in MB
-            if data_processed_mb + file_size_mb > limit_mb:
-                logger.info(f"File: {log_file} - Skipping (limit {limit_mb} MB)")
+            # Get size of file
+            file_size = file_sizes[log_file] if log_file in file_sizes else fs.stat(log_file)["size"]
+            file_size_mb = file_size >> 20
+
+            # Skip files exceeding the limit of data processed, or not expected to fit below the memory ceilings when
+            # loaded (the mdf_iter data frame is built whole before the frames are selected)
+            skip = _skip_reason(memory=memory, memory_guard=memory_guard, file_size=file_size,
+                                data_processed_mb=data_processed_mb, limit_mb=limit_mb)
+            if skip is not None:
+                _skip_file(log_file, device, *skip)
+                skipped_from = data_until if skipped_from is None else skipped_from
+                skipped_reasons.add(skip[1])
                 continue
+
             logger.info(f"File: {log_file}")
+            record_file(log_file, device, "processed")
 
             # Update size of data processed
             data_processed_mb += file_size_mb
 
-            # TODO: caching can be improved on by taking log file and signal - such that the cached data contain the
-            # decoded signals (with max time resolution). Currently, the cache contains all data, which does not improve
-            # loading times significantly (and takes a lot of memory)
-            start_epoch, df_raw_can, df_raw_lin = _load_log_file(fs, log_file, [x.itf for x in device_group], passwords)
+            # The data frame is held while the file is loaded
+            memory.add(file_size * LOAD_EXPANSION)
+            start_epoch, frames_can, frames_lin, can_ids = _load_log_file(fs, log_file, itf_used, passwords,
+                                                                          predicates)
+            memory.release(file_size * LOAD_EXPANSION)
 
-            # Keep only selected time interval (files may contain a more at both ends). Do this early to process as
-            # little data as possible
-            df_raw_can = df_raw_can.loc[start_date:stop_date]
-            df_raw_lin = df_raw_lin.loc[start_date:stop_date]
+            # Keep track on the IDs seen on the device (all IDs of the file, before filtering)
+            if presence is not None and can_ids is not None and not presence.has(device, log_file):
+                presence.record(device, log_file, can_ids)
 
             # If no data, continue to next file
-            if len(df_raw_can) == 0 and len(df_raw_lin) == 0:
+            if len(frames_can) == 0 and len(frames_lin) == 0:
                 continue
 
+            # Close a preceding range of skipped files, and keep track on the time covered by processed data
+            frames_timestamps = [x.timestamp for x in [frames_can, frames_lin] if len(x) > 0]
+            if skipped_from is not None:
+                skipped_ranges.append((skipped_from, pd.Timestamp(min(x[0] for x in frames_timestamps), tz="UTC")))
+                skipped_from = None
+            data_until = pd.Timestamp(max(x[-1] for x in frames_timestamps), tz="UTC")
+
+            # End the continuous segment at a session gap
+            if segment_break:
+                segment_break = False
+                _flush_resamplers(resamplers, device_group, result, result_indices, memory)
+                gap_pending = {id(x) for x in device_group}
+
+            # The loaded frames are held while the file is processed
+            frames_nbytes = frames_can.nbytes + frames_lin.nbytes
+            memory.add(frames_nbytes)
+
             # Group queries using the same db, interface and channel (to minimize the number of decoding runs)
             for (itf, chn, db), decode_group in groupby(device_group, lambda x: (x.itf, x.chn, x.db)):
 
+                if cancel is not None:
+                    cancel.check()
+
                 decode_group = list(decode_group)
 
                 # Keep only selected interface (only signals from the same interface are grouped)
-                df_raw = df_raw_can if itf == CanedgeInterface.CAN else df_raw_lin
+                frames_itf = frames_can if itf == CanedgeInterface.CAN else frames_lin
 
-                # Keep only selected channel
-                df_raw = df_raw.loc[df_raw['BusChannel'] == int(chn)]
+                # Decoder of the requested signals (compiled once per DB and set of signals)
+                decoder = get_decoder(db, [x.signal_name for x in decode_group])
 
-                if df_raw.empty:
-                    continue
+                # TP messages may span chunks, process the file whole
+                for frames in _iter_chunks(frames_itf, chunk_rows if tp_type == "" else None):
+
+                    if cancel is not None:
+                        cancel.check()
 
-                # If IDE missing (LIN) add dummy allow decoding
-                if 'IDE' not in df_raw:
-                    df_raw['IDE'] = 0
-
-                # Filter out IDs not used before the costly decoding step (bit 32 cleared). For simplicity, does not
-                # differentiate standard and extended. Result is potentially unused IDs passed for decoding if overlaps
-                if db.protocol == "J1939":
-                    #TODO Find out how to do pre-filtering on PGNs to speed up J1939 decoding
-                    pass
-                else:
-                    df_raw = df_raw[df_raw['ID'].isin([x & 0x7FFFFFFF for x in db.frames.keys()])]
-                    # TODO optimize by using requested signals to create a smaller subset DBC and filter by that
-
-                if tp_type != "":
-                    # Decode after first re-segmenting CAN data according to TP type (uds, j1939, nmea)
-                    #TODO Optimize for speed
-                    tp = MultiFrameDecoder(tp_type)
-                    df_raw = tp.combine_tp_frames(df_raw)
-
-                df_phys_temp = [] 
-                for length, group in df_raw.groupby("DataLength"):
-                    df_phys_group = can_decoder.DataFrameDecoder(db).decode_frame(group)
-
-                    if 'Signal' not in df_phys_group.columns:
+                    # Keep only selected channel
+                    frames = frames[frames.channel == int(chn)]
+
+                    if len(frames) == 0:
                         continue
 
-                    df_phys_temp.append(df_phys_group)
+                    if tp_type == "":
+                        # Keep only frames with requested signals before the decoding step
+                        frames = frames[decoder.matches(frames)]
+                        frames_parts = [frames]
+                    else:
+                        # Filter out IDs not used before TP re-segmenting (bit 32 cleared). For simplicity, does not
+                        # differentiate standard and extended. J1939 TP frames use other PGNs than the data, not
+                        # filtered
+                        if db.protocol != "J1939":
+                            frames = frames[np.isin(frames.id, [x & 0x7FFFFFFF for x in db.frames.keys()])]
+
+                        # Decode after first re-segmenting CAN data according to TP type (uds, j1939, nmea)
+                        #TODO Optimize for speed
+                        with timer("tp", device):
+                            tp = MultiFrameDecoder(tp_type)
+                            df_raw = tp.combine_tp_frames(frames.to_data_frame())
+
+                        # Reassembled payloads can be long. Keep these separate, such that the payload matrix of the
+                        # other frames stays narrow
+                        frames_parts = [RawFrames.from_data_frame(x)
+                                        for _, x in df_raw.groupby(df_raw["DataLength"] > 64)]
+
+                    # Decode all payload lengths in one pass, to arrays per signal
+                    with timer("decode", device):
+                        decoded = _decode_parts(decoder, frames_parts)
+
+                    # Check if output contains any signals
+                    if len(decoded) == 0:
+                        continue
+
+                    # If new session, insert a None/null data point to indicate that data is not continuous
+                    for signal_group in decode_group:
+                        if id(signal_group) in gap_pending:
+                            gap_pending.discard(id(signal_group))
+                            result[result_indices[id(signal_group)]]["datapoints"].extend([[None, None]])
+
+                    decoded_bytes = decoded_nbytes(decoded)
+                    memory.add(decoded_bytes)
+
+                    with timer("resample", device):
+                        for signal_group in decode_group:
+
+                            # Extract the signal (the arrays of each signal are views, no filtering of the decoded
+                            # data needed)
+                            signal_timestamps, signal_values, _, _ = decoded.get(signal_group.signal_name,
+                                                                                 _EMPTY_SIGNAL)
+                            timestamps, values = resamplers[id(signal_group)].add(signal_timestamps, signal_values)
+                            _add_datapoints(result[result_indices[id(signal_group)]], timestamps, values, memory)
+
+                    memory.release(decoded_bytes)
 
-                if len(df_phys_temp) > 0:
-                    df_phys = pd.concat(df_phys_temp,ignore_index=False).sort_index()
-                else:
-                    df_phys = pd.DataFrame()
+            memory.release(frames_nbytes)
 
-                # commented out the original option of a "clean" decoding due to lack of support for mixed DLC rows in df_raw
-                # df_phys = can_decoder.DataFrameDecoder(db).decode_frame(df_raw)
+        # Add the last interval of each signal
+        _flush_resamplers(resamplers, device_group, result, result_indices, memory)
 
+        # Report skipped time ranges, such that Grafana can show that the data is incomplete
+        if skipped_from is not None:
+            skipped_ranges.append((skipped_from, stop_date))
+        if len(skipped_ranges) > 0:
+            notice = f"Partial data ({', '.join(sorted(skipped_reasons))}), skipped: {format_ranges(skipped_ranges)}"
+            logger.info(f"Device: {device} - {notice}")
+            for signal_query in device_group:
+                add_notice(result[result_indices[id(signal_query)]], notice)
 
-                # Check if output contains any signals
-                if 'Signal' not in df_phys.columns:
+    logger.info(f"Peak memory: {memory.peak_mb:.1f} MB")
+    QUERY_PEAK_MEMORY.observe(memory.peak, endpoint=current_endpoint())
+
+    return result
+
+
+def iter_signal_data(fs, signal_queries: [SignalQuery], start_date: datetime, stop_date: datetime, limit_mb, passwords,
+                     cancel: CancelToken = None, deadline: Deadline = None, presence: PresenceIndex = None,
+                     chunk_rows: int = None, memory_guard: MemoryGuard = None, decoded_cache: DecodedCache = None,
+                     skipped: set = None, memory: MemoryBudget = None):
+    """
+    Yields the data of signal queries of the same device, interface, channel and DB at full time resolution, e.g. to be
+    aggregated by the caller. The signals are decoded together. Each chunk is a dict of (timestamps, values) arrays
+    ordered by time per signal name (timestamps in ns since epoch).
+
+    Log files are processed one at a time as in time_series_phy_data: files are served from the decoded cache if
+    cached, files known not to contain the signals are skipped, and files are decoded in chunks of at most chunk_rows
+    frames. Files exceeding the data limit or the process memory ceiling, or processed after the deadline, are skipped,
+    and the reasons are added to skipped. With a memory budget (of the caller), files not expected to fit when loaded
+    are skipped, and the memory held while a file is loaded and decoded is accounted. TP data is not supported.
+    """
+    signal_query = signal_queries[0]
+    device, itf = signal_query.device, signal_query.itf
+    signal_names = [x.signal_name for x in signal_queries]
+    start_ns, stop_ns = to_epoch_ns(start_date), to_epoch_ns(stop_date)
+    skipped = set() if skipped is None else skipped
+
+    with timer("listing", device):
+        log_files = canedge_browser.get_log_files(fs, device, start_date=start_date, stop_date=stop_date,
+                                                  passwords=passwords)
+
+    predicates = _query_predicates(signal_queries, "", start_ns, stop_ns)
+    decoder = get_decoder(signal_query.db, signal_names)
+
+    data_processed_mb = 0
+    for log_file in log_files:
+
+        if cancel is not None:
+            cancel.check()
+
+        skip = _skip_reason(deadline=deadline, memory=memory)
+        if skip is not None:
+            _skip_file(log_file, device, *skip)
+            skipped.add(skip[1])
+            continue
+
+        if itf == CanedgeInterface.CAN and \
+                not _may_match(presence, device, log_file, dict(predicates)[CanedgeInterface.CAN]):
+            FILES_SKIPPED.inc(reason="presence", device=device)
+            record_file(log_file, device, "skipped (presence)")
+            continue
+
+        cached = _get_cached(decoded_cache, log_file, signal_queries)
+        if cached is not None:
+            record_file(log_file, device, "cached")
+            chunk = {}
+            for query in signal_queries:
+                timestamps, values = cached[id(query)]
+                mask = (timestamps >= start_ns) & (timestamps <= stop_ns)
+                chunk[query.signal_name] = (timestamps[mask], values[mask])
+            if any(len(x[0]) > 0 for x in chunk.values()):
+                yield chunk
+            continue
+
+        file_size = fs.stat(log_file)["size"]
+        skip = _skip_reason(memory=memory, memory_guard=memory_guard, file_size=file_size,
+                            data_processed_mb=data_processed_mb, limit_mb=limit_mb)
+        if skip is not None:
+            _skip_file(log_file, device, *skip)
+            skipped.add(skip[1])
+            continue
+
+        record_file(log_file, device, "processed")
+        data_processed_mb += file_size >> 20
+
+        # The data frame is held while the file is loaded
+        held = file_size * LOAD_EXPANSION if memory is not None else 0
+        if memory is not None:
+            memory.add(held)
+        try:
+            _, frames_can, frames_lin, can_ids = _load_log_file(fs, log_file, [itf], passwords, predicates)
+
+            if presence is not None and can_ids is not None and not presence.has(device, log_file):
+                presence.record(device, log_file, can_ids)
+
+            # The loaded frames are held while the file is decoded
+            frames_itf = frames_can if itf == CanedgeInterface.CAN else frames_lin
+            if memory is not None:
+                memory.release(held)
+                held = frames_itf.nbytes
+                memory.add(held)
+
+            for frames in _iter_chunks(frames_itf, chunk_rows):
+
+                if cancel is not None:
+                    cancel.check()
+
+                frames = frames[frames.channel == int(signal_query.chn)]
+                if len(frames) == 0:
                     continue
 
-                # Keep only requested signals
-                df_phys = df_phys[df_phys['Signal'].isin([x.signal_name for x in decode_group])]
+                frames = frames[decoder.matches(frames)]
+                with timer("decode", device):
+                    decoded = decoder.decode(frames)
+
+                if len(decoded) > 0:
+                    yield {x: decoded.get(x, _EMPTY_SIGNAL)[:2] for x in signal_names}
+        finally:
+            if memory is not None:
+                memory.release(held)
+
 
-                # Drop unused columns
-                df_phys.drop(['CAN ID', 'Raw Value'], axis=1, inplace=True)
+def _skip_reason(deadline: Deadline = None, memory: MemoryBudget = None, memory_guard: MemoryGuard = None,
+                 file_size: int = None, data_processed_mb: int = 0, limit_mb=None) -> (str, str):
+    """
+    Reason to skip a log file, as the reason of the skipped files metric and the reason reported to the user, or None if
+    the file is processed. Without a file size, the query is checked for time and memory left (deadline, memory ceiling
+    exceeded). With the file size, the file is checked against the data limit, and against the memory ceilings of the
+    query and of the process when loaded.
+    """
+    if file_size is None:
+        if deadline is not None and deadline.expired:
+            return "deadline", f"deadline {deadline.seconds} s"
+        if memory is not None and memory.exceeded:
+            return "memory", f"memory {memory.limit_mb} MB"
+        return None
 
-                # Resample each signal using the specific method and interval.
-                # Making sure that only existing/real data points are included in the output (no interpolations etc).
-                for signal_group in decode_group:
+    if limit_mb is not None and data_processed_mb + (file_size >> 20) > limit_mb:
+        return "limit", f"limit {limit_mb} MB"
+    if memory is not None and not memory.admits(file_size * LOAD_EXPANSION):
+        return "memory", f"memory {memory.limit_mb} MB"
+    if memory_guard is not None and not memory_guard.admits(file_size * LOAD_EXPANSION):
+        return "process_memory", f"process memory {memory_guard.limit_mb} MB"
+    return None
 
-                    # "Backup" the original timestamps, such that these can be used after resampling
-                    df_phys['time_orig'] = df_phys.index
 
-                    # Extract the signal
-                    df_phys_signal = df_phys.loc[df_phys['Signal'] == signal_group.signal_name]
+def _skip_file(log_file: str, device: str, reason: str, text: str):
+    """Log and count a skipped log file"""
+    logger.info(f"File: {log_file} - Skipping ({text})")
+    FILES_SKIPPED.inc(reason=reason, device=device)
+    record_file(log_file, device, f"skipped ({reason.replace('_', ' ')})")
 
-                    # Pick the min, max or nearest. This picks a real data value but potentially a "fake" timestamp
-                    interval_ms = signal_group.interval_ms
-                    if signal_group.method == SampleMethod.MIN:
-                        df_phys_signal_resample = df_phys_signal.resample(f"{interval_ms}ms").min()
-                    elif signal_group.method == SampleMethod.MAX:
-                        df_phys_signal_resample = df_phys_signal.resample(f"{interval_ms}ms").max()
-                    else:
-                        df_phys_signal_resample = df_phys_signal.resample(f"{interval_ms}ms").nearest()
 
-                    # The "original" time was also resampled. Use this to restore true data points.
-                    # Drop duplicates and nans (duplicates were potentially created during "nearest" resampling)
-                    # This also makes sure that data is never up-sampled
-                    df_phys_signal_resample.drop_duplicates(subset='time_orig', inplace=True)
-                    df_phys_signal_resample.dropna(axis=0, how='any', inplace=True)
+def _iter_chunks(frames: RawFrames, chunk_rows: int = None):
+    """Consecutive chunks of at most chunk_rows frames (views). A single chunk if chunk_rows is None or 0"""
+    if not chunk_rows or len(frames) <= chunk_rows:
+        yield frames
+        return
+    for start in range(0, len(frames), chunk_rows):
+        yield frames[start:start + chunk_rows]
 
-                    # Timestamps and values to list
-                    timestamps = (df_phys_signal_resample["time_orig"].astype(np.int64) / 10 ** 6).tolist()
-                    values = df_phys_signal_resample["Physical Value"].values.tolist()
 
-                    # Get the list index of the result to update
-                    result_index = [idx for idx, value in enumerate(result) if value['target'] == signal_group.target][0]
+def _flush_resamplers(resamplers: dict, signal_queries: [SignalQuery], result: list, result_indices: dict,
+                      memory: MemoryBudget):
+    """Add the data points held back by the resamplers of signal queries (end of a continuous segment)"""
+    with timer("resample", signal_queries[0].device if len(signal_queries) > 0 else ""):
+        for signal_query in signal_queries:
+            timestamps, values = resamplers[id(signal_query)].flush()
+            _add_datapoints(result[result_indices[id(signal_query)]], timestamps, values, memory)
 
-                    # If new session, insert a None/null data point to indicate that data is not continuous
-                    if new_session:
-                        result[result_index]["datapoints"].extend([[None, None]])
 
-                    # Update result with additional datapoints
-                    result[result_index]["datapoints"].extend(list(zip(values, timestamps)))
+def _add_datapoints(entry: dict, timestamps: list, values: list, memory: MemoryBudget):
+    """Add resampled data points to a result entry, accounting the memory used"""
+    entry["datapoints"].extend(list(zip(values, timestamps)))
+    memory.add(len(timestamps) * DATAPOINT_BYTES)
+
+
+# Decoded arrays of a signal not in the output
+_EMPTY_SIGNAL = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.uint64),
+                 np.zeros(0, dtype=np.uint32))
 
-    return result
 
+def _decode_parts(decoder, frames_parts: [RawFrames]) -> dict:
+    """
+    Decodes frames (in one or more parts) to (timestamps, physical values, raw values, IDs) arrays per signal name.
+    Signals decoded from several parts are merged, ordered by time.
+    """
+    decoded = [decoder.decode(x) for x in frames_parts if len(x) > 0]
+    if len(decoded) == 1:
+        return decoded[0]
+
+    merged = {}
+    for part in decoded:
+        for name, arrays in part.items():
+            merged.setdefault(name, []).append(arrays)
+
+    for name, parts in merged.items():
+        timestamps, values, raws, ids = (np.concatenate(x) for x in zip(*parts))
+        order = np.argsort(timestamps, kind="stable")
+        merged[name] = (timestamps[order], values[order], raws[order], ids[order])
+
+    return merged
 
-def _load_log_file(fs, file, itf_used, passwords):
 
-    # As local function to be able to cache result
+def _query_predicates(signal_queries: [SignalQuery], tp_type: str, start_ns: int, stop_ns: int) -> tuple:
+    """
+    Returns the frames needed by signal queries as (interface, FramePredicate) pairs: the channels, the IDs (or J1939
+    PGNs) of the frames containing the requested signals, and the time interval.
+    """
+    predicates = []
+    for itf, itf_queries in groupby(sorted(signal_queries, key=lambda x: x.itf.value), lambda x: x.itf):
+        itf_queries = list(itf_queries)
+        ids, pgns = set(), set()
+        for db, db_queries in groupby(sorted(itf_queries, key=lambda x: id(x.db)), lambda x: x.db):
+            if tp_type == "":
+                decoder = get_decoder(db, [x.signal_name for x in db_queries])
+                ids.update(decoder.frame_ids or [])
+                pgns.update(decoder.pgns or [])
+            elif db.protocol != "J1939":
+                # TP frames are filtered by the IDs of the DB before re-segmenting
+                ids.update(x & 0x7FFFFFFF for x in db.frames.keys())
+            else:
+                # J1939 TP frames use other PGNs than the data, not filtered
+                ids, pgns = None, None
+                break
+
+        # No IDs and no PGNs selects no frames
+        if ids is not None:
+            ids, pgns = (tuple(sorted(ids)) if len(ids) > 0 or len(pgns) == 0 else None,
+                         tuple(sorted(pgns)) if len(pgns) > 0 else None)
+
+        predicates.append((itf, FramePredicate(channels=tuple(sorted({int(x.chn) for x in itf_queries})),
+                                               ids=ids,
+                                               pgns=pgns,
+                                               start_ns=start_ns,
+                                               stop_ns=stop_ns)))
+
+    return tuple(predicates)
+
+
+def _get_cached(decoded_cache: DecodedCache, log_file: str, signal_queries: [SignalQuery]) -> dict:
+    """Cached (timestamps, values) arrays of a log file per signal query (by id), None unless all are cached"""
+    if decoded_cache is None:
+        return None
+
+    cached = {}
+    for (itf, chn, db), decode_group in groupby(signal_queries, lambda x: (x.itf, x.chn, x.db)):
+        decode_group = list(decode_group)
+        signals = decoded_cache.get(log_file, db, itf, int(chn), [x.signal_name for x in decode_group])
+        if signals is None:
+            return None
+        for signal_query in decode_group:
+            cached[id(signal_query)] = signals[signal_query.signal_name]
+    return cached
+
+
+def _may_match(presence: PresenceIndex, device: str, log_file: str, predicate: FramePredicate) -> bool:
+    """False if a log file is known (from the presence index) not to contain any CAN frames matching the predicate"""
+    if presence is None:
+        return True
+    file_ids = presence.file_ids(device, log_file)
+    return file_ids is None or predicate.matches_ids(file_ids)
+
+
+def _load_log_file(fs, file, itf_used, passwords, predicates: tuple = None):
+    """
+    Loads the frames of the used interfaces of a log file (cached, see read_log_file).
+
+    The time window of the predicates is not part of the cache key, such that zooming and panning within a file hit
+    the cache. The frames of the whole file are cached, and the frames within the time window are returned.
+    """
+
+    # As local function to be able to cache result. The frames are cached as compact arrays (see RawFrames)
     @cache.memoize(timeout=50)
-    def _load_log_file_cache(file_in, itf_used_in, passwords_in):
-        with fs.open(file_in, "rb") as handle:
-            mdf_file = mdf_iter.MdfFile(handle, passwords=passwords_in)
+    def _load_log_file_cache(file_in, itf_used_in, passwords_in, predicates_in):
+        return read_log_file(fs, file_in, itf_used_in, passwords_in, predicates_in)
+
+    predicates_dict = dict(predicates or ())
+    predicates_file = tuple((itf, replace(x, start_ns=None, stop_ns=None)) for itf, x in predicates_dict.items()) \
+        if predicates is not None else None
+
+    with cache_namespace("log_file"):
+        start_epoch, frames_can, frames_lin, can_ids = _load_log_file_cache(file, itf_used, passwords, predicates_file)
+
+    return (start_epoch, _between(frames_can, predicates_dict.get(CanedgeInterface.CAN)),
+            _between(frames_lin, predicates_dict.get(CanedgeInterface.LIN)), can_ids)
+
+
+def _between(frames: RawFrames, predicate: FramePredicate = None) -> RawFrames:
+    """Frames within the time window of a predicate (as a view)"""
+    if predicate is None or (predicate.start_ns is None and predicate.stop_ns is None):
+        return frames
+    return frames.between(-2 ** 63 if predicate.start_ns is None else predicate.start_ns,
+                          2 ** 63 - 1 if predicate.stop_ns is None else predicate.stop_ns)
+
+
+def read_log_file(fs, file, itf_used, passwords, predicates: tuple = None):
+    """
+    Reads the frames of the used interfaces of a log file. Returns the log file start time, the CAN and LIN frames, and
+    the unique IDs of all CAN frames of the file (None if CAN is not used).
+
+    Optional predicates ((interface, FramePredicate) pairs) select the frames to load. Other frames are skipped before
+    the payloads are packed.
+    """
+    predicates_dict = dict(predicates or ())
+    device = fs.path_to_pars(file.lstrip("/"))[0] or ""
+
+    # The file is read lazily while parsing. The fetch time is the time to open the file
+    with timer("fetch", device):
+        handle = fs.open(file, "rb")
+
+    with handle:
+        handle.seek(0, 2)
+        size = handle.tell()
+        handle.seek(0)
+        FETCH_BYTES.observe(size, endpoint=current_endpoint(), device=device)
+
+        with timer("parse", device):
+            mdf_file = mdf_iter.MdfFile(handle, passwords=passwords)
 
             # Get log file start time
             start_epoch = datetime.utcfromtimestamp(mdf_file.get_first_measurement() / 1000000000)
 
             # Load only the interfaces which are used
-            df_raw_can_local = mdf_file.get_data_frame() if CanedgeInterface.CAN in itf_used_in else pd.DataFrame()
-            df_raw_lin_local = mdf_file.get_data_frame_lin() if CanedgeInterface.LIN in itf_used_in else pd.DataFrame()
+            frames_can, can_ids = RawFrames.empty(), None
+            if CanedgeInterface.CAN in itf_used:
+                df_can = mdf_file.get_data_frame()
+                can_ids = np.unique(df_can["ID"].values.astype(np.uint32))
+                frames_can = _to_frames(df_can, predicates_dict.get(CanedgeInterface.CAN))
+                del df_can
+
+            frames_lin = RawFrames.empty()
+            if CanedgeInterface.LIN in itf_used:
+                frames_lin = _to_frames(mdf_file.get_data_frame_lin(), predicates_dict.get(CanedgeInterface.LIN))
+
+    return start_epoch, frames_can, frames_lin, can_ids
 
-        return start_epoch, df_raw_can_local, df_raw_lin_local
 
-    return _load_log_file_cache(file, itf_used, passwords)
+def _to_frames(df: pd.DataFrame, predicate: FramePredicate = None) -> RawFrames:
+    """Converts the rows of a mdf_iter data frame matching the predicate to RawFrames"""
+    if predicate is not None:
+        df = df[predicate.mask(df)]
+    return RawFrames.from_data_frame(df, chunk_rows=CONVERT_CHUNK_ROWS)
@@ -0,0 +1,140 @@
+import difflib
+from dataclasses import dataclass
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max number of signals returned by a search if no limit is requested
+DEFAULT_LIMIT = 1000
+
+
+def calculate_pgn(frame_id: int) -> int:
+    """
+    Returns the J1939 PGN of a (29 bit) frame ID. For PDU1 (PF < 240), the destination address is not part of the PGN.
+    """
+    pgn = (frame_id & 0x03FFFF00) >> 8
+    if (pgn & 0xFF00) >> 8 < 240:
+        pgn &= 0xFFFFFF00
+    return pgn
+
+
+def calculate_pgns(frame_ids: np.ndarray, ide: np.ndarray) -> np.ndarray:
+    """
+    Returns the J1939 PGNs of an array of frame IDs (vectorized calculate_pgn). Standard frames (IDE 0) have no PGN, and
+    are given the PGN 0xFFFFFFFF.
+    """
+    pgns = np.where(ide == 1, (frame_ids.astype(np.uint32) & np.uint32(0x03FFFF00)) >> np.uint32(8),
+                    np.uint32(0xFFFFFFFF))
+    pdu1 = (pgns & np.uint32(0xFF00)) < np.uint32(0xF000)
+    return np.where(pdu1, pgns & np.uint32(0xFFFFFF00), pgns)
+
+
+@dataclass
+class SignalIndexEntry:
+    name: str
+    name_lower: str
+    frame_id: int
+    pgn: int
+
+
+class SignalIndex:
+    """
+    Search index of the signals in a DB, supporting prefix, substring and fuzzy matching, filtering by frame ID or PGN,
+    and pagination.
+
+    Built once per DB, such that searches in large DBs (e.g. J1939 with tens of thousands of signals) return small
+    responses without walking the DB on each request.
+    """
+
+    def __init__(self, db):
+        """
+        :param db: can_decoder SignalDB
+        """
+        self.j1939 = db.protocol == "J1939"
+        self._entries = []
+
+        def add_signals(frame_id, signals):
+            for signal in signals:
+                self._entries.append(SignalIndexEntry(name=signal.name,
+                                                      name_lower=signal.name.lower(),
+                                                      frame_id=frame_id & 0x7FFFFFFF,
+                                                      pgn=calculate_pgn(frame_id) if self.j1939 else None))
+                if signal.is_multiplexer:
+                    for multiplex in signal.signals.values():
+                        add_signals(frame_id, multiplex)
+
+        for frame_id, frame in db.frames.items():
+            add_signals(frame_id, frame.signals)
+
+        # Unique names, in DB order, for fuzzy matching
+        self._names = list(dict.fromkeys(x.name for x in self._entries))
+
+        logger.debug(f"Signal index of {len(self._names)} signals")
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, query: str = "", match: str = "substring", limit: int = None, cursor: int = 0,
+               frame_ids: [int] = None, pgns: [int] = None, seen_ids: set = None) -> ([str], int):
+        """
+        Search signal names.
+
+        :param query: Text to match (case-insensitive). All signals match an empty query
+        :param match: "prefix", "substring" or "fuzzy" (ordered by similarity)
+        :param limit: Max number of signal names returned (None for all)
+        :param cursor: Offset of the first signal returned (from a previous search)
+        :param frame_ids: Only signals of these frame IDs
+        :param pgns: Only signals of these PGNs (J1939)
+        :param seen_ids: Only signals of frames with these IDs (e.g. IDs seen on a device)
+        :return: Signal names and cursor of the next page (None if no more signals)
+        """
+        query_lower = query.lower()
+
+        # Filter by frames
+        entries = self._entries
+        if frame_ids is not None:
+            frame_ids = {x & 0x7FFFFFFF for x in frame_ids}
+            entries = [x for x in entries if x.frame_id in frame_ids]
+        if pgns is not None:
+            pgns = set(pgns)
+            entries = [x for x in entries if x.pgn in pgns]
+        if seen_ids is not None:
+            if self.j1939:
+                seen_pgns = {calculate_pgn(x) for x in seen_ids}
+                entries = [x for x in entries if x.pgn in seen_pgns]
+            else:
+                seen_ids = {x & 0x7FFFFFFF for x in seen_ids}
+                entries = [x for x in entries if x.frame_id in seen_ids]
+
+        # Match names
+        if query_lower == "":
+            names = [x.name for x in entries]
+        elif match == "prefix":
+            names = [x.name for x in entries if x.name_lower.startswith(query_lower)]
+        elif match == "fuzzy":
+            candidates = list(dict.fromkeys(x.name for x in entries))
+            candidates_lower = {}
+            for name in candidates:
+                candidates_lower.setdefault(name.lower(), name)
+
+            # Substring matches first, then close matches ordered by similarity
+            names = [x for x in candidates if query_lower in x.lower()]
+            close = difflib.get_close_matches(query_lower, candidates_lower.keys(), n=len(candidates_lower),
+                                              cutoff=0.6)
+            names.extend(candidates_lower[x] for x in close)
+        elif match == "substring":
+            names = [x.name for x in entries if query_lower in x.name_lower]
+        else:
+            raise ValueError(f"Unknown match: {match}")
+
+        # Unique names (signals may be in several frames)
+        names = list(dict.fromkeys(names))
+
+        if limit is None:
+            return names[cursor:], None
+
+        page = names[cursor:cursor + limit]
+        next_cursor = cursor + limit if cursor + limit < len(names) else None
+
+        return page, next_cursor
@@ -0,0 +1,158 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from canedge_datasource.dashboard import Dashboard
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Attempts of a request rejected while the server is busy (501), and the wait between attempts in seconds
+BUSY_ATTEMPTS = 5
+BUSY_WAIT_S = 2
+
+# Interval in s between checks for user queries to finish before a request is sent
+IDLE_WAIT_S = 0.1
+
+# Header marking the requests of the warm-up, such that user queries take precedence over these
+WARMUP_HEADER = "X-Warmup"
+
+
+@dataclass
+class WarmupResult:
+    requests: int = 0
+    failed: int = 0
+    duration_s: float = 0
+    devices: list = field(default_factory=list)
+
+
+class Warmup:
+    """
+    Fills the caches and indexes of the backend ahead of users, by replaying dashboards (Grafana JSON) for a list of
+    devices over their default time range.
+
+    For each dashboard and device, the template variables are expanded (the device variable set to the device, other
+    variables as configured, else as saved in the dashboard, else the first option found by /search), and the
+    annotation and panel queries are sent in parallel, as Grafana does (merged by the query planner). Requests are sent
+    through a post function, such that the warm-up can run in-process at startup or against a running server.
+
+    The warm-up has a lower priority than users: with a busy function, requests are only sent while no user queries are
+    running, and one dashboard load is in flight at a time. The requests are marked with WARMUP_HEADER, such that the
+    server can preempt these for user queries.
+    """
+
+    def __init__(self, post, dashboards: [Dashboard], devices: [str] = None, values: dict = None, progress=None,
+                 busy=None):
+        """
+        :param post: Function sending a request, post(endpoint, body) -> (status, response body)
+        :param dashboards: Dashboards to replay
+        :param devices: Devices to replay the dashboards for, all devices (found by /search) if None
+        :param values: Optional values of template variables, by variable name
+        :param progress: Optional function called with (loads done, loads total) after each dashboard load
+        :param busy: Optional function returning True while user queries are running
+        """
+        self._post = post
+        self._busy = busy or (lambda: False)
+        self._dashboards = dashboards
+        self._devices = devices
+        self._values = values or {}
+        self._progress = progress
+        self._thread = None
+        self.done = 0
+        self.total = None
+        self.result = None
+
+    def start(self):
+        """Run the warm-up in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def run(self) -> WarmupResult:
+        started = time.time()
+        result = WarmupResult(devices=list(self._devices) if self._devices else self._find_devices())
+
+        loads = [(dashboard, device) for dashboard in self._dashboards for device in result.devices]
+        self.total = len(loads)
+        logger.info(f"Warm-up of {len(self._dashboards)} dashboard(s) for {len(result.devices)} device(s)")
+
+        for index, (dashboard, device) in enumerate(loads):
+            try:
+                requests, failed = self._load(dashboard, device)
+            except Exception as e:
+                logger.warning(f"Warm-up of {dashboard.title} for {device} failed: {e}")
+                requests, failed = 1, 1
+            result.requests += requests
+            result.failed += failed
+            self.done = index + 1
+
+            logger.info(f"Warm-up: {index + 1}/{len(loads)} dashboard loads ({dashboard.title}, {device}) in "
+                        f"{time.time() - started:.1f} s")
+            if self._progress is not None:
+                self._progress(index + 1, len(loads))
+
+        result.duration_s = time.time() - started
+        logger.info(f"Warm-up done: {result.requests} requests ({result.failed} failed) in {result.duration_s:.1f} s")
+        self.result = result
+        return result
+
+    def _load(self, dashboard: Dashboard, device: str) -> (int, int):
+        """Loads a dashboard for a device. Returns the number of requests and failed requests"""
+        values = self._resolve_values(dashboard, device)
+        start, stop = dashboard.time_range()
+
+        requests = [("/annotations", x) for x in dashboard.annotation_requests(values, start, stop)]
+        requests += [("/query", x) for x in dashboard.query_requests(values, start, stop)]
+        if len(requests) == 0:
+            return 0, 0
+
+        with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            statuses = list(executor.map(lambda x: self._send(*x), requests))
+
+        return len(requests), sum(1 for x in statuses if x != 200)
+
+    def _send(self, endpoint: str, body: dict) -> int:
+        status = None
+        for _ in range(BUSY_ATTEMPTS):
+            while self._busy():
+                time.sleep(IDLE_WAIT_S)
+            status, _ = self._post(endpoint, body)
+            if status != 501:
+                break
+            time.sleep(BUSY_WAIT_S)
+        return status
+
+    def _resolve_values(self, dashboard: Dashboard, device: str) -> dict:
+        fixed = dict(dashboard.default_values(), **self._values)
+        fixed.update({x: device for x in device_variables(dashboard)})
+
+        # Variables are resolved in order, as these may refer to the preceding variables
+        values = dict(fixed)
+        for name in [x.name for x in dashboard.variables if x.query is not None and x.name not in fixed]:
+            status, options = self._post("/search", dict(dashboard.search_requests(values))[name])
+            if status == 200 and isinstance(options, list) and len(options) > 0:
+                option = options[0]
+                values[name] = option["value"] if isinstance(option, dict) else option
+        return values
+
+    def _find_devices(self) -> [str]:
+        status, devices = self._post("/search", {"target": json.dumps({"search": "device"})})
+        if status != 200 or not isinstance(devices, list):
+            logger.warning(f"Unable to list devices for the warm-up ({status})")
+            return []
+        return [str(x) for x in devices]
+
+
+def device_variables(dashboard: Dashboard) -> [str]:
+    """Names of the template variables selecting devices (device or device_name searches)"""
+    names = []
+    for variable in dashboard.variables:
+        try:
+            query = json.loads(variable.query or "")
+        except ValueError:
+            continue
+        if isinstance(query, dict) and query.get("search") in ("device", "device_name"):
+            names.append(variable.name)
+    return names
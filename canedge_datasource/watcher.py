@@ -0,0 +1,80 @@
+import json
+import threading
+
+from canedge_datasource.databases import DatabaseStore
+
+import logging
+logger = logging.getLogger(__name__)
+
+PASSWORDS_FILE = "passwords.json"
+
+
+class RootWatcher:
+    """
+    Polls the root of the file system for changed DBs (*.dbc) and passwords file (passwords.json), such that changes are
+    applied without restarting the server (which loses all caches).
+
+    Only the changed DBs are compiled again, replacing the previous DBs once compiled. Cached results are keyed by the
+    versions of the DBs used (see db_versions), such that results derived from other DBs stay cached. Log files are
+    cached per passwords, such that changed passwords apply to the next read.
+    """
+
+    def __init__(self, fs, dbs: DatabaseStore, on_passwords, interval_s: float = 60):
+        """
+        :param fs: FS mounted in CANedge "root"
+        :param dbs: DBs to refresh
+        :param on_passwords: Called with the passwords when the passwords file changes (empty if removed)
+        :param interval_s: Interval between polls in seconds
+        """
+        self._fs = fs
+        self._dbs = dbs
+        self._on_passwords = on_passwords
+        self._interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = None
+        self._passwords_version = self._get_passwords_version()
+
+    def start(self):
+        """Start polling in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="root-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self._interval_s):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Polling the data root for changes failed: {e}")
+
+    def poll(self) -> bool:
+        """Applies changed DBs and passwords. Returns True if anything changed"""
+        changed = self._dbs.refresh() if isinstance(self._dbs, DatabaseStore) else []
+
+        version = self._get_passwords_version()
+        if version != self._passwords_version:
+            passwords = {}
+            if version is not None:
+                try:
+                    with self._fs.open(PASSWORDS_FILE) as fp:
+                        passwords = json.load(fp)
+                except Exception as e:
+                    # E.g. read while being written, retried on the next poll
+                    logger.warning(f"Unable to load passwords file: {e}")
+                    return len(changed) > 0
+
+            logger.info("Passwords file changed, reloaded")
+            self._passwords_version = version
+            self._on_passwords(passwords)
+            changed.append(PASSWORDS_FILE)
+
+        return len(changed) > 0
+
+    def _get_passwords_version(self) -> str:
+        for info in self._fs.ls("", detail=True):
+            if info["name"].lstrip("/") == PASSWORDS_FILE:
+                return self._fs.get_file_version(info)
+        return None
@@ -1,10 +1,12 @@
 import json
 import logging
+import os
 import sys
 import click
 from pathlib import Path
 from canedge_datasource import start_server
 from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.databases import DatabaseStore
 from urllib.parse import urlparse
 from urllib.request import url2pathname
 
@@ -20,8 +22,53 @@ from urllib.request import url2pathname
 @click.option('--loglevel', required=False, default="INFO",
               type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]), help='Logging level')
 @click.option('--tp_type', required=False, default="", type=str, help='ISO TP type (uds, j1939, nmea)')
-
-def main(data_url, port, limit, s3_ak, s3_sk, s3_bucket, s3_cert, loglevel, tp_type):
+@click.option('--batch_ms', required=False, default=10, type=int,
+              help='Window in ms for merging concurrent panel queries (0 to disable)')
+@click.option('--deadline', required=False, default=0, type=float,
+              help='Time budget per query in seconds, returning partial results when exceeded (0 to disable)')
+@click.option('--coverage', is_flag=True, default=False,
+              help='Spread the data limit over evenly spaced files across long time ranges')
+@click.option('--cache_dir', required=False, default=None, type=click.Path(file_okay=False),
+              help='Local directory for caches persisted across restarts (e.g. log file meta data)')
+@click.option('--catalog_refresh', required=False, default=300, type=float,
+              help='Interval in seconds between background refreshes of the device list and comments')
+@click.option('--chunk_rows', required=False, default=500000, type=int,
+              help='Max number of frames decoded at a time when processing a log file (0 for whole files)')
+@click.option('--max_query_mb', required=False, default=0, type=float,
+              help='Memory ceiling per query in MB, returning partial results when exceeded (0 to disable)')
+@click.option('--max_process_mb', required=False, default=0, type=float,
+              help='Memory ceiling of the process in MB, degrading or rejecting queries near it (0 to disable)')
+@click.option('--reload', required=False, default=60, type=float,
+              help='Interval in seconds between checks for changed DBs and passwords file (0 to disable)')
+@click.option('--predecode', required=False, multiple=True, type=str,
+              help='DB, optionally with signals (e.g. canmod-gps:Speed,Latitude), decoded in the background for new log '
+                   'files (repeatable)')
+@click.option('--predecode_interval', required=False, default=60, type=float,
+              help='Interval in seconds between checks for new log files to pre-decode')
+@click.option('--predecode_workers', required=False, default=1, type=int,
+              help='Max number of log files pre-decoded in parallel')
+@click.option('--predecode_mb', required=False, default=256, type=float,
+              help='Max size of the pre-decoded signals kept in memory in MB')
+@click.option('--warmup', required=False, multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='Dashboard (Grafana JSON) replayed in the background at startup to warm up the caches (repeatable)')
+@click.option('--warmup_device', required=False, multiple=True, type=str,
+              help='Device to replay the warm-up dashboards for (repeatable, all devices if not set)')
+@click.option('--threads', required=False, default=16, type=int, help='Number of threads serving requests')
+@click.option('--fleet_workers', required=False, default=4, type=int,
+              help='Max number of devices processed in parallel by a fleet query')
+@click.option('--slow_query', required=False, default=0, type=float,
+              help='Log requests taking longer than this many seconds to the slow query log (0 to disable)')
+@click.option('--slow_query_log', required=False, default=None, type=click.Path(dir_okay=False),
+              help='Slow query log file (JSON lines). Logged as warnings if not set')
+@click.option('--profile_dir', required=False, default=None, type=click.Path(file_okay=False),
+              help='Directory for cProfile dumps of requests with "debug": true in the target')
+@click.option('--metrics_device_labels', is_flag=True, default=False,
+              help='Label the stage, fetch and skipped file metrics by device (one series per device)')
+
+def main(data_url, port, limit, s3_ak, s3_sk, s3_bucket, s3_cert, loglevel, tp_type, batch_ms, deadline, coverage,
+         cache_dir, catalog_refresh, chunk_rows, max_query_mb, max_process_mb, reload, predecode, predecode_interval,
+         predecode_workers, predecode_mb, warmup, warmup_device, fleet_workers, threads, slow_query, slow_query_log,
+         profile_dir, metrics_device_labels):
     """
     CANedge Grafana Datasource. Provide a URL pointing to a CANedge data root.
 
@@ -100,30 +147,51 @@ def main(data_url, port, limit, s3_ak, s3_sk, s3_bucket, s3_cert, loglevel, tp_t
         logging.error(f"Unsupported data URL: {data_url}")
         sys.exit(-1)
 
-    # Load DBs in root
-    logging.getLogger("canmatrix").setLevel(logging.ERROR)
-    import can_decoder
-    dbs = {}
-    for db_path in fs.glob("*.dbc"):
-        db_name = Path(db_path).stem.lower()
-        with fs.open(db_path) as fp:
-            db = can_decoder.load_dbc(fp)
-            dbs[db_name] = {"db": db, "signals": db.signals()}
-
-    print(f"Loaded DBs: {', '.join(dbs.keys())}")
+    # DBs in root, loaded in the background once the server is started
+    dbs = load_dbs(fs, cache_dir)
+    print(f"Found DBs: {', '.join(dbs.keys())}")
 
     # Load passwords file if exists
+    try:
+        passwords = load_passwords(fs)
+    except Exception as e:
+        logging.error(f"Unable to load passwords file")
+        sys.exit(-1)
+
+    start_server(fs, dbs, passwords, port, limit, tp_type, batch_ms, deadline, coverage,
+                 cache_dir=cache_dir,
+                 catalog_refresh_s=catalog_refresh,
+                 chunk_rows=chunk_rows,
+                 max_query_mb=max_query_mb,
+                 slow_query_s=slow_query,
+                 slow_query_log=slow_query_log,
+                 profile_dir=profile_dir,
+                 max_process_mb=max_process_mb,
+                 reload_s=reload,
+                 predecode=list(predecode),
+                 predecode_interval_s=predecode_interval,
+                 predecode_workers=predecode_workers,
+                 predecode_mb=predecode_mb,
+                 warmup=list(warmup),
+                 warmup_devices=list(warmup_device),
+                 fleet_workers=fleet_workers,
+                 threads=threads,
+                 device_labels=metrics_device_labels)
+
+def load_dbs(fs, cache_dir: str = None) -> DatabaseStore:
+    """Lists the DBs (*.dbc) in the root of the file system by lower case name. DBs are parsed on first use"""
+    return DatabaseStore(fs, cache_dir=os.path.join(cache_dir, "dbs") if cache_dir is not None else None)
+
+
+def load_passwords(fs) -> dict:
+    """Loads the passwords file (passwords.json) in the root of the file system, if it exists"""
     passwords = {}
     if fs.isfile("passwords.json"):
-        try:
-            with fs.open("passwords.json") as fp:
-                passwords = json.load(fp)
-                print("Loaded passwords file")
-        except Exception as e:
-            logging.error(f"Unable to load passwords file")
-            sys.exit(-1)
-
-    start_server(fs, dbs, passwords, port, limit, tp_type)
+        with fs.open("passwords.json") as fp:
+            passwords = json.load(fp)
+            print("Loaded passwords file")
+    return passwords
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,65 @@
+import json
+import logging
+import sys
+import urllib.error
+import urllib.request
+import click
+from canedge_datasource.dashboard import Dashboard
+from canedge_datasource.warmup import WARMUP_HEADER, Warmup
+
+
+@click.command()
+@click.argument('url', envvar='CANEDGE_DATASOURCE_URL')
+@click.argument('dashboards', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--device', 'devices', required=False, multiple=True, type=str,
+              help='Device to replay the dashboards for (repeatable, all devices if not set)')
+@click.option('--var', 'variables', required=False, multiple=True, type=str,
+              help='Value of a template variable as NAME=VALUE (repeatable, repeated names give multiple values)')
+@click.option('--timeout', required=False, default=600, type=float, help='Timeout per request in seconds')
+@click.option('--loglevel', required=False, default="INFO",
+              type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]), help='Logging level')
+def main(url, dashboards, devices, variables, timeout, loglevel):
+    """
+    Warms up the caches of a running CANedge Grafana Datasource, by replaying the panel queries of dashboards (Grafana
+    JSON, e.g. dashboard_templates/dashboard-template-simple.json) for a list of devices over their default time range.
+
+    Example:
+
+        python canedge_warmup_cli.py http://localhost:5000 dashboard.json --device 2F6913DB --device AABBCCDD
+    """
+
+    logging.basicConfig(level=getattr(logging, loglevel.upper()),
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def post(endpoint: str, body: dict) -> (int, object):
+        request = urllib.request.Request(url.rstrip("/") + endpoint, data=json.dumps(body).encode(),
+                                         headers={"Content-Type": "application/json", WARMUP_HEADER: "1"},
+                                         method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            return e.code, None
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logging.warning(f"Request to {endpoint} failed: {e}")
+            return None, None
+
+    values = {}
+    for variable in variables:
+        name, _, value = variable.partition("=")
+        values.setdefault(name, []).append(value)
+    values = {k: v[0] if len(v) == 1 else v for k, v in values.items()}
+
+    warmup = Warmup(post, [Dashboard.load(x) for x in dashboards], devices=list(devices) or None, values=values,
+                    progress=lambda done, total: click.echo(f"{done}/{total} dashboard loads"))
+    result = warmup.run()
+
+    click.echo(f"Warm-up done: {result.requests} requests ({result.failed} failed) for {len(result.devices)} "
+               f"device(s) in {result.duration_s:.1f} s")
+
+    if result.requests > 0 and result.failed == result.requests:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+CPU micro-benchmarks of the decode pipeline, on synthetic raw CAN/LIN frames.
+
+Frames are generated at a configurable bus load, ID mix and payload length mix, optionally with UDS, J1939 (BAM) and
+NMEA 2000 (fast packet) TP sequences. Each stage of time_series_phy_data (frame selection and conversion, filtering,
+decoding and resampling), the full function, and MultiFrameDecoder.combine_tp_frames are timed separately across
+input sizes. The generator is seeded, such that runs are reproducible.
+
+Results are saved as JSON. Passing the results of a previous run as baseline reports stages slower than the baseline by
+more than the threshold, and exits with status 1.
+
+Examples:
+
+    python test/benchmark_decode.py --sizes 10000,100000 --output bench.json
+    python test/benchmark_decode.py --baseline bench.json --threshold 0.2
+"""
+import io
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+import can_decoder
+import canedge_browser
+import click
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from canedge_datasource import signal
+from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.decoder import get_decoder
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface, SampleMethod
+from canedge_datasource.raw_frames import FramePredicate
+from canedge_datasource.resample import SignalResampler
+from canedge_datasource.signal import SignalQuery, time_series_phy_data
+from utils import MultiFrameDecoder
+
+# Start of the synthetic data
+START_NS = 1640995200 * 10 ** 9
+
+# Response ID of the UDS sequences, PGN of the NMEA 2000 fast packets (GNSS position data) and source address
+UDS_ID = 2025
+NMEA_PGN = 129029
+SOURCE_ADDRESS = 0x23
+
+
+def generate_frames(count: int, bus_load: float = 2000, ids: int = 50, extended: float = 0.5,
+                    lengths: dict = None, channels: int = 2, tp_type: str = "", tp_share: float = 0.1,
+                    seed: int = 0) -> pd.DataFrame:
+    """
+    Generates a mdf_iter CAN data frame (TimeStamp index, BusChannel, ID, IDE, DLC, DataLength, DataBytes).
+
+    :param count: Number of frames
+    :param bus_load: Frames per second (Poisson arrivals)
+    :param ids: Number of distinct IDs (equally frequent)
+    :param extended: Share of the IDs which are extended (29 bit)
+    :param lengths: Payload lengths and their weights (by ID), e.g. {8: 0.8, 4: 0.1, 64: 0.1}
+    :param channels: Number of channels the IDs are spread over
+    :param tp_type: Optional TP type (uds, j1939, nmea) of the TP sequences mixed into the traffic
+    :param tp_share: Share of the frames which are part of TP sequences
+    :param seed: Seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    lengths = lengths or {8: 1.0}
+
+    timestamps = START_NS + np.cumsum(rng.exponential(10 ** 9 / bus_load, count)).astype(np.int64)
+
+    # ID pool, each ID with a fixed channel and payload length
+    id_extended = rng.random(ids) < extended
+    id_values = np.where(id_extended, rng.integers(0x800, 0x1FFFFFFF, ids), rng.integers(0, 0x7FF, ids))
+    id_channels = rng.integers(1, channels + 1, ids)
+    id_lengths = rng.choice(list(lengths.keys()), ids, p=np.asarray(list(lengths.values())) / sum(lengths.values()))
+
+    picks = rng.integers(0, ids, count)
+    frame_ids = id_values[picks].astype(np.uint32)
+    frame_ide = id_extended[picks]
+    frame_channels = id_channels[picks].astype(np.uint8)
+    frame_lengths = id_lengths[picks].astype(np.uint8)
+    payloads = rng.integers(0, 256, (count, int(max(lengths.keys()))), dtype=np.uint8)
+    data_bytes = [payload[:length] for payload, length in zip(payloads.tolist(), frame_lengths.tolist())]
+
+    # Replace a share of the frames (evenly spread over the time range) with TP sequences, in sequence order
+    if tp_type != "":
+        tp_frames = generate_tp_frames(tp_type, int(count * tp_share), rng)
+        positions = np.sort(rng.choice(count, len(tp_frames), replace=False))
+        for position, (frame_id, ide, payload) in zip(positions.tolist(), tp_frames):
+            frame_ids[position], frame_ide[position], frame_channels[position] = frame_id, ide, 1
+            frame_lengths[position], data_bytes[position] = len(payload), payload
+
+    index = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True), name="TimeStamp")
+    return pd.DataFrame({"BusChannel": frame_channels,
+                         "ID": frame_ids,
+                         "IDE": frame_ide,
+                         "DLC": frame_lengths,
+                         "DataLength": frame_lengths,
+                         "DataBytes": data_bytes}, index=index)
+
+
+def generate_lin_frames(count: int, bus_load: float = 100, seed: int = 0) -> pd.DataFrame:
+    """Generates a mdf_iter LIN data frame (IDs 0-63, payloads of 2, 4 or 8 bytes by ID)"""
+    rng = np.random.default_rng(seed)
+    timestamps = START_NS + np.cumsum(rng.exponential(10 ** 9 / bus_load, count)).astype(np.int64)
+    id_lengths = rng.choice([2, 4, 8], 64)
+    frame_ids = rng.integers(0, 64, count).astype(np.uint32)
+    payloads = rng.integers(0, 256, (count, 8), dtype=np.uint8).tolist()
+
+    index = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True), name="TimeStamp")
+    return pd.DataFrame({"BusChannel": np.ones(count, dtype=np.uint8),
+                         "ID": frame_ids,
+                         "DataLength": id_lengths[frame_ids].astype(np.uint8),
+                         "DataBytes": [x[:n] for x, n in zip(payloads, id_lengths[frame_ids].tolist())]}, index=index)
+
+
+def generate_tp_frames(tp_type: str, count: int, rng) -> [(int, bool, list)]:
+    """Generates about count frames of complete TP sequences as (ID, extended, payload) tuples"""
+    frames = []
+    sequence = 0
+    while len(frames) < count:
+        if tp_type == "uds":
+            # First frame with the length (12 bits), consecutive frames with a 4 bit sequence number
+            data = rng.integers(0, 256, int(rng.integers(8, 64))).tolist()
+            frames.append((UDS_ID, False, [0x10 | (len(data) >> 8), len(data) & 0xFF] + data[:6]))
+            for number, offset in enumerate(range(6, len(data), 7)):
+                frames.append((UDS_ID, False, [0x20 | ((number + 1) & 0x0F)] + _pad(data[offset:offset + 7], 7)))
+        elif tp_type == "nmea":
+            # Fast packets: sequence counter (3 bits) and frame counter (5 bits), length in the first frame
+            frame_id = (3 << 26) | (NMEA_PGN << 8) | SOURCE_ADDRESS
+            data = rng.integers(0, 256, 43).tolist()
+            counter = (sequence & 0x07) << 5
+            frames.append((frame_id, True, [counter, len(data)] + data[:6]))
+            for number, offset in enumerate(range(6, len(data), 7)):
+                frames.append((frame_id, True, [counter | (number + 1)] + _pad(data[offset:offset + 7], 7)))
+        elif tp_type == "j1939":
+            # BAM: connection management (TP.CM, PGN 0xEC00) announcing the size and PGN, then data transfers (TP.DT,
+            # PGN 0xEB00) with a sequence number
+            pgn = 0xFEE3
+            data = rng.integers(0, 256, int(rng.integers(9, 100))).tolist()
+            packets = (len(data) + 6) // 7
+            frames.append(((7 << 26) | (0xECFF << 8) | SOURCE_ADDRESS, True,
+                           [0x20, len(data) & 0xFF, len(data) >> 8, packets, 0xFF,
+                            pgn & 0xFF, (pgn >> 8) & 0xFF, pgn >> 16]))
+            for number in range(packets):
+                frames.append(((7 << 26) | (0xEBFF << 8) | SOURCE_ADDRESS, True,
+                               [number + 1] + _pad(data[number * 7:number * 7 + 7], 7)))
+        else:
+            raise ValueError(f"Unknown TP type: {tp_type}")
+        sequence += 1
+
+    return frames
+
+
+def _pad(data: list, length: int) -> list:
+    return data + [0xFF] * (length - len(data))
+
+
+def generate_db(df: pd.DataFrame, signal_bits: int = 16, max_signals: int = 8):
+    """A DB with a frame per ID of the data frame, each with little endian signals covering the payload"""
+    lines = ['VERSION ""', "", "NS_ :", "", "BS_:", "", "BU_: X", ""]
+    ids = df.drop_duplicates("ID")
+    for number, (frame_id, ide, length) in enumerate(zip(ids["ID"], ids["IDE"], ids["DataLength"])):
+        lines.append(f"BO_ {int(frame_id) | (0x80000000 if ide else 0)} F{number}: {int(length)} X")
+        for signal_number in range(min(int(length) * 8 // signal_bits, max_signals)):
+            lines.append(f" SG_ S{number}_{signal_number} : {signal_number * signal_bits}|{signal_bits}@1+ (0.1,0) "
+                         f'[0|0] "" X')
+        lines.append("")
+
+    return can_decoder.load_dbc(io.BytesIO("\n".join(lines).encode()))
+
+
+class FakeFs(CanedgeFileSystem):
+    """File system serving a single (synthetic) log file"""
+
+    def __init__(self):
+        pass
+
+    def stat(self, path, **kwargs):
+        return {"size": 1 << 20}
+
+
+def timed(function, repeat: int) -> (float, object):
+    """Min time of repeated calls in s, and the result of the last call"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_stages(df: pd.DataFrame, db, signals: int, interval_ms: int, repeat: int) -> dict:
+    """Times the stages of time_series_phy_data for the frames of a single log file"""
+    timings = {}
+
+    # Signals requested on channel 1 (of the frames of the IDs on channel 1, each ID is on one channel)
+    channel_ids = set(np.unique(df["ID"].values[df["BusChannel"].values == 1]).tolist())
+    names = [x.name for frame_id, frame in db.frames.items() if frame_id & 0x7FFFFFFF in channel_ids
+             for x in frame.signals][::3][:signals]
+    decoder = get_decoder(db, names)
+    predicate = FramePredicate(channels=(1,), ids=tuple(decoder.frame_ids))
+
+    timings["convert"], frames = timed(lambda: signal._to_frames(df, predicate), repeat)
+    timings["convert_unfiltered"], _ = timed(lambda: signal._to_frames(df), repeat)
+
+    timings["filter"], frames = timed(lambda: frames[decoder.matches(frames[frames.channel == 1])], repeat)
+    assert len(frames) > 0, "No frames of the requested signals on channel 1"
+    timings["decode"], decoded = timed(lambda: signal._decode_parts(decoder, [frames]), repeat)
+
+    def resample():
+        for name in names:
+            resampler = SignalResampler(interval_ms, SampleMethod.MAX, origin_ns=0)
+            timestamps, values, _, _ = decoded.get(name, signal._EMPTY_SIGNAL)
+            resampler.add(timestamps, values)
+            resampler.flush()
+    timings["resample"], _ = timed(resample, repeat)
+
+    # The full function, with the log file served from memory
+    signal_queries = [SignalQuery(refid="A", target=name, device="AABBCCDD", itf=CanedgeInterface.CAN,
+                                  chn=CanedgeChannel.CH1, db=db, signal_name=name, interval_ms=interval_ms,
+                                  method=SampleMethod.MAX) for name in names]
+    start_date = datetime.fromtimestamp(START_NS / 10 ** 9, timezone.utc)
+    stop_date = datetime.fromtimestamp(int(df.index[-1].value) / 10 ** 9 + 1, timezone.utc)
+
+    def load_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        return (None, signal._to_frames(df, dict(predicates or ()).get(CanedgeInterface.CAN)),
+                signal._to_frames(df.iloc[:0]), None)
+
+    with mock.patch.object(canedge_browser, "get_log_files", lambda *args, **kwargs: ["AABBCCDD/00000001/00000001.MF4"]), \
+            mock.patch.object(signal, "_load_log_file", load_log_file):
+        timings["time_series_phy_data"], _ = timed(
+            lambda: time_series_phy_data(FakeFs(), signal_queries, start_date, stop_date, limit_mb=1000, passwords={},
+                                         tp_type=""), repeat)
+
+    return timings
+
+
+def benchmark_lin(df: pd.DataFrame, repeat: int) -> dict:
+    return {"convert_lin": timed(lambda: signal._to_frames(df), repeat)[0]}
+
+
+def benchmark_tp(df: pd.DataFrame, tp_type: str, repeat: int) -> dict:
+    decoder = MultiFrameDecoder(tp_type)
+    return {f"tp_{tp_type}": timed(lambda: decoder.combine_tp_frames(df), repeat)[0]}
+
+
+def compare(results: [dict], baseline: [dict], threshold: float) -> [str]:
+    """Returns the stages slower than the baseline by more than the threshold (relative)"""
+    reference = {(x["stage"], x["frames"]): x["seconds"] for x in baseline}
+    regressions = []
+    for result in results:
+        seconds = reference.get((result["stage"], result["frames"]))
+        if seconds is not None and result["seconds"] > seconds * (1 + threshold):
+            regressions.append(f"{result['stage']} ({result['frames']} frames): {result['seconds']:.4f} s, "
+                               f"baseline {seconds:.4f} s (+{result['seconds'] / seconds - 1:.0%})")
+    return regressions
+
+
+def _parse_lengths(value: str) -> dict:
+    pairs = [x.split(":") for x in value.split(",")]
+    return {int(length): float(weight) for length, weight in pairs}
+
+
+@click.command()
+@click.option('--sizes', default="10000,100000", help='Comma separated numbers of frames')
+@click.option('--tp_sizes', default="2000,20000", help='Comma separated numbers of frames for the TP benchmarks')
+@click.option('--bus_load', default=2000.0, help='Frames per second')
+@click.option('--ids', default=50, help='Number of distinct IDs')
+@click.option('--extended', default=0.5, help='Share of extended IDs')
+@click.option('--lengths', default="8:0.8,4:0.1,64:0.1", help='Payload lengths and weights (length:weight,...)')
+@click.option('--tp_types', default="uds,j1939,nmea", help='Comma separated TP types (empty to skip)')
+@click.option('--tp_share', default=0.2, help='Share of frames in TP sequences')
+@click.option('--signals', default=10, help='Number of signals requested')
+@click.option('--interval_ms', default=1000, help='Resampling interval in ms')
+@click.option('--repeat', default=3, help='Repetitions per stage (the fastest is reported)')
+@click.option('--seed', default=0, help='Seed of the generator')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Save the results as JSON')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Results of a previous run to compare with')
+@click.option('--threshold', default=0.2, help='Relative slowdown reported as regression')
+def main(sizes, tp_sizes, bus_load, ids, extended, lengths, tp_types, tp_share, signals, interval_ms, repeat, seed,
+         output, baseline, threshold):
+    """
+    Benchmark the decode pipeline on synthetic frames.
+    """
+    results = []
+
+    def add(frames: int, timings: dict):
+        for stage, seconds in timings.items():
+            results.append({"stage": stage, "frames": frames, "seconds": seconds,
+                            "frames_per_s": frames / seconds if seconds > 0 else None})
+            print(f"{stage:<24}{frames:>10} frames{seconds:>12.4f} s{frames / max(seconds, 1e-12):>14.0f} frames/s")
+
+    for size in [int(x) for x in sizes.split(",") if x]:
+        df = generate_frames(size, bus_load=bus_load, ids=ids, extended=extended, lengths=_parse_lengths(lengths),
+                             seed=seed)
+        add(size, benchmark_stages(df, generate_db(df), signals, interval_ms, repeat))
+        add(size, benchmark_lin(generate_lin_frames(size, seed=seed), repeat))
+
+    for tp_type in [x for x in tp_types.split(",") if x]:
+        for size in [int(x) for x in tp_sizes.split(",") if x]:
+            df = generate_frames(size, bus_load=bus_load, ids=ids, extended=extended, lengths={8: 1.0},
+                                 tp_type=tp_type, tp_share=tp_share, seed=seed)
+            add(size, benchmark_tp(df, tp_type, repeat))
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"meta": {"time": datetime.now(timezone.utc).isoformat(),
+                                "python": platform.python_version(),
+                                "numpy": np.__version__,
+                                "pandas": pd.__version__,
+                                "machine": platform.machine(),
+                                "options": click.get_current_context().params},
+                       "results": results}, f, indent=2)
+        print(f"Saved results: {output}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)["results"], threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+        print(f"No regressions (threshold {threshold:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+End-to-end load test of the backend.
+
+The backend is started in-process against a data root, served either from a local folder or from a local S3 stand-in
+(moto server, requires moto and s3fs), optionally with injected per-request latency and limited bandwidth. Dashboards
+(Grafana JSON, e.g. dashboard_templates/*.json) are replayed by N concurrent simulated users: each dashboard load
+resolves the template variables through /search, requests the annotations, and sends the panel queries in parallel
+(as Grafana does).
+
+Reports the latency percentiles (p50/p95/p99) per endpoint, the throughput, the rate of rejected (501) requests and
+the peak RSS of the process (sampled from /metrics). Results can be saved as JSON.
+
+Examples:
+
+    python test/load_test.py /data/root --users 8 --iterations 5 --var DEVICE=2F6913DB
+    python test/load_test.py /data/root --latency_ms 40 --bandwidth_mbps 50 --random_ranges --output load.json
+    python test/load_test.py /data/root --moto --users 4
+"""
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from pathlib import Path
+
+import click
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import canedge_datasource
+from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.dashboard import Dashboard, parse_time
+from canedge_datasource_cli import load_dbs, load_passwords
+
+DASHBOARDS = str(Path(__file__).resolve().parent.parent / "dashboard_templates" / "*.json")
+
+
+class ThrottledFileSystem(CanedgeFileSystem):
+    """
+    CanedgeFileSystem with a fixed latency per request (listing, opening and each read) and a limited bandwidth, as a
+    stand-in for a remote object store.
+    """
+
+    def __init__(self, *args, latency_s: float = 0, bandwidth: float = None, **kwargs):
+        """
+        :param latency_s: Latency per request in s
+        :param bandwidth: Bandwidth in bytes/s (None for unlimited)
+        """
+        super().__init__(*args, **kwargs)
+        self.latency_s = latency_s
+        self.bandwidth = bandwidth
+
+    def ls(self, path, **kwargs):
+        time.sleep(self.latency_s)
+        return super().ls(path, **kwargs)
+
+    def open(self, path, mode="rb", **kwargs):
+        time.sleep(self.latency_s)
+        return ThrottledFile(super().open(path, mode, **kwargs), self.latency_s, self.bandwidth)
+
+
+class ThrottledFile:
+    """File wrapper delaying reads by the latency and the transfer time"""
+
+    def __init__(self, handle, latency_s: float, bandwidth: float = None):
+        self._handle = handle
+        self._latency_s = latency_s
+        self._bandwidth = bandwidth
+
+    def read(self, size=-1):
+        data = self._handle.read(size)
+        time.sleep(self._latency_s + (len(data) / self._bandwidth if self._bandwidth else 0))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+    def __iter__(self):
+        return iter(self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._handle.close()
+
+
+def moto_file_system(data_dir: str, **kwargs) -> CanedgeFileSystem:
+    """Starts a local moto S3 server, uploads the data root to a bucket, and returns a file system of the bucket"""
+    from moto.server import ThreadedMotoServer
+    import s3fs
+
+    port = _free_port()
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+
+    credentials = dict(key="testing", secret="testing", client_kwargs={"endpoint_url": endpoint})
+    s3 = s3fs.S3FileSystem(**credentials)
+    s3.mkdir("canedge")
+    for path in Path(data_dir).rglob("*"):
+        if path.is_file():
+            s3.put_file(str(path), f"canedge/{path.relative_to(data_dir).as_posix()}")
+
+    return ThrottledFileSystem(protocol="s3", base_path="canedge", use_listings_cache=False, **credentials, **kwargs)
+
+
+class LoadTest:
+    """Simulated users replaying dashboards against a running backend"""
+
+    def __init__(self, url: str, dashboards: [Dashboard], values: dict, start=None, stop=None,
+                 random_ranges: bool = False, think_s: float = 0, seed: int = 0):
+        self.url = url
+        self.dashboards = dashboards
+        self.values = values
+        self.start = start
+        self.stop = stop
+        self.random_ranges = random_ranges
+        self.think_s = think_s
+        self.samples = []
+        self.peak_rss = 0
+        self._lock = threading.Lock()
+        self._seed = seed
+
+    def request(self, endpoint: str, body: dict = None) -> (int, object):
+        """Sends a request, recording its latency and status. Returns the status and the decoded response"""
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + endpoint, data=data, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, b""
+        except OSError:
+            status, payload = 0, b""
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self.samples.append((endpoint, status, latency))
+
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, payload
+
+    def resolve_values(self, dashboard: Dashboard) -> dict:
+        """Values of the template variables: as configured, else as saved, else the first option found by /search"""
+        values = dict(dashboard.default_values(), **self.values)
+        for name, request in dashboard.search_requests(values):
+            status, options = self.request("/search", request)
+            if name in self.values or name in dashboard.default_values():
+                continue
+            if status == 200 and isinstance(options, list) and len(options) > 0:
+                option = options[0]
+                values[name] = option["value"] if isinstance(option, dict) else option
+        return values
+
+    def load_dashboard(self, dashboard: Dashboard, rng: random.Random):
+        values = self.resolve_values(dashboard)
+
+        start, stop = dashboard.time_range()
+        start, stop = self.start or start, self.stop or stop
+        if self.random_ranges:
+            # Zoom to a random part of the range (of at least a tenth of it)
+            span = (stop - start) * rng.uniform(0.1, 1)
+            start = start + (stop - start - span) * rng.random()
+            stop = start + span
+
+        requests = [("/annotations", x) for x in dashboard.annotation_requests(values, start, stop)]
+        requests += [("/query", x) for x in dashboard.query_requests(values, start, stop)]
+
+        # Panels are loaded in parallel
+        with ThreadPoolExecutor(max_workers=max(len(requests), 1)) as executor:
+            list(executor.map(lambda x: self.request(*x), requests))
+
+    def user(self, index: int, iterations: int):
+        rng = random.Random(self._seed + index)
+        for _ in range(iterations):
+            for dashboard in self.dashboards:
+                self.load_dashboard(dashboard, rng)
+                time.sleep(rng.uniform(0, 2 * self.think_s))
+
+    def sample_rss(self, stop: threading.Event):
+        """Samples the RSS of the backend every 0.5 s until stopped (and once more when stopped)"""
+        while True:
+            try:
+                with urllib.request.urlopen(self.url + "/metrics", timeout=10) as response:
+                    for line in response.read().decode().splitlines():
+                        if line.startswith("process_resident_memory_bytes "):
+                            self.peak_rss = max(self.peak_rss, float(line.split()[1]))
+            except OSError:
+                pass
+            if stop.is_set():
+                break
+            stop.wait(0.5)
+
+    def run(self, users: int, iterations: int) -> dict:
+        stop = threading.Event()
+        sampler = threading.Thread(target=self.sample_rss, args=(stop,), daemon=True)
+        sampler.start()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            list(executor.map(lambda x: self.user(x, iterations), range(users)))
+        duration = time.perf_counter() - start
+
+        stop.set()
+        sampler.join()
+
+        return report(self.samples, duration, self.peak_rss)
+
+
+def report(samples: [(str, int, float)], duration_s: float, peak_rss: float) -> dict:
+    """Latency percentiles, throughput and rejected rate, per endpoint and in total"""
+    result = {"duration_s": duration_s, "peak_rss_mb": peak_rss / 2 ** 20, "endpoints": {}}
+    groups = {"all": samples}
+    for endpoint in sorted(set(x[0] for x in samples)):
+        groups[endpoint] = [x for x in samples if x[0] == endpoint]
+
+    for name, group in groups.items():
+        latencies = np.array([x[2] for x in group])
+        statuses = [x[1] for x in group]
+        result["endpoints"][name] = {
+            "requests": len(group),
+            "throughput_rps": len(group) / duration_s if duration_s > 0 else None,
+            "p50_s": float(np.percentile(latencies, 50)) if len(group) > 0 else None,
+            "p95_s": float(np.percentile(latencies, 95)) if len(group) > 0 else None,
+            "p99_s": float(np.percentile(latencies, 99)) if len(group) > 0 else None,
+            "rejected_rate": statuses.count(501) / len(group) if len(group) > 0 else None,
+            "error_rate": sum(1 for x in statuses if x not in (200, 501)) / len(group) if len(group) > 0 else None,
+        }
+    return result
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, timeout_s: float = 60):
+    end = time.monotonic() + timeout_s
+    while time.monotonic() < end:
+        try:
+            with urllib.request.urlopen(url + "/", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Backend not responding")
+
+
+@click.command()
+@click.argument('data_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--dashboard', 'dashboards', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='Dashboard JSON to replay (default: dashboard_templates/*.json)')
+@click.option('--var', 'variables', multiple=True, help='Template variable value, NAME=VALUE (repeat for lists)')
+@click.option('--users', default=4, help='Concurrent simulated users')
+@click.option('--iterations', default=3, help='Dashboard loads per user')
+@click.option('--think_ms', default=0, help='Mean pause between dashboard loads of a user in ms')
+@click.option('--start', default=None, help='Start of the time range (default: dashboard time range)')
+@click.option('--stop', default=None, help='End of the time range (default: dashboard time range)')
+@click.option('--random_ranges', is_flag=True, default=False, help='Zoom to random parts of the range')
+@click.option('--latency_ms', default=0.0, help='Injected latency per storage request in ms')
+@click.option('--bandwidth_mbps', default=0.0, help='Storage bandwidth in Mbit/s (0 for unlimited)')
+@click.option('--moto', is_flag=True, default=False, help='Serve the data from a local moto S3 server')
+@click.option('--limit', default=100, help='Limit on data to process in MB')
+@click.option('--batch_ms', default=10, help='Window in ms for merging concurrent panel queries')
+@click.option('--seed', default=0, help='Seed of the simulated users')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Save the report as JSON')
+def main(data_dir, dashboards, variables, users, iterations, think_ms, start, stop, random_ranges, latency_ms,
+         bandwidth_mbps, moto, limit, batch_ms, seed, output):
+    """
+    Load test the backend by replaying dashboards with concurrent simulated users.
+    """
+    throttle = dict(latency_s=latency_ms / 1000, bandwidth=bandwidth_mbps * 10 ** 6 / 8 if bandwidth_mbps else None)
+    if moto:
+        fs = moto_file_system(data_dir, **throttle)
+    else:
+        fs = ThrottledFileSystem(protocol="file", base_path=data_dir, **throttle)
+
+    # Start the backend in the background
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    threading.Thread(target=canedge_datasource.start_server, daemon=True,
+                     kwargs=dict(fs=fs, dbs=load_dbs(fs), passwords=load_passwords(fs), port=port, limit_mb=limit,
+                                 tp_type="", batch_ms=batch_ms, deadline_s=0, coverage=False)).start()
+    _wait_until_up(url)
+
+    values = {}
+    for variable in variables:
+        name, value = variable.split("=", 1)
+        values.setdefault(name, []).append(value)
+    values = {k: v[0] if len(v) == 1 else v for k, v in values.items()}
+
+    load_test = LoadTest(url=url,
+                         dashboards=[Dashboard.load(x) for x in (dashboards or sorted(glob(DASHBOARDS)))],
+                         values=values,
+                         start=parse_time(start) if start else None,
+                         stop=parse_time(stop) if stop else None,
+                         random_ranges=random_ranges,
+                         think_s=think_ms / 1000,
+                         seed=seed)
+    result = load_test.run(users, iterations)
+    result["options"] = click.get_current_context().params
+
+    print(f"Duration: {result['duration_s']:.1f} s, peak RSS: {result['peak_rss_mb']:.0f} MB")
+    print(f"{'endpoint':<14}{'requests':>10}{'req/s':>10}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}{'501':>8}{'error':>8}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<14}{stats['requests']:>10}{stats['throughput_rps']:>10.2f}{stats['p50_s']:>10.3f}"
+              f"{stats['p95_s']:>10.3f}{stats['p99_s']:>10.3f}{stats['rejected_rate']:>8.1%}{stats['error_rate']:>8.1%}")
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved report: {output}")
+
+
+if __name__ == '__main__':
+    main()
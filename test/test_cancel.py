@@ -0,0 +1,74 @@
+import threading
+import pytest
+
+from canedge_datasource.cancel import CancelToken, CancelGroup, CancelRegistry, QueryCancelled, panel_key
+from canedge_datasource.planner import QueryPlanner
+
+
+class TestCancel(object):
+
+    def test_supersede(self):
+        registry = CancelRegistry()
+        key = panel_key({"dashboardUID": "abc", "panelId": 4})
+
+        first = CancelToken()
+        second = CancelToken()
+        assert registry.register(key, first) is False
+        assert registry.register(key, second) is True
+        assert first.cancelled
+        assert not second.cancelled
+
+        # Unregistering a superseded token does not remove the newer one
+        registry.unregister(key, first)
+        third = CancelToken()
+        assert registry.register(key, third) is True
+        assert second.cancelled
+
+    def test_client_disconnected(self):
+        disconnected = [False]
+        token = CancelToken(lambda: disconnected[0])
+        token.check()
+
+        disconnected[0] = True
+        with pytest.raises(QueryCancelled):
+            token.check()
+
+    def test_group(self):
+        tokens = [CancelToken(), CancelToken()]
+        group = CancelGroup(tokens)
+
+        tokens[0].cancel()
+        assert not group.cancelled
+        tokens[1].cancel()
+        assert group.cancelled
+
+    def test_planner_cancel(self):
+
+        started = threading.Event()
+        cancels = []
+
+        def process(signal_queries, start_date, stop_date, cancel=None):
+            cancels.append(cancel)
+            started.set()
+            while not cancel.cancelled:
+                pass
+            cancel.check()
+
+        planner = QueryPlanner(process=process, window_ms=0)
+        token = CancelToken()
+        errors = []
+
+        def request():
+            try:
+                planner.submit(["a"], 1, 2, cancel=token)
+            except QueryCancelled as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        started.wait(1)
+        token.cancel()
+        thread.join(1)
+
+        assert cancels == [token]
+        assert len(errors) == 1
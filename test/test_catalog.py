@@ -0,0 +1,59 @@
+from canedge_datasource.catalog import DeviceCatalog
+from canedge_datasource.metadata import LogFileMetadata
+
+
+class FakeFs(object):
+
+    def __init__(self, devices: dict):
+        self.devices = devices
+
+    def get_device_ids(self, reverse: bool = False):
+        yield from sorted(self.devices.keys(), reverse=reverse)
+
+    def get_device_log_files(self, device, reverse: bool = False):
+        if self.devices[device] == "error":
+            raise OSError("Listing failed")
+        for log_file in sorted(self.devices[device], reverse=reverse):
+            yield log_file, None, None
+
+
+class FakeMetadata(object):
+
+    def __init__(self, comments: dict):
+        self.comments = comments
+        self.reads = []
+
+    def get(self, log_file, passwords):
+        self.reads.append(log_file)
+        return LogFileMetadata(path=log_file, version="", size=0, start_epoch_ns=1,
+                               meta={"HDcomment.File Information.comment": self.comments[log_file]})
+
+
+class TestCatalog(object):
+
+    def test_refresh(self):
+        fs = FakeFs({"AABBCCDD": ["AABBCCDD/00000001/00000001.MF4", "AABBCCDD/00000002/00000001.MF4"],
+                     "11223344": []})
+        metadata = FakeMetadata({"AABBCCDD/00000002/00000001.MF4": " Truck 1 "})
+        catalog = DeviceCatalog(fs, metadata, {})
+
+        assert catalog.updated is None
+        catalog.refresh()
+
+        entries = catalog.entries()
+        assert [x.device for x in entries] == ["11223344", "AABBCCDD"]
+        assert entries[0].log_file is None
+        assert entries[1].log_file == "AABBCCDD/00000002/00000001.MF4"
+        assert entries[1].comment == "Truck 1"
+        assert metadata.reads == ["AABBCCDD/00000002/00000001.MF4"]
+        assert catalog.age >= 0
+
+    def test_failed_device_keeps_entry(self):
+        fs = FakeFs({"AABBCCDD": ["AABBCCDD/00000001/00000001.MF4"]})
+        catalog = DeviceCatalog(fs, FakeMetadata({"AABBCCDD/00000001/00000001.MF4": "Truck 1"}), {})
+        catalog.refresh()
+
+        fs.devices["AABBCCDD"] = "error"
+        catalog.refresh()
+
+        assert catalog.entries()[0].comment == "Truck 1"
@@ -0,0 +1,27 @@
+import pytest
+
+from canedge_datasource.coverage import select_files
+
+
+class TestCoverage(object):
+
+    def test_all_files_fit(self):
+        assert select_files([10] * 10, 100) == list(range(10))
+
+    def test_evenly_spaced(self):
+        selected = select_files([10] * 100, 100, 1000)
+
+        assert len(selected) == 10
+        assert selected[0] == 0
+        assert selected[-1] == 99
+        assert max(b - a for a, b in zip(selected, selected[1:])) <= 12
+
+    @pytest.mark.parametrize("max_files", [1, 5, 20])
+    def test_max_files(self, max_files):
+        assert len(select_files([1] * 100, 100, max_files)) == max_files
+
+    def test_budget(self):
+        sizes = [1, 50, 1, 1, 1, 1, 1, 1, 1, 1]
+        assert sum(sizes[x] for x in select_files(sizes, 10)) <= 10
+        assert select_files([200], 100) == []
+        assert select_files([], 100) == []
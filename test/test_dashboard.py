@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+from canedge_datasource.dashboard import Dashboard, parse_time, substitute
+
+TEMPLATES = Path(__file__).resolve().parent.parent / "dashboard_templates"
+
+
+class TestDashboard(object):
+
+    def test_substitute(self):
+        values = {"DEVICE": "AABBCCDD", "SIGNAL": ["A", "B"], "ONE": ["C"]}
+        assert substitute('{"device":"${DEVICE}","signal":"${SIGNAL}"}', values) == \
+            '{"device":"AABBCCDD","signal":"(A|B)"}'
+        assert substitute("$DEVICE ${ONE} ${DEVICE:raw} $UNKNOWN", values) == "AABBCCDD C AABBCCDD $UNKNOWN"
+
+    def test_parse_time(self):
+        now = datetime(2022, 1, 8, 12, tzinfo=timezone.utc)
+        assert parse_time("now", now) == now
+        assert parse_time("now-12h", now) == datetime(2022, 1, 8, 0, tzinfo=timezone.utc)
+        assert parse_time("2022-01-08T10:33:37.186Z") == datetime(2022, 1, 8, 10, 33, 37, 186000, tzinfo=timezone.utc)
+        assert parse_time("1641637800000") == datetime(2022, 1, 8, 10, 30, tzinfo=timezone.utc)
+
+    def test_simple_template(self):
+        dashboard = Dashboard.load(str(TEMPLATES / "dashboard-template-simple.json"))
+        assert [x.name for x in dashboard.variables] == ["DEVICE", "DB", "CHN", "ITF", "SIGNAL"]
+        assert dashboard.default_values() == {"CHN": "CH1", "ITF": "CAN"}
+        assert dashboard.annotations == ['{"annotation": "session", "device": "${DEVICE}"}',
+                                         '{"annotation": "split", "device": "${DEVICE}"}']
+
+        values = dict(dashboard.default_values(), DEVICE="AABBCCDD", DB="canmod-gps", SIGNAL=["Speed", "Satellites"])
+        searches = dict(dashboard.search_requests(values))
+        assert searches["SIGNAL"] == {"target": '{"search":"signal", "db": "canmod-gps"}'}
+
+        start = datetime(2022, 1, 8, 10, tzinfo=timezone.utc)
+        stop = datetime(2022, 1, 8, 11, tzinfo=timezone.utc)
+        requests = dashboard.query_requests(values, start, stop)
+        assert len(requests) == 1
+        request = requests[0]
+        assert request["range"] == {"from": "2022-01-08T10:00:00.000Z", "to": "2022-01-08T11:00:00.000Z"}
+        assert request["intervalMs"] == 3600 * 1000 // request["maxDataPoints"]
+        target = json.loads(request["targets"][0]["target"])
+        assert target == {"device": "AABBCCDD", "itf": "CAN", "chn": "CH1", "db": "canmod-gps",
+                          "signal": "(Speed|Satellites)"}
+
+        annotations = dashboard.annotation_requests(values, start, stop)
+        assert json.loads(annotations[0]["annotation"]["query"]) == {"annotation": "session", "device": "AABBCCDD"}
+
+    def test_sample_data_template(self):
+        dashboard = Dashboard.load(str(TEMPLATES / "dashboard-template-sample-data.json"))
+
+        # Panels reusing the data of other panels have no targets of their own
+        assert len(dashboard.panels) == 1
+        assert len(dashboard.panels[0].targets) == 8
+        assert dashboard.default_values()["SIGNAL"] == ["AccelerationX", "AccelerationY", "AccelerationZ"]
+        assert dashboard.time_range() == (datetime(2022, 1, 8, 10, 33, 37, 186000, tzinfo=timezone.utc),
+                                          datetime(2022, 1, 8, 10, 51, 16, 573000, tzinfo=timezone.utc))
+
+    def test_nested_panels(self):
+        dashboard = Dashboard.from_json({"dashboard": {"uid": "x", "panels": [
+            {"type": "row", "panels": [{"id": 2, "targets": [{"refId": "A", "target": "{}"}]}]}]}})
+        assert [x.id for x in dashboard.panels] == [2]
@@ -0,0 +1,75 @@
+import os
+import shutil
+from pathlib import Path
+
+from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.databases import DatabaseStore, db_versions
+
+DBC = Path(__file__).resolve().parent.parent / "LOG" / "canmod-gps.dbc"
+
+
+class TestDatabaseStore(object):
+
+    def test_lazy_load(self, tmp_path):
+        shutil.copy(DBC, tmp_path / "CANmod-GPS.dbc")
+        store = DatabaseStore(CanedgeFileSystem(protocol="file", base_path=str(tmp_path)))
+
+        assert list(store.keys()) == ["canmod-gps"]
+        assert store.status() == {"canmod-gps": "pending"}
+        assert not store.ready
+
+        assert len(store["canmod-gps"]["db"].frames) == 9
+        assert store.get("unknown") is None
+        assert store.ready
+
+    def test_failed(self, tmp_path):
+        shutil.copy(DBC, tmp_path / "removed.dbc")
+        store = DatabaseStore(CanedgeFileSystem(protocol="file", base_path=str(tmp_path)))
+        os.remove(tmp_path / "removed.dbc")
+
+        assert store.get("removed") is None
+        assert store.status() == {"removed": "failed"}
+        assert store.ready
+
+    def test_compiled_cache(self, tmp_path):
+        data_dir = tmp_path / "data"
+        cache_dir = tmp_path / "cache"
+        data_dir.mkdir()
+        shutil.copy(DBC, data_dir / "canmod-gps.dbc")
+        fs = CanedgeFileSystem(protocol="file", base_path=str(data_dir))
+
+        DatabaseStore(fs, cache_dir=str(cache_dir)).load_all()
+        cached = os.listdir(cache_dir)
+        assert len(cached) == 1 and cached[0].endswith(".pickle")
+
+        # Warm restart reads the compiled DB
+        store = DatabaseStore(fs, cache_dir=str(cache_dir))
+        assert len(store["canmod-gps"]["db"].frames) == 9
+
+        # Changed DBC content is compiled again
+        with open(data_dir / "canmod-gps.dbc", "a") as f:
+            f.write("\n")
+        DatabaseStore(fs, cache_dir=str(cache_dir)).load_all()
+        assert len(os.listdir(cache_dir)) == 2
+
+    def test_refresh(self, tmp_path):
+        shutil.copy(DBC, tmp_path / "a.dbc")
+        shutil.copy(DBC, tmp_path / "b.dbc")
+        store = DatabaseStore(CanedgeFileSystem(protocol="file", base_path=str(tmp_path)))
+        store.load_all()
+        db_a, db_b = store["a"]["db"], store["b"]["db"]
+        versions = db_versions(store, ["a", "b"])
+        assert store.refresh() == []
+
+        # Only the changed DB is compiled again
+        with open(tmp_path / "a.dbc", "a") as f:
+            f.write("\n")
+        shutil.copy(DBC, tmp_path / "c.dbc")
+        os.remove(tmp_path / "b.dbc")
+        assert store.refresh() == ["a", "b", "c"]
+
+        assert store["a"]["db"] is not db_a
+        assert store.get("b") is None and "b" not in store
+        assert store.status() == {"a": "loaded", "c": "pending"}
+        assert db_versions(store, ["a"]) != versions[:1]
+        assert db_versions({"a": db_a}, ["a", "a"]) == (("a", None),)
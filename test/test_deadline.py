@@ -0,0 +1,26 @@
+import time
+from datetime import datetime
+
+from canedge_datasource.deadline import Deadline, add_notice, is_partial, format_ranges
+
+
+class TestDeadline(object):
+
+    def test_deadline(self):
+        assert not Deadline(None).expired
+        assert not Deadline(0).expired
+
+        deadline = Deadline(0.01)
+        assert not deadline.expired
+        time.sleep(0.02)
+        assert deadline.expired
+
+    def test_notice(self):
+        res = [{"target": "A", "datapoints": []}, {"target": "B", "datapoints": []}]
+        assert not is_partial(res)
+
+        ranges = [(datetime(2022, 1, 8, 10, 0, 0), datetime(2022, 1, 8, 10, 30, 0))]
+        add_notice(res[1], f"Partial data, skipped: {format_ranges(ranges)}")
+
+        assert is_partial(res)
+        assert res[1]["meta"]["notices"][0]["text"] == "Partial data, skipped: 2022-01-08 10:00:00 - 2022-01-08 10:30:00"
@@ -0,0 +1,183 @@
+import warnings
+import can_decoder
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource.decoder import SignalDecoder, get_decoder
+from canedge_datasource.raw_frames import RawFrames
+from canedge_datasource.signal import _decode_parts
+
+# Big endian, signed, multiplexed, float and CAN FD signals
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 256 Motorola: 8 X
+ SG_ BeU16 : 7|16@0+ (0.1,0) [0|0] "" X
+ SG_ BeS12 : 19|12@0- (0.5,-3) [0|0] "" X
+ SG_ BeU3 : 34|3@0+ (1,0) [0|0] "" X
+ SG_ BeU20 : 35|20@0+ (1,0) [0|0] "" X
+ SG_ LeS7 : 57|7@1- (1,0) [0|0] "" X
+
+BO_ 512 Muxed: 8 X
+ SG_ Mux M : 0|8@1+ (1,0) [0|0] "" X
+ SG_ A m0 : 8|16@1- (0.5,-3) [0|0] "" X
+ SG_ B m1 : 15|12@0+ (1,0) [0|0] "" X
+ SG_ C m1 : 32|16@1+ (1,0) [0|0] "" X
+ SG_ Common : 56|8@1+ (2,1) [0|0] "" X
+
+BO_ 2147484416 Extended: 8 X
+ SG_ Float : 0|32@1- (1,0) [0|0] "" X
+ SG_ Unsigned : 32|32@1+ (0.001,0) [0|0] "" X
+
+BO_ 1536 Double: 8 X
+ SG_ F64 : 0|64@1- (1,0) [0|0] "" X
+
+BO_ 1280 Fd: 16 X
+ SG_ Wide : 4|62@1+ (1,0) [0|0] "" X
+ SG_ Late : 96|16@1+ (1,0) [0|0] "" X
+
+SIG_VALTYPE_ 2147484416 Float : 1;
+SIG_VALTYPE_ 1536 F64 : 2;
+"""
+
+J1939_DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 2364540158 EEC1: 8 X
+ SG_ EngineSpeed : 24|16@1+ (0.125,0) [0|8031.875] "rpm" X
+ SG_ Torque : 16|8@1+ (1,-125) [-125|125] "%" X
+
+BO_ 2566844926 CCVS1: 8 X
+ SG_ WheelSpeed : 8|16@1+ (0.00390625,0) [0|250.996] "km/h" X
+
+BA_DEF_  "ProtocolType" STRING ;
+BA_DEF_DEF_  "ProtocolType" "";
+BA_ "ProtocolType" "J1939";
+"""
+
+
+def load_dbc(tmp_path, content):
+    path = tmp_path / "test.dbc"
+    path.write_text(content)
+    return can_decoder.load_dbc(str(path))
+
+
+def make_frames(lengths: dict, count: int, extended: bool = False, seed: int = 0) -> pd.DataFrame:
+    """Random frames in the mdf_iter data frame layout, with mixed IDs and payload lengths (per ID)"""
+    rng = np.random.default_rng(seed)
+    choice = rng.integers(0, len(lengths), count)
+    frame_ids = np.array(list(lengths.keys()), dtype=np.uint32)[choice]
+    frame_lengths = np.array(list(lengths.values()), dtype=np.uint8)[choice]
+    index = pd.DatetimeIndex(pd.to_datetime(np.arange(count), unit="ms", utc=True), name="TimeStamp")
+
+    return pd.DataFrame({"BusChannel": np.ones(count, dtype=np.uint8),
+                         "ID": frame_ids,
+                         "IDE": np.full(count, extended) | (frame_ids > 0x7FF),
+                         "DLC": frame_lengths,
+                         "DataLength": frame_lengths,
+                         "DataBytes": [list(rng.integers(0, 256, x)) for x in frame_lengths]}, index=index)
+
+
+def reference(db, df: pd.DataFrame) -> pd.DataFrame:
+    """Decoding as previously done, by can_decoder per payload length"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        df_phys = [can_decoder.DataFrameDecoder(db).decode_frame(group) for _, group in df.groupby("DataLength")]
+    return pd.concat([x for x in df_phys if "Signal" in x.columns])
+
+
+def assert_equal(expected: pd.DataFrame, actual: pd.DataFrame):
+    assert set(actual["Signal"].unique()) == set(expected["Signal"].unique())
+
+    for name in expected["Signal"].unique():
+        signal_expected = expected[expected["Signal"] == name].sort_index(kind="stable")
+        signal_actual = actual[actual["Signal"] == name]
+
+        assert signal_actual.index.equals(signal_expected.index), name
+        np.testing.assert_allclose(signal_actual["Physical Value"].values,
+                                   signal_expected["Physical Value"].values.astype(float), rtol=1e-12, err_msg=name)
+        assert (signal_actual["CAN ID"].values == signal_expected["CAN ID"].values).all(), name
+
+
+class TestDecoder(object):
+
+    def test_canmod_gps(self):
+        db = can_decoder.load_dbc("LOG/canmod-gps.dbc")
+        df = make_frames({1: 8, 2: 8, 3: 8, 4: 8, 5: 8, 6: 8, 7: 8, 8: 8, 9: 8, 0x7E8: 8, 0x7E9: 3}, 20000)
+
+        assert_equal(reference(db, df), SignalDecoder(db).decode_frame(RawFrames.from_data_frame(df)))
+
+    def test_signal_types(self, tmp_path):
+        db = load_dbc(tmp_path, DBC)
+        df = make_frames({0x100: 8, 0x200: 8, 0x300: 8, 0x600: 8, 0x500: 16, 0x123: 3}, 20000)
+
+        # Extended frame
+        df.loc[df["ID"] == 0x300, "IDE"] = True
+
+        decoded = SignalDecoder(db).decode_frame(RawFrames.from_data_frame(df))
+        assert_equal(reference(db, df), decoded)
+        assert {"BeU16", "A", "B", "C", "Common", "Float", "F64", "Wide", "Late"} <= set(decoded["Signal"].unique())
+
+    def test_requested_signals(self, tmp_path):
+        db = load_dbc(tmp_path, DBC)
+        df = make_frames({0x100: 8, 0x200: 8}, 1000)
+        frames = RawFrames.from_data_frame(df)
+
+        decoder = SignalDecoder(db, ["B", "LeS7"])
+        assert set(decoder.decode_frame(frames)["Signal"].unique()) == {"B", "LeS7"}
+        assert decoder.matches(frames).all()
+        assert not SignalDecoder(db, ["Late"]).matches(frames).any()
+
+    def test_j1939(self, tmp_path):
+        db = load_dbc(tmp_path, J1939_DBC)
+        assert db.protocol == "J1939"
+
+        # Several source addresses, including values not available (0xFF / 0xFFFF)
+        df = make_frames({0x0CF00400: 8, 0x0CF00401: 8, 0x18FEF100: 8, 0x18FEF1FE: 8, 0x18FEF200: 8}, 5000,
+                         extended=True)
+        df.loc[df.index[::7], "DataBytes"] = pd.Series([[0xFF] * 8] * len(df.index[::7]), index=df.index[::7])
+
+        assert_equal(reference(db, df), SignalDecoder(db).decode_frame(RawFrames.from_data_frame(df)))
+
+    def test_short_payloads(self, tmp_path):
+        db = load_dbc(tmp_path, DBC)
+
+        # Signals are only decoded from the frames with payloads covering the signal
+        df = make_frames({0x200: 8}, 100)
+        df["DataBytes"] = [[1, 0, 0, 0, 0] if x % 2 == 0 else [1, 0, 0, 0, 2, 0, 0, 3] for x in range(100)]
+        df["DataLength"] = df["DLC"] = [len(x) for x in df["DataBytes"]]
+        decoded = SignalDecoder(db, ["C", "Common"]).decode(RawFrames.from_data_frame(df))
+
+        assert (decoded["C"][0] == df.index[1::2].values.astype(np.int64)).all()
+        assert (decoded["C"][1] == 2).all()
+        assert (decoded["Common"][1] == 7).all()
+
+    def test_cache(self):
+        db = can_decoder.load_dbc("LOG/canmod-gps.dbc")
+        assert get_decoder(db, ["Speed", "Latitude"]) is get_decoder(db, ["Latitude", "Speed"])
+        assert get_decoder(db, ["Speed"]) is not get_decoder(db, ["Latitude"])
+
+    def test_decode_parts(self, tmp_path):
+        db = load_dbc(tmp_path, DBC)
+        df = make_frames({0x100: 8, 0x500: 16}, 1000)
+        frames = RawFrames.from_data_frame(df)
+        decoder = SignalDecoder(db, ["BeU16", "Late"])
+
+        # Parts (e.g. narrow and wide payloads) are merged per signal, ordered by time
+        parts = [frames[frames.length <= 8], frames[frames.length > 8]]
+        merged = _decode_parts(decoder, parts)
+        expected = decoder.decode(frames)
+        for name in ["BeU16", "Late"]:
+            for merged_array, expected_array in zip(merged[name], expected[name]):
+                assert (merged_array == expected_array).all()
@@ -0,0 +1,197 @@
+from datetime import datetime, timezone
+import can_decoder
+import canedge_browser
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource import signal
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface
+from canedge_datasource.fleet import SKETCH_SIZE, BucketAggregate, FleetQuery, fleet_phy_data, match_devices, \
+    parse_aggregate
+
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 256 Frame: 8 X
+ SG_ Value : 0|16@1+ (1,0) [0|0] "" X
+"""
+
+# Devices with one log file each. The value of a device is its offset plus the second within the minute
+DEVICES = {"AABBCCDD": 0, "AABB0000": 100, "11223344": 1000}
+
+
+class FakeFs(object):
+
+    def get_device_ids(self):
+        yield from DEVICES
+
+    def path_to_pars(self, path):
+        device, session, split = path.split("/")
+        return device, session, split, ".MF4"
+
+    def stat(self, path, **kwargs):
+        return {"size": 1 << 20}
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC)
+    return can_decoder.load_dbc(str(path))
+
+
+@pytest.fixture
+def log_files(monkeypatch):
+    loaded = []
+
+    def read_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        loaded.append(log_file)
+        value = DEVICES[log_file.split("/")[0]]
+        index = pd.DatetimeIndex(pd.to_datetime(np.arange(120) * 10 ** 9, utc=True), name="TimeStamp")
+        df = pd.DataFrame({"BusChannel": np.ones(120, dtype=np.uint8),
+                           "ID": np.full(120, 0x100, dtype=np.uint32),
+                           "IDE": np.zeros(120, dtype=bool),
+                           "DLC": np.full(120, 8, dtype=np.uint8),
+                           "DataLength": np.full(120, 8, dtype=np.uint8),
+                           "DataBytes": [list((value + x % 60).to_bytes(2, "little")) + [0] * 6 for x in range(120)]},
+                          index=index)
+        return (None, signal._to_frames(df, dict(predicates or ()).get(CanedgeInterface.CAN)),
+                signal._to_frames(df.iloc[:0]), np.unique(df["ID"].values))
+
+    monkeypatch.setattr(signal, "_load_log_file", read_log_file)
+    monkeypatch.setattr(canedge_browser, "get_log_files", lambda fs, device, **kwargs: [f"{device}/00000001/00000001"])
+    return loaded
+
+
+class TestFleet(object):
+
+    def test_parse_aggregate(self):
+        assert [parse_aggregate(x) for x in ["MAX", "mean", "p99.9", "median"]] == ["max", "mean", "p99.9", "p50"]
+        with pytest.raises(ValueError):
+            parse_aggregate("p101")
+        with pytest.raises(ValueError):
+            parse_aggregate("sum")
+
+    def test_match_devices(self):
+        assert match_devices(["AABB*"], list(DEVICES)) == ["AABBCCDD", "AABB0000"]
+        assert match_devices(["*"], list(DEVICES)) == list(DEVICES)
+        assert match_devices(["11223344", "AABBCCDD"], list(DEVICES)) == ["AABBCCDD", "11223344"]
+
+    def test_aggregate(self):
+        rng = np.random.default_rng(0)
+        timestamps = np.sort(rng.integers(0, 10 * 10 ** 9, 20000))
+        values = rng.normal(size=len(timestamps))
+
+        # Samples split over several (device) aggregates, merged
+        merged = BucketAggregate(0, 10 ** 9, 10, sketch=True)
+        for part in np.array_split(rng.permutation(len(timestamps)), 7):
+            aggregate = BucketAggregate(0, 10 ** 9, 10, sketch=True)
+            for chunk in np.array_split(part, 3):
+                aggregate.add(timestamps[chunk], values[chunk])
+            merged.merge(aggregate)
+
+        buckets = timestamps // 10 ** 9
+        expected = pd.Series(values).groupby(buckets)
+        assert merged.series("count")[0] == [x * 1000.0 for x in range(10)]
+        assert merged.series("count")[1] == expected.count().astype(float).tolist()
+        assert merged.series("min")[1] == expected.min().tolist()
+        assert merged.series("max")[1] == expected.max().tolist()
+        assert np.allclose(merged.series("mean")[1], expected.mean().tolist())
+
+        # Percentiles within a small rank error
+        for name, fraction in [("p5", 0.05), ("p50", 0.5), ("p95", 0.95)]:
+            for bucket, value in enumerate(merged.series(name)[1]):
+                rank = np.mean(values[buckets == bucket] <= value)
+                assert abs(rank - fraction) < 0.03
+
+        # The size does not depend on the number of samples
+        assert merged.nbytes == BucketAggregate(0, 10 ** 9, 10, sketch=True).nbytes
+
+    def test_aggregate_devices(self):
+        rng = np.random.default_rng(0)
+
+        # Devices with different distributions, merged one at a time
+        merged = BucketAggregate(0, 10 ** 9, 1, sketch=True)
+        samples = []
+        for device in range(300):
+            values = rng.normal(loc=rng.normal(), scale=rng.uniform(0.5, 2), size=rng.integers(100, 2000))
+            aggregate = BucketAggregate(0, 10 ** 9, 1, sketch=True)
+            for chunk in np.array_split(values, 3):
+                aggregate.add(np.zeros(len(chunk), dtype=np.int64), chunk)
+            merged.merge(aggregate)
+            samples.append(values)
+        samples = np.concatenate(samples)
+
+        # The rank error does not build up with the number of merges
+        for percentile in [1, 5, 25, 50, 75, 95, 99]:
+            value = merged.series(f"p{percentile}")[1][0]
+            expected = np.percentile(samples, percentile)
+            assert abs(np.mean(samples <= value) - np.mean(samples <= expected)) < 1 / SKETCH_SIZE
+
+    def test_aggregate_small(self):
+        aggregate = BucketAggregate(0, 10, 3, sketch=True)
+        aggregate.add(np.array([0, 1, 2, 25]), np.array([3.0, 1.0, np.nan, 7.0]))
+        assert aggregate.series("count") == ([0.0, 2e-05], [2.0, 1.0])
+        assert aggregate.series("p0")[1] == [1.0, 7.0]
+        assert aggregate.series("p100")[1] == [3.0, 7.0]
+
+    def test_fleet_phy_data(self, db, log_files):
+        query = FleetQuery(refid="A", targets=("max", "mean", "p50", "count"), devices=("AABB*",),
+                           itf=CanedgeInterface.CAN, chn=CanedgeChannel.CH1, db=db, signal_name="Value",
+                           interval_ms=60000, aggregates=("max", "mean", "p50", "count"))
+        result = fleet_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 2, tzinfo=timezone.utc), limit_mb=100, passwords={},
+                                max_workers=2)
+
+        assert sorted(log_files) == ["AABB0000/00000001/00000001", "AABBCCDD/00000001/00000001"]
+        assert [x["target"] for x in result] == ["max", "mean", "p50", "count"]
+        assert result[0]["datapoints"] == [(159.0, 0.0), (159.0, 60000.0)]
+        assert result[1]["datapoints"] == [(79.5, 0.0), (79.5, 60000.0)]
+        assert result[3]["datapoints"] == [(120.0, 0.0), (120.0, 60000.0)]
+        assert all("meta" not in x for x in result)
+
+    def test_device_limit(self, db, log_files):
+        query = FleetQuery(refid="A", targets=("max",), devices=("*",), itf=CanedgeInterface.CAN,
+                           chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=60000, aggregates=("max",))
+        result = fleet_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 2, tzinfo=timezone.utc), limit_mb=0, passwords={})
+
+        assert log_files == []
+        assert result[0]["datapoints"] == []
+        assert result[0]["meta"]["notices"][0]["text"] == "Partial data (limit 0 MB), 3 of 3 devices incomplete"
+
+        # The limit of a query lowers the limit of the request, per query
+        limited = FleetQuery(refid="B", targets=("max",), devices=("*",), itf=CanedgeInterface.CAN,
+                             chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=60000,
+                             aggregates=("max",), limit_mb=0)
+        result = fleet_phy_data(FakeFs(), [limited, query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 2, tzinfo=timezone.utc), limit_mb=100, passwords={})
+
+        assert len(log_files) == 3
+        assert result[0]["datapoints"] == [] and "meta" not in result[1]
+
+    def test_max_query_mb(self, db, log_files):
+        query = FleetQuery(refid="A", targets=("max",), devices=("*",), itf=CanedgeInterface.CAN,
+                           chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=60000, aggregates=("max",))
+
+        # Files of 1 MB are not expected to fit when loaded
+        result = fleet_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 2, tzinfo=timezone.utc), limit_mb=100, passwords={},
+                                max_query_mb=5)
+
+        assert log_files == []
+        assert result[0]["meta"]["notices"][0]["text"] == "Partial data (memory 5 MB), 3 of 3 devices incomplete"
+
+        # The memory of a device is released once done, such that the devices processed one at a time all fit
+        result = fleet_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 2, tzinfo=timezone.utc), limit_mb=100, passwords={},
+                                max_workers=1, max_query_mb=11)
+
+        assert len(log_files) == 3
+        assert result[0]["datapoints"] == [(1059.0, 0.0), (1059.0, 60000.0)] and "meta" not in result[0]
@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+from pathlib import Path
+import can_decoder
+import canedge_browser
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource import signal
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface
+from canedge_datasource.geo import GeoQuery, align_track, douglas_peucker, find_stops, geo_phy_data, simplify_track
+
+DBC = Path(__file__).resolve().parent.parent / "LOG" / "canmod-gps.dbc"
+
+
+def make_track(stop_s: float = 120) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Positions at 10 Hz: 1000 m north in 100 s, a stop, then 1000 m east in 100 s (with GPS noise)
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(0, 200 + stop_s, 0.1)
+    north = np.clip(t, 0, 100) * 10
+    east = np.clip(t - 100 - stop_s, 0, 100) * 10
+    lat = 56 + (north + rng.normal(scale=0.5, size=len(t))) / 111195
+    lon = 10 + (east + rng.normal(scale=0.5, size=len(t))) / (111195 * np.cos(np.radians(56)))
+    return (t * 10 ** 9).astype(np.int64), lat, lon
+
+
+@pytest.fixture
+def track(monkeypatch):
+    """Track of make_track served as CAN frames of the GPS DB (a single log file)"""
+    timestamps, lat, lon = make_track()
+
+    raw = ((np.round((lat + 90) * 10 ** 6).astype(np.uint64) << np.uint64(1)) |
+           (np.round((lon + 180) * 10 ** 6).astype(np.uint64) << np.uint64(29)))
+    df = pd.DataFrame({"BusChannel": np.full(len(raw), 2, dtype=np.uint8),
+                       "ID": np.full(len(raw), 3, dtype=np.uint32),
+                       "IDE": np.zeros(len(raw), dtype=bool),
+                       "DLC": np.full(len(raw), 8, dtype=np.uint8),
+                       "DataLength": np.full(len(raw), 8, dtype=np.uint8),
+                       "DataBytes": [list(int(x).to_bytes(8, "little")) for x in raw]},
+                      index=pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True), name="TimeStamp"))
+
+    def read_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        return (None, signal._to_frames(df, dict(predicates or ()).get(CanedgeInterface.CAN)),
+                signal._to_frames(df.iloc[:0]), np.unique(df["ID"].values))
+
+    monkeypatch.setattr(signal, "_load_log_file", read_log_file)
+    monkeypatch.setattr(canedge_browser, "get_log_files", lambda *args, **kwargs: ["AABBCCDD/00000001/00000001"])
+    return timestamps, lat, lon
+
+
+class FakeFs(object):
+    def stat(self, path, **kwargs):
+        return {"size": 1 << 20}
+
+
+class TestGeo(object):
+
+    def test_douglas_peucker(self):
+        x = np.array([0, 1, 2, 3, 4, 4, 4], dtype=float)
+        y = np.array([0, 0.1, -0.1, 0, 1, 2, 3], dtype=float)
+
+        assert douglas_peucker(x, y, 0.7).tolist() == [True, False, False, True, False, False, True]
+        assert douglas_peucker(x, y, 0.05).tolist() == [True, True, True, True, True, False, True]
+        assert douglas_peucker(x, y, 10, keep=np.arange(7) == 5).tolist() == [True] + [False] * 4 + [True, True]
+
+    def test_align_track(self):
+        timestamps, lat, lon = align_track(np.array([0, 10, 20, 30]) * 10 ** 8, np.array([1.0, 2, np.nan, 4]),
+                                           np.array([5, 25]) * 10 ** 8, np.array([10.0, 200]))
+
+        # No longitude before the first latitude, and invalid positions are dropped
+        assert timestamps.tolist() == [10 ** 9]
+        assert lat.tolist() == [2.0] and lon.tolist() == [10.0]
+
+    def test_simplify_track(self):
+
+        # The start, the turn and the end are kept
+        timestamps, lat, lon = make_track(stop_s=0)
+        index = simplify_track(timestamps, lat, lon, max_points=100)
+        seconds = timestamps[index] / 10 ** 9
+        assert len(index) <= 100
+        assert seconds[0] == 0 and seconds[-1] == pytest.approx(199.9)
+        assert any(abs(x - 100) < 0.5 for x in seconds)
+
+        # The start and end of the stop are kept
+        timestamps, lat, lon = make_track()
+        index = simplify_track(timestamps, lat, lon, max_points=100)
+        seconds = timestamps[index] / 10 ** 9
+        assert len(index) <= 100
+        assert any(abs(x - 100) < 3 for x in seconds) and any(abs(x - 220) < 3 for x in seconds)
+
+        # A tighter tolerance keeps more positions
+        assert len(simplify_track(timestamps, lat, lon, max_points=10000, tolerance_m=0.5)) > len(index)
+
+    def test_find_stops(self):
+        timestamps, lat, lon = make_track()
+        x, y = lon * 111195 * np.cos(np.radians(56)), lat * 111195
+        stops = timestamps[find_stops(timestamps, x, y)] / 10 ** 9
+        assert len(stops) == 2
+        assert stops[0] == pytest.approx(100, abs=3) and stops[1] == pytest.approx(220, abs=3)
+
+    def test_geo_phy_data(self, track):
+        db = can_decoder.load_dbc(str(DBC))
+        timestamps, lat, lon = track
+
+        query = GeoQuery(refid="A", targets=("lat", "lon"), device="AABBCCDD", itf=CanedgeInterface.CAN,
+                         chn=CanedgeChannel.CH2, db=db, latitude="Latitude", longitude="Longitude", max_data_points=50)
+        result = geo_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                                datetime(1970, 1, 1, 0, 10, tzinfo=timezone.utc), limit_mb=100, passwords={})
+
+        assert [x["target"] for x in result] == ["lat", "lon"]
+        assert 4 <= len(result[0]["datapoints"]) <= 50
+        assert [x[1] for x in result[0]["datapoints"]] == [x[1] for x in result[1]["datapoints"]]
+        assert result[0]["datapoints"][0][0] == pytest.approx(lat[0], abs=1e-6)
+        assert result[1]["datapoints"][-1][0] == pytest.approx(lon[-1], abs=1e-6)
+
+    def test_memory_ceiling(self, track, monkeypatch):
+        db = can_decoder.load_dbc(str(DBC))
+        timestamps, lat, lon = track
+        query = GeoQuery(refid="A", targets=("lat", "lon"), device="AABBCCDD", itf=CanedgeInterface.CAN,
+                         chn=CanedgeChannel.CH2, db=db, latitude="Latitude", longitude="Longitude", max_data_points=50)
+
+        # The data frame of the file is not expected to fit
+        result = geo_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                              datetime(1970, 1, 1, 0, 10, tzinfo=timezone.utc), limit_mb=100, passwords={},
+                              max_query_mb=1)
+        assert result[0]["datapoints"] == []
+        assert result[0]["meta"]["notices"][0]["text"] == "Partial data (memory 1 MB)"
+
+        # The positions decoded until the ceiling is exceeded are returned (chunks of 16 kB)
+        monkeypatch.setattr(signal, "LOAD_EXPANSION", 0)
+        result = geo_phy_data(FakeFs(), [query], datetime(1970, 1, 1, tzinfo=timezone.utc),
+                              datetime(1970, 1, 1, 0, 10, tzinfo=timezone.utc), limit_mb=100, passwords={},
+                              chunk_rows=500, max_query_mb=0.02)
+        assert 0 < result[0]["datapoints"][-1][1] < timestamps[-1] / 10 ** 6
+        assert result[1]["meta"]["notices"][0]["text"] == "Partial data (memory 0.02 MB)"
@@ -0,0 +1,54 @@
+from canedge_datasource.memory import MemoryBudget, MemoryGuard, DATAPOINT_BYTES
+
+
+class TestMemoryBudget(object):
+
+    def test_ceiling(self):
+        memory = MemoryBudget(1)
+        memory.add(2 ** 20)
+        assert not memory.exceeded
+
+        memory.add(1)
+        assert memory.exceeded
+
+        memory.release(2 ** 20)
+        assert not memory.exceeded
+        assert memory.peak == 2 ** 20 + 1
+
+    def test_no_ceiling(self):
+        memory = MemoryBudget(0)
+        memory.add(2 ** 40)
+        assert not memory.exceeded
+
+
+class TestMemoryGuard(object):
+
+    def test_no_ceiling(self):
+        guard = MemoryGuard(0, rss=lambda: 2 ** 40)
+        assert guard.available is None
+        assert guard.admits(2 ** 40)
+        assert guard.interval_factor(10 ** 9) == 1
+
+    def test_available(self):
+        guard = MemoryGuard(10, rss=lambda: 4 << 20)
+        assert guard.available == 6 << 20
+        assert guard.admits(6 << 20)
+        assert not guard.admits((6 << 20) + 1)
+
+        guard = MemoryGuard(10, rss=lambda: 20 << 20)
+        assert guard.available == 0
+        assert not guard.admits(1)
+
+    def test_rss_not_available(self):
+        guard = MemoryGuard(10, rss=lambda: 0)
+        assert guard.available is None
+        assert guard.admits(2 ** 40)
+        assert guard.interval_factor(10 ** 9) == 1
+
+    def test_interval_factor(self):
+        guard = MemoryGuard(10, rss=lambda: 8 << 20)
+
+        # Data points may use half of the 2 MB available
+        fits = (1 << 20) // DATAPOINT_BYTES
+        assert guard.interval_factor(fits) == 1
+        assert guard.interval_factor(fits * 3) == 3
@@ -0,0 +1,121 @@
+import io
+import mdf_iter
+import pytest
+
+from canedge_datasource import metadata
+from canedge_datasource.metadata import MetadataStore
+
+
+class FakeFs(object):
+
+    def __init__(self, files: dict):
+        self.files = files
+        self.reads = []
+
+    def get_file_infos(self, paths):
+        return {x: {"name": x, "size": len(self.files[x]), "ETag": f'"{hash(self.files[x])}"'} for x in paths}
+
+    @staticmethod
+    def get_file_version(info):
+        return info["ETag"].strip('"')
+
+    def open(self, path, mode="rb", **kwargs):
+        self.reads.append(path)
+        return io.BytesIO(self.files[path])
+
+
+class FakeMdfFile(object):
+    """Header is the first line of the file, "<start>;<session>". Files starting with "!" need a full read"""
+
+    def __init__(self, handle, passwords=None):
+        data = handle.read()
+        if data.startswith(b"!") and len(data) <= metadata.HEADER_BYTES:
+            raise ValueError("Truncated")
+        self.start, self.session = data.lstrip(b"!").split(b"\n")[0].split(b";")
+
+    def get_first_measurement(self):
+        return int(self.start)
+
+    def get_metadata(self):
+        return {"HDcomment.File Information.session": {"value_raw": self.session.decode()}}
+
+
+@pytest.fixture(autouse=True)
+def fake_mdf(monkeypatch):
+    monkeypatch.setattr(mdf_iter, "MdfFile", FakeMdfFile)
+
+
+class TestMetadata(object):
+
+    def test_get_many(self):
+        fs = FakeFs({"A/00000001/00000001.MF4": b"1000;1\n", "A/00000001/00000002.MF4": b"invalid"})
+        store = MetadataStore(fs)
+
+        entries = store.get_many(["A/00000001/00000001.MF4", "A/00000001/00000002.MF4"], {})
+
+        assert entries[0].start_epoch_ns == 1000
+        assert entries[0].size == 7
+        assert entries[0].get("HDcomment.File Information.session") == "1"
+        assert entries[1] is None
+
+    def test_cached_by_version(self):
+        fs = FakeFs({"A/00000001/00000001.MF4": b"1000;1\n"})
+        store = MetadataStore(fs)
+
+        store.get("A/00000001/00000001.MF4", {})
+        store.get("A/00000001/00000001.MF4", {})
+        assert len(fs.reads) == 1
+
+        # File replaced
+        fs.files["A/00000001/00000001.MF4"] = b"2000;1\n"
+        assert store.get("A/00000001/00000001.MF4", {}).start_epoch_ns == 2000
+        assert len(fs.reads) == 2
+
+    def test_full_read_fallback(self):
+        fs = FakeFs({"A/00000001/00000001.MF4": b"!3000;2\n" + b"\x00" * metadata.HEADER_BYTES})
+        store = MetadataStore(fs)
+
+        assert store.get("A/00000001/00000001.MF4", {}).start_epoch_ns == 3000
+        assert len(fs.reads) == 2
+
+    def test_persisted(self, tmp_path):
+        fs = FakeFs({"A/00000001/00000001.MF4": b"1000;1\n"})
+        path = str(tmp_path / "metadata.jsonl")
+
+        MetadataStore(fs, path=path).get("A/00000001/00000001.MF4", {})
+        store = MetadataStore(fs, path=path)
+
+        assert len(store) == 1
+        assert store.get("A/00000001/00000001.MF4", {}).start_epoch_ns == 1000
+        assert len(fs.reads) == 1
+
+    def test_compacted(self, tmp_path):
+        fs = FakeFs({"A/00000001/00000001.MF4": b"1000;1\n"})
+        path = tmp_path / "metadata.jsonl"
+
+        # New versions of a file are appended, until compacted
+        store = MetadataStore(fs, path=str(path))
+        for start in range(1000, 1010):
+            fs.files["A/00000001/00000001.MF4"] = f"{start};1\n".encode()
+            store.get("A/00000001/00000001.MF4", {})
+        assert len(path.read_text().splitlines()) <= 2
+
+        # Compacted when loaded, with the latest version
+        path.write_text(path.read_text() * 3)
+        store = MetadataStore(fs, path=str(path))
+        assert len(path.read_text().splitlines()) == 1
+        assert store.get("A/00000001/00000001.MF4", {}).start_epoch_ns == 1009
+
+    def test_max_entries(self):
+        fs = FakeFs({f"A/00000001/0000000{x}.MF4": f"{x}000;1\n".encode() for x in range(1, 5)})
+        store = MetadataStore(fs, max_entries=2)
+
+        store.get_many(["A/00000001/00000001.MF4", "A/00000001/00000002.MF4"], {})
+        store.get("A/00000001/00000001.MF4", {})
+        store.get("A/00000001/00000003.MF4", {})
+
+        # The least recently used entry is dropped
+        assert len(store) == 2
+        reads = len(fs.reads)
+        store.get_many(["A/00000001/00000001.MF4", "A/00000001/00000003.MF4"], {})
+        assert len(fs.reads) == reads
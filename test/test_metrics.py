@@ -0,0 +1,118 @@
+import threading
+
+from canedge_datasource.metrics import Counter, Gauge, Histogram, Registry, InstrumentedSimpleCache, \
+    CACHE_REQUESTS, CACHE_EVICTIONS, cache_namespace, enable_device_labels
+
+
+class TestMetrics(object):
+
+    def test_counter(self):
+        counter = Counter("test_total", "Test counter", ["reason"])
+        counter.inc(reason="limit")
+        counter.inc(2, reason="limit")
+        counter.inc(reason='a "b"')
+
+        assert counter.render() == [
+            "# HELP test_total Test counter",
+            "# TYPE test_total counter",
+            'test_total{reason="a \\"b\\""} 1',
+            'test_total{reason="limit"} 3',
+        ]
+
+    def test_gauge_function(self):
+        gauge = Gauge("test_gauge", "Test gauge", function=lambda: 1.5)
+        assert gauge.render()[-1] == "test_gauge 1.5"
+
+    def test_histogram(self):
+        histogram = Histogram("test_seconds", "Test histogram", ["stage"], buckets=[0.1, 1])
+        histogram.observe(0.05, stage="decode")
+        histogram.observe(0.1, stage="decode")
+        histogram.observe(5, stage="decode")
+
+        assert histogram.render()[2:] == [
+            'test_seconds_bucket{stage="decode",le="0.1"} 2',
+            'test_seconds_bucket{stage="decode",le="1"} 2',
+            'test_seconds_bucket{stage="decode",le="+Inf"} 3',
+            'test_seconds_sum{stage="decode"} 5.15',
+            'test_seconds_count{stage="decode"} 3',
+        ]
+
+    def test_device_label(self):
+        counter = Counter("test_skipped_total", "Test counter", ["reason", "device"])
+
+        # The device label is dropped by default
+        counter.inc(reason="limit", device="AABBCCDD")
+        counter.inc(reason="limit", device="11223344")
+        assert counter.render()[2:] == ['test_skipped_total{reason="limit"} 2']
+
+        try:
+            enable_device_labels()
+            counter = Counter("test_skipped_total", "Test counter", ["reason", "device"])
+            counter.inc(reason="limit", device="AABBCCDD")
+            assert counter.render()[2:] == ['test_skipped_total{reason="limit",device="AABBCCDD"} 1']
+        finally:
+            enable_device_labels(False)
+
+    def test_registry(self):
+        registry = Registry()
+        registry.register(Counter("a_total", "A"))
+        registry.register(Counter("b_total", "B"))
+        text = registry.render()
+        assert text.endswith("\n")
+        assert text.index("# HELP a_total") < text.index("# HELP b_total")
+
+
+class TestInstrumentedSimpleCache(object):
+
+    @staticmethod
+    def _count(metric, **labels):
+        return metric._values.get(metric._key(labels), 0)
+
+    def test_hits_and_misses(self):
+        cache = InstrumentedSimpleCache(threshold=10)
+        hits, misses = self._count(CACHE_REQUESTS, namespace="test", result="hit"), \
+            self._count(CACHE_REQUESTS, namespace="test", result="miss")
+
+        with cache_namespace("test"):
+            assert cache.get("key") is None
+            cache.set("key", 1)
+        assert cache.get("key") == 1
+
+        # Memoize version keys are not counted
+        cache.get("key_memver")
+
+        assert self._count(CACHE_REQUESTS, namespace="test", result="hit") == hits + 1
+        assert self._count(CACHE_REQUESTS, namespace="test", result="miss") == misses + 1
+
+    def test_evictions(self):
+        cache = InstrumentedSimpleCache(threshold=2)
+        evictions = self._count(CACHE_EVICTIONS, namespace="evict")
+
+        with cache_namespace("evict"):
+            for key in range(5):
+                cache.set(str(key), key)
+
+        assert self._count(CACHE_EVICTIONS, namespace="evict") > evictions
+
+    def test_concurrent(self):
+        cache = InstrumentedSimpleCache(threshold=20)
+        errors = []
+
+        def work(offset):
+            try:
+                with cache_namespace("concurrent"):
+                    for key in range(500):
+                        cache.set(str(offset + key), key)
+                        cache.get(str(offset + key - 1))
+                        cache.delete(str(offset + key - 2))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(i * 1000,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert set(cache._namespaces.keys()) <= set(cache._cache.keys())
@@ -0,0 +1,143 @@
+import threading
+import time
+import pytest
+
+from canedge_datasource.planner import QueryPlanner
+
+
+class TestQueryPlanner(object):
+
+    @pytest.fixture
+    def calls(self):
+        return []
+
+    @pytest.fixture
+    def planner(self, calls):
+        def process(signal_queries, start_date, stop_date, limit_mb):
+            calls.append((list(signal_queries), limit_mb))
+            return [f"{x}:{start_date}" for x in signal_queries]
+        return QueryPlanner(process=process, window_ms=50)
+
+    def test_merge_concurrent(self, planner, calls):
+
+        results = {}
+
+        def request(name, signal_queries):
+            assert planner.try_acquire()
+            try:
+                results[name] = planner.submit(signal_queries, 1, 2, limit_mb=100)
+            finally:
+                planner.release()
+
+        threads = [threading.Thread(target=request, args=("A", ["a1", "a2"])),
+                   threading.Thread(target=request, args=("B", ["b1"]))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Both requests processed in a single run, with the combined budget
+        assert len(calls) == 1
+        assert sorted(calls[0][0]) == ["a1", "a2", "b1"]
+        assert calls[0][1] == 200
+
+        # Each request gets its own results back
+        assert results["A"] == ["a1:1", "a2:1"]
+        assert results["B"] == ["b1:1"]
+
+    def test_different_range_not_merged(self, planner, calls):
+
+        results = {}
+
+        def request(name, start_date):
+            assert planner.try_acquire()
+            try:
+                results[name] = planner.submit([name], start_date, 2, limit_mb=100)
+            finally:
+                planner.release()
+
+        threads = [threading.Thread(target=request, args=("A", 0)),
+                   threading.Thread(target=request, args=("B", 1))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 2
+        assert results == {"A": ["A:0"], "B": ["B:1"]}
+
+    def test_memory_ceiling_not_scaled(self):
+        calls = []
+
+        def process(signal_queries, start_date, stop_date, limit_mb, max_query_mb):
+            calls.append((limit_mb, max_query_mb))
+            return list(signal_queries)
+
+        planner = QueryPlanner(process=process, window_ms=50)
+
+        def request(name):
+            assert planner.try_acquire()
+            try:
+                planner.submit([name], 1, 2, limit_mb=100, max_query_mb=500)
+            finally:
+                planner.release()
+
+        threads = [threading.Thread(target=request, args=(x,)) for x in "AB"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [(200, 500)]
+
+    def test_late_submit(self):
+        running, runs = [], []
+
+        def process(signal_queries, start_date, stop_date):
+            running.append(1)
+            runs.append((list(signal_queries), len(running)))
+            time.sleep(0.1)
+            running.pop()
+            return list(signal_queries)
+
+        planner = QueryPlanner(process=process, window_ms=50)
+        results = {}
+
+        def request(name, delay):
+            try:
+                time.sleep(delay)
+                results[name] = planner.submit([name], 1, 2)
+            finally:
+                planner.release()
+
+        # Both admitted within the window, B submitted after the batch has been taken
+        assert planner.try_acquire() and planner.try_acquire()
+        threads = [threading.Thread(target=request, args=("A", 0)),
+                   threading.Thread(target=request, args=("B", 0.08))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # B is processed in a later batch, not concurrently with A
+        assert runs == [(["A"], 1), (["B"], 1)]
+        assert results == {"A": ["A"], "B": ["B"]}
+
+    def test_busy_after_window(self, planner):
+
+        assert planner.try_acquire()
+        time.sleep(0.06)
+        assert not planner.try_acquire()
+        planner.release()
+        assert planner.try_acquire()
+        planner.release()
+
+    def test_error_propagated(self):
+
+        def process(signal_queries, start_date, stop_date):
+            raise ValueError("Failed")
+
+        planner = QueryPlanner(process=process, window_ms=0)
+
+        with pytest.raises(ValueError):
+            planner.submit(["a"], 1, 2)
@@ -0,0 +1,173 @@
+from datetime import datetime, timezone
+import can_decoder
+import canedge_browser
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource import signal
+from canedge_datasource.decoded import DecodedCache
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface, SampleMethod
+from canedge_datasource.memory import MemoryGuard
+from canedge_datasource.predecoder import PreDecoder, PreDecodeTarget, parse_targets
+from canedge_datasource.presence import PresenceIndex
+from canedge_datasource.signal import SignalQuery, time_series_phy_data
+
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 256 Frame: 8 X
+ SG_ Value : 0|16@1+ (1,0) [0|0] "" X
+ SG_ Other : 16|8@1+ (1,0) [0|0] "" X
+"""
+
+# Log files with their start time (in s). The last file is uploaded later
+LOG_FILES = {"AABBCCDD/00000001/00000001.MF4": 0, "AABBCCDD/00000001/00000002.MF4": 10,
+             "AABBCCDD/00000002/00000001.MF4": 30, "AABBCCDD/00000002/00000002.MF4": 40}
+
+
+class FakeFs(object):
+
+    def __init__(self, log_files: [str]):
+        self.log_files = log_files
+
+    def get_device_ids(self):
+        yield from sorted({x.split("/")[0] for x in self.log_files})
+
+    def get_device_sessions(self, device, reverse=False):
+        sessions = sorted({x.split("/")[1] for x in self.log_files if x.startswith(device)}, reverse=reverse)
+        for session in sessions:
+            yield session, f"{device}/{session}"
+
+    def get_device_splits(self, device, session, reverse=False):
+        for log_file in sorted([x for x in self.log_files if x.startswith(f"{device}/{session}/")], reverse=reverse):
+            yield log_file.split("/")[2].split(".")[0], log_file
+
+    def path_to_pars(self, path):
+        device, session, split = path.split("/")
+        return device, session, split, ".MF4"
+
+    def stat(self, path, **kwargs):
+        return {"size": 1 << 20}
+
+
+class FakeMetadata(object):
+
+    def __init__(self):
+        self.read = []
+
+    def get(self, log_file, passwords):
+        self.read.append(log_file)
+
+
+def make_data_frame(start_s: int, count: int) -> pd.DataFrame:
+    """Frames with values counting from the start time (in s), one frame per second on channel 1"""
+    index = pd.DatetimeIndex(pd.to_datetime((start_s + np.arange(count)) * 10 ** 9, utc=True), name="TimeStamp")
+    return pd.DataFrame({"BusChannel": np.ones(count, dtype=np.uint8),
+                         "ID": np.full(count, 0x100, dtype=np.uint32),
+                         "IDE": np.zeros(count, dtype=bool),
+                         "DLC": np.full(count, 8, dtype=np.uint8),
+                         "DataLength": np.full(count, 8, dtype=np.uint8),
+                         "DataBytes": [[(start_s + x) % 256, 0, 1, 0, 0, 0, 0, 0] for x in range(count)]}, index=index)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC)
+    return can_decoder.load_dbc(str(path))
+
+
+@pytest.fixture
+def log_files(monkeypatch):
+    loaded = []
+
+    def read_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        loaded.append(log_file)
+        df = make_data_frame(LOG_FILES[log_file], 10)
+        return (None, signal._to_frames(df, dict(predicates or ()).get(CanedgeInterface.CAN)),
+                signal._to_frames(df.iloc[:0]), np.unique(df["ID"].values))
+
+    monkeypatch.setattr(signal, "read_log_file", read_log_file)
+    monkeypatch.setattr(signal, "_load_log_file", read_log_file)
+    monkeypatch.setattr(canedge_browser, "get_log_files", lambda *args, **kwargs: list(LOG_FILES)[:3])
+    return loaded
+
+
+class TestPreDecoder(object):
+
+    def test_parse_targets(self):
+        assert parse_targets(["CANmod-GPS", "j1939:EngineSpeed, WheelBasedVehicleSpeed"]) == [
+            PreDecodeTarget(db="canmod-gps"),
+            PreDecodeTarget(db="j1939", signals=("EngineSpeed", "WheelBasedVehicleSpeed"))]
+
+    def test_new_files(self, db, log_files):
+        fs = FakeFs(list(LOG_FILES)[:3])
+        metadata, presence, decoded = FakeMetadata(), PresenceIndex(), DecodedCache()
+        predecoder = PreDecoder(fs, {"test": {"db": db}}, [PreDecodeTarget(db="test")], {}, metadata, presence,
+                                decoded)
+
+        # Only the most recent file on the first poll
+        assert predecoder.poll() == 1
+        assert log_files == ["AABBCCDD/00000002/00000001.MF4"]
+        assert metadata.read == log_files
+        assert presence.file_ids("AABBCCDD", "AABBCCDD/00000002/00000001.MF4") == frozenset([0x100])
+        assert len(decoded) == 2 * len(CanedgeChannel)
+
+        # Files uploaded since the last poll
+        assert predecoder.poll() == 0
+        fs.log_files.append("AABBCCDD/00000002/00000002.MF4")
+        assert predecoder.poll() == 1
+        assert log_files[1:] == ["AABBCCDD/00000002/00000002.MF4"]
+
+    def test_skip_files(self, db, log_files):
+        decoded = DecodedCache()
+
+        # Files of 1 MB exceed the data limit
+        predecoder = PreDecoder(FakeFs(list(LOG_FILES)[:3]), {"test": {"db": db}}, [PreDecodeTarget(db="test")], {},
+                                FakeMetadata(), PresenceIndex(), decoded, limit_mb=0)
+        assert predecoder.poll() == 0
+
+        # 5 MB available: files of 1 MB are not expected to fit when loaded
+        predecoder = PreDecoder(FakeFs(list(LOG_FILES)[:3]), {"test": {"db": db}}, [PreDecodeTarget(db="test")], {},
+                                FakeMetadata(), PresenceIndex(), decoded, limit_mb=100,
+                                memory_guard=MemoryGuard(100, rss=lambda: 95 << 20))
+        assert predecoder.poll() == 0
+        assert log_files == [] and len(decoded) == 0
+
+    def test_served_from_cache(self, db, log_files):
+        start_date = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        stop_date = datetime(1970, 1, 1, 0, 0, 35, tzinfo=timezone.utc)
+
+        def query(**kwargs):
+            signal_query = SignalQuery(refid="A", target="Value", device="AABBCCDD", itf=CanedgeInterface.CAN,
+                                       chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=4000,
+                                       method=SampleMethod.MAX)
+            return time_series_phy_data(FakeFs([]), [signal_query], start_date, stop_date, limit_mb=100,
+                                        passwords={}, tp_type="", **kwargs)[0]["datapoints"]
+
+        expected = query()
+        assert len(log_files) == 3
+
+        decoded = DecodedCache()
+        predecoder = PreDecoder(FakeFs(list(LOG_FILES)[:3]), {"test": {"db": db}}, [PreDecodeTarget(db="test")], {},
+                                FakeMetadata(), PresenceIndex(), decoded, backlog=10)
+        assert predecoder.poll() == 3
+
+        log_files.clear()
+        assert query(decoded_cache=decoded) == expected
+        assert log_files == []
+
+        # Signals not pre-decoded are loaded
+        partial = DecodedCache()
+        PreDecoder(FakeFs(["AABBCCDD/00000001/00000001.MF4"]), {"test": {"db": db}},
+                   [PreDecodeTarget(db="test", signals=("Other",))], {}, FakeMetadata(), PresenceIndex(),
+                   partial).poll()
+        log_files.clear()
+        assert query(decoded_cache=partial) == expected
+        assert len(log_files) == 3
@@ -0,0 +1,68 @@
+import can_decoder
+import numpy as np
+import pytest
+
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface
+from canedge_datasource.presence import PresenceIndex
+from canedge_datasource.raw_frames import FramePredicate
+from canedge_datasource.signal import SignalQuery, _may_match, _query_predicates
+
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 256 Motorola: 8 X
+ SG_ BeU16 : 7|16@0+ (0.1,0) [0|0] "" X
+
+BO_ 512 Muxed: 8 X
+ SG_ Mux M : 0|8@1+ (1,0) [0|0] "" X
+ SG_ A m0 : 8|16@1- (0.5,-3) [0|0] "" X
+
+BO_ 2147484416 Extended: 8 X
+ SG_ Float : 0|32@1- (1,0) [0|0] "" X
+
+BO_ 1536 Double: 8 X
+ SG_ F64 : 0|64@1- (1,0) [0|0] "" X
+
+BO_ 1280 Fd: 16 X
+ SG_ Late : 96|16@1+ (1,0) [0|0] "" X
+
+SIG_VALTYPE_ 2147484416 Float : 1;
+SIG_VALTYPE_ 1536 F64 : 2;
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC)
+    return can_decoder.load_dbc(str(path))
+
+
+class TestPredicates(object):
+
+    def test_query_predicates(self, db):
+        queries = [SignalQuery(refid="A", target="A", device="AABBCCDD", itf=CanedgeInterface.CAN, chn=chn, db=db,
+                               signal_name=name, interval_ms=100) for chn, name in [(CanedgeChannel.CH1, "BeU16"),
+                                                                                     (CanedgeChannel.CH2, "Float")]]
+
+        predicates = dict(_query_predicates(queries, "", 1, 2))
+        assert predicates[CanedgeInterface.CAN] == FramePredicate(channels=(1, 2), ids=(0x100, 0x300), pgns=None,
+                                                                  start_ns=1, stop_ns=2)
+
+        # With TP, all frames of the DB are needed
+        predicates = dict(_query_predicates(queries, "uds", 1, 2))
+        assert predicates[CanedgeInterface.CAN].ids == (0x100, 0x200, 0x300, 0x500, 0x600)
+
+    def test_presence_skip(self):
+        presence = PresenceIndex()
+        predicate = FramePredicate(ids=(0x100,))
+
+        assert _may_match(presence, "AABBCCDD", "AABBCCDD/00000001/00000001.MF4", predicate)
+        presence.record("AABBCCDD", "AABBCCDD/00000001/00000001.MF4", np.array([0x200], dtype=np.uint32))
+        assert not _may_match(presence, "AABBCCDD", "AABBCCDD/00000001/00000001.MF4", predicate)
+        assert _may_match(None, "AABBCCDD", "AABBCCDD/00000001/00000001.MF4", predicate)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from canedge_datasource.presence import PresenceIndex
+
+
+class TestPresence(object):
+
+    def test_record(self):
+        presence = PresenceIndex(max_files_per_device=2)
+        assert presence.ids("AABBCCDD") is None
+
+        presence.record("AABBCCDD", "AABBCCDD/00000001/00000001.MF4", np.array([1, 2, 2, 3], dtype=np.uint32))
+        presence.record("AABBCCDD", "AABBCCDD/00000001/00000002.MF4", np.array([4], dtype=np.uint32))
+        assert presence.ids("AABBCCDD") == {1, 2, 3, 4}
+        assert presence.has("AABBCCDD", "AABBCCDD/00000001/00000001.MF4")
+
+        # Oldest file dropped
+        presence.record("AABBCCDD", "AABBCCDD/00000001/00000003.MF4", np.array([5], dtype=np.uint32))
+        assert presence.ids("AABBCCDD") == {4, 5}
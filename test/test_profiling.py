@@ -0,0 +1,80 @@
+import json
+import os
+from canedge_datasource.metrics import timer
+from canedge_datasource.profiling import Profiler, RequestTrace, activate, active_traces, bypass_cache, \
+    is_debug_request, normalize_request, record_file
+
+
+def _query_request(target: dict) -> dict:
+    return {"requestId": "Q100", "startTime": 1, "range": {"from": "2022-01-08T10:00:00.000Z"},
+            "targets": [{"refId": "A", "target": json.dumps(target)}]}
+
+
+class TestProfiling(object):
+
+    def test_debug_request(self):
+        assert is_debug_request(_query_request({"device": "AABBCCDD", "debug": True}))
+        assert not is_debug_request(_query_request({"device": "AABBCCDD"}))
+        assert is_debug_request({"target": '{"search": "device", "debug": true}'})
+        assert is_debug_request({"annotation": {"query": '{"annotation": "session", "debug": 1}'}})
+        assert not is_debug_request({"target": "not json"})
+        assert not is_debug_request(None)
+
+    def test_normalize_request(self):
+        req = normalize_request(_query_request({"device": "AABBCCDD"}))
+        assert "requestId" not in req and "startTime" not in req
+        assert "targets" in req
+
+    def test_not_traced(self):
+        profiler = Profiler()
+        assert profiler.start("/query", _query_request({"device": "AABBCCDD"})) is None
+        assert profiler.start("/alive", _query_request({"device": "AABBCCDD", "debug": True})) is None
+
+    def test_debug_trace(self, tmp_path):
+        log_path = str(tmp_path / "slow.jsonl")
+        profiler = Profiler(log_path=log_path, profile_dir=str(tmp_path / "profiles"))
+
+        trace = profiler.start("/query", _query_request({"device": "AABBCCDD", "debug": True}))
+        assert trace is not None and trace.debug
+        assert bypass_cache()
+
+        with timer("decode", "AABBCCDD"):
+            pass
+        record_file("AABBCCDD/00000001/00000001.MF4", "AABBCCDD", "processed")
+        record_file("AABBCCDD/00000001/00000002.MF4", "AABBCCDD", "skipped (limit)")
+
+        profiler.finish(trace, 200)
+        assert active_traces() == []
+
+        with open(log_path) as f:
+            entries = [json.loads(x) for x in f]
+        assert len(entries) == 1
+        entry = entries[0]
+        assert entry["endpoint"] == "/query"
+        assert entry["status"] == 200
+        assert entry["stages"]["decode"]["count"] == 1
+        assert [x["status"] for x in entry["files"]] == ["processed", "skipped (limit)"]
+        assert "requestId" not in entry["request"]
+        assert os.path.isfile(entry["profile"])
+
+    def test_threshold(self, tmp_path):
+        log_path = str(tmp_path / "slow.jsonl")
+
+        profiler = Profiler(threshold_s=60, log_path=log_path)
+        trace = profiler.start("/search", {"target": '{"search": "device"}'})
+        assert trace is not None and not bypass_cache()
+        profiler.finish(trace, 200)
+        assert not os.path.exists(log_path)
+
+        profiler = Profiler(threshold_s=1e-9, log_path=log_path)
+        profiler.finish(profiler.start("/search", {"target": '{"search": "device"}'}), 200)
+        with open(log_path) as f:
+            assert json.loads(f.readline())["slow"]
+
+    def test_activate(self):
+        traces = [RequestTrace("/query", {}), RequestTrace("/query", {})]
+        with activate(traces):
+            with timer("resample"):
+                pass
+        assert active_traces() == []
+        assert all(x.to_dict()["stages"]["resample"]["count"] == 1 for x in traces)
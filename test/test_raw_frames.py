@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from canedge_datasource.raw_frames import RawFrames, FramePredicate, to_epoch_ns
+
+
+def make_data_frame():
+    index = pd.DatetimeIndex(pd.to_datetime([3, 1, 2, 4], unit="ms", utc=True), name="TimeStamp")
+    return pd.DataFrame({"BusChannel": np.array([1, 2, 1, 2], dtype=np.uint8),
+                         "ID": np.array([0x100, 0x18FEF100, 0x200, 0x100], dtype=np.uint32),
+                         "IDE": [False, True, False, False],
+                         "DLC": np.array([2, 8, 0, 13], dtype=np.uint8),
+                         "DataLength": np.array([2, 8, 0, 32], dtype=np.uint8),
+                         "DataBytes": [[1, 2], list(range(8)), [], list(range(32))]}, index=index)
+
+
+class TestRawFrames(object):
+
+    def test_round_trip(self):
+        df = make_data_frame()
+        frames = RawFrames.from_data_frame(df)
+
+        assert frames.data.shape == (4, 32)
+        assert frames.timestamp.dtype == np.int64
+        assert frames.length.tolist() == [8, 0, 2, 32]
+
+        df_out = frames.to_data_frame()
+        df_sorted = df.sort_index()
+        assert df_out.index.equals(df_sorted.index)
+        assert df_out["DataBytes"].tolist() == df_sorted["DataBytes"].tolist()
+        assert df_out["ID"].tolist() == df_sorted["ID"].tolist()
+        assert df_out["IDE"].tolist() == [1, 0, 0, 0]
+        assert df_out["DataLength"].tolist() == df_sorted["DataLength"].tolist()
+
+    def test_views(self):
+        frames = RawFrames.from_data_frame(make_data_frame())
+
+        selected = frames.between(to_epoch_ns(pd.Timestamp(2, unit="ms", tz="UTC")),
+                                  to_epoch_ns(pd.Timestamp(3, unit="ms", tz="UTC")))
+        assert selected.id.tolist() == [0x200, 0x100]
+        assert np.shares_memory(selected.data, frames.data)
+
+        assert frames[frames.channel == 2].id.tolist() == [0x18FEF100, 0x100]
+
+    def test_lin(self):
+        df = make_data_frame().drop(columns=["IDE", "DLC"])
+        frames = RawFrames.from_data_frame(df)
+
+        assert frames.ide.tolist() == [0, 0, 0, 0]
+        assert frames.dlc.tolist() == frames.length.tolist()
+
+    def test_empty(self):
+        frames = RawFrames.from_data_frame(pd.DataFrame())
+
+        assert len(frames) == 0
+        assert len(frames.to_data_frame()) == 0
+
+    def test_chunked_conversion(self):
+        df = make_data_frame()
+        frames = RawFrames.from_data_frame(df)
+        chunked = RawFrames.from_data_frame(df, chunk_rows=3)
+
+        assert chunked.data.shape == frames.data.shape
+        for name in ["timestamp", "id", "channel", "ide", "dlc", "length", "data"]:
+            assert (getattr(chunked, name) == getattr(frames, name)).all()
+
+        assert len(RawFrames.concat([RawFrames.empty(), frames[:1]])) == 1
+
+    def test_predicate(self):
+        df = make_data_frame()
+
+        predicate = FramePredicate(channels=(1,), start_ns=2 * 10 ** 6, stop_ns=3 * 10 ** 6)
+        assert predicate.mask(df).tolist() == [True, False, True, False]
+        assert FramePredicate(start_ns=3 * 10 ** 6).mask(df).tolist() == [True, False, False, True]
+
+        # Frames selected by ID (extended bit ignored) or by PGN
+        assert FramePredicate(ids=(0x200,)).mask(df).tolist() == [False, False, True, False]
+        assert FramePredicate(ids=(0x200,), pgns=(0xFEF1,)).mask(df).tolist() == [False, True, True, False]
+
+        assert FramePredicate(ids=(0x200,)).matches_ids({0x100, 0x200})
+        assert not FramePredicate(ids=(0x200,)).matches_ids({0x100})
+        assert FramePredicate(pgns=(0xFEF1,)).matches_ids({0x18FEF1FE})
+        assert not FramePredicate(pgns=(0xFEF1,)).matches_ids({0xF1})
+        assert FramePredicate(channels=(1,)).matches_ids(set())
@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+import canedge_browser
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource import signal
+from canedge_datasource.enums import CanedgeInterface
+from canedge_datasource.raw_frames import payload_matrix
+from canedge_datasource.signal import _format_hex, table_raw_data
+
+LOG_FILES = ["AABBCCDD/00000001/00000001.MF4", "AABBCCDD/00000001/00000002.MF4"]
+
+
+def make_data_frame(start_s: int, count: int, lin: bool = False) -> pd.DataFrame:
+    index = pd.DatetimeIndex(pd.to_datetime(start_s + np.arange(count), unit="s", utc=True), name="TimeStamp")
+    df = pd.DataFrame({"BusChannel": np.ones(count, dtype=np.uint8),
+                       "ID": (np.arange(count) % 3).astype(np.uint32),
+                       "DataLength": np.full(count, 2, dtype=np.uint8),
+                       "DataBytes": [[x % 256, 0xAA] for x in range(count)]}, index=index)
+    if not lin:
+        df["IDE"] = False
+        df["DLC"] = df["DataLength"]
+    return df
+
+
+@pytest.fixture
+def log_files(monkeypatch):
+    data = {LOG_FILES[0]: (make_data_frame(0, 7), make_data_frame(0, 5, lin=True)),
+            LOG_FILES[1]: (make_data_frame(100, 6), make_data_frame(0, 0, lin=True))}
+
+    # Frames selected by the predicates, as when loading a log file
+    def load_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        predicates = dict(predicates or ())
+        df_can, df_lin = data[log_file]
+        return (None, signal._to_frames(df_can, predicates.get(CanedgeInterface.CAN)),
+                signal._to_frames(df_lin, predicates.get(CanedgeInterface.LIN)), np.unique(df_can["ID"].values))
+
+    monkeypatch.setattr(canedge_browser, "get_log_files", lambda *args, **kwargs: list(LOG_FILES))
+    monkeypatch.setattr(signal, "_load_log_file", load_log_file)
+
+
+class TestRawTable(object):
+
+    start_date = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    stop_date = datetime(1970, 1, 2, tzinfo=timezone.utc)
+
+    def query(self, max_data_points, **kwargs):
+        return table_raw_data(None, "AABBCCDD", self.start_date, self.stop_date, max_data_points, {}, **kwargs)
+
+    def test_format_hex(self):
+        payloads = [[0x00, 0x1F, 0xFF], [], list(range(64))]
+
+        expected = [" ".join(f"{x:02X}" for x in payload) for payload in payloads]
+
+        assert _format_hex(*payload_matrix(payloads)).tolist() == expected
+
+    def test_format_hex_empty(self):
+        assert _format_hex(*payload_matrix([])).tolist() == []
+        assert _format_hex(*payload_matrix([[]])).tolist() == [""]
+
+    @pytest.mark.parametrize("page_size", [1, 4, 7, 12, 18])
+    def test_pages(self, log_files, page_size):
+        rows_all = self.query(1000)[0]["rows"]
+        assert len(rows_all) == 18
+        assert rows_all[0][-1] == "00 AA"
+
+        rows, cursor = [], None
+        while True:
+            res = self.query(page_size, cursor=cursor)
+            rows.extend(res[0]["rows"])
+            cursor = res[0]["meta"]["cursor"]
+            if cursor is None:
+                break
+
+        assert rows == rows_all
+
+    def test_filter(self, log_files):
+        rows = self.query(1000, ids=[1])[0]["rows"]
+        assert {x[3] for x in rows} == {1}
+        assert {x[1] for x in rows} == {"CAN", "LIN"}
+
+    @pytest.mark.parametrize("cursor", ["AABBCCDD/00000001/00000001.MF4", "AABBCCDD/00000001/00000001.MF4:x",
+                                        "AABBCCDD/00000001/00000001.MF4:-1", ":3", 12])
+    def test_malformed_cursor(self, log_files, cursor):
+        assert self.query(4, cursor=cursor) is None
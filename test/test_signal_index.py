@@ -0,0 +1,53 @@
+import can_decoder
+import pytest
+
+from canedge_datasource.signal_index import SignalIndex, calculate_pgn
+
+
+@pytest.fixture
+def db():
+    return can_decoder.load_dbc("LOG/canmod-gps.dbc")
+
+
+class TestSignalIndex(object):
+
+    def test_all(self, db):
+        index = SignalIndex(db)
+        signals, cursor = index.search()
+
+        assert signals == list(dict.fromkeys(db.signals()))
+        assert cursor is None
+
+    def test_match(self, db):
+        index = SignalIndex(db)
+
+        assert index.search("lat", match="prefix")[0] == ["Latitude"]
+        assert {"Latitude", "Longitude", "AltitudeValid"} <= set(index.search("itude", match="substring")[0])
+        assert index.search("Lattitude", match="fuzzy")[0][0] == "Latitude"
+
+        with pytest.raises(ValueError):
+            index.search("lat", match="regex")
+
+    def test_pagination(self, db):
+        index = SignalIndex(db)
+        signals_all, _ = index.search()
+
+        signals, cursor = [], 0
+        while cursor is not None:
+            page, cursor = index.search(limit=3, cursor=cursor)
+            assert len(page) <= 3
+            signals.extend(page)
+
+        assert signals == signals_all
+
+    def test_filter(self, db):
+        index = SignalIndex(db)
+        frame_id = next(x for x, frame in db.frames.items() if any(s.name == "Latitude" for s in frame.signals))
+
+        assert "Latitude" in index.search(frame_ids=[frame_id])[0]
+        assert "Latitude" in index.search(seen_ids={frame_id})[0]
+        assert "Latitude" not in index.search(seen_ids={0x7FF})[0]
+
+    def test_pgn(self):
+        assert calculate_pgn(0x18FEF100) == 0xFEF1
+        assert calculate_pgn(0x18EA00F9) == 0xEA00
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from canedge_datasource.enums import SampleMethod
+from canedge_datasource.resample import SignalResampler
+
+
+def resample_pandas(timestamps: np.ndarray, values: np.ndarray, interval_ms: int, method: SampleMethod):
+    """Resampling of a whole signal with pandas, as previously done per log file"""
+    index = pd.DatetimeIndex(timestamps.astype("datetime64[ns]"), name="TimeStamp").tz_localize("UTC")
+    df = pd.DataFrame({"Physical Value": values, "time_orig": index}, index=index)
+
+    if method == SampleMethod.MIN:
+        df_resample = df.resample(f"{interval_ms}ms").min()
+    elif method == SampleMethod.MAX:
+        df_resample = df.resample(f"{interval_ms}ms").max()
+    else:
+        df_resample = df.resample(f"{interval_ms}ms").nearest()
+
+    df_resample.drop_duplicates(subset='time_orig', inplace=True)
+    df_resample.dropna(axis=0, how='any', inplace=True)
+
+    return (df_resample["time_orig"].astype(np.int64) / 10 ** 6).tolist(), df_resample["Physical Value"].values.tolist()
+
+
+def resample_chunks(resampler: SignalResampler, timestamps: np.ndarray, values: np.ndarray, cuts: [int]):
+    out_timestamps, out_values = [], []
+    for start, stop in zip([0] + cuts, cuts + [len(timestamps)]):
+        chunk_timestamps, chunk_values = resampler.add(timestamps[start:stop], values[start:stop])
+        out_timestamps.extend(chunk_timestamps)
+        out_values.extend(chunk_values)
+
+    chunk_timestamps, chunk_values = resampler.flush()
+    return out_timestamps + chunk_timestamps, out_values + chunk_values
+
+
+class TestSignalResampler(object):
+
+    @pytest.mark.parametrize("method", list(SampleMethod))
+    @pytest.mark.parametrize("interval_ms", [1, 10, 115, 755, 1000])
+    def test_equal_to_pandas(self, method, interval_ms):
+        rng = np.random.default_rng(interval_ms)
+
+        for _ in range(20):
+            timestamps = np.unique(rng.integers(0, 5 * 10 ** 9, rng.integers(1, 300))) + 1641636000 * 10 ** 9
+            values = rng.normal(size=len(timestamps))
+            values[rng.random(len(timestamps)) < 0.1] = np.nan
+            cuts = sorted(rng.integers(0, len(timestamps), rng.integers(0, 5)).tolist())
+
+            expected = resample_pandas(timestamps, values, interval_ms, method)
+            actual = resample_chunks(SignalResampler(interval_ms, method), timestamps, values, cuts)
+
+            assert actual[0] == expected[0]
+            np.testing.assert_array_equal(actual[1], expected[1])
+
+    def test_min_max_pending(self):
+        resampler = SignalResampler(100, SampleMethod.MAX)
+        timestamps = np.array([0, 50, 120], dtype=np.int64) * 10 ** 6
+
+        # The last interval is held back until it is complete
+        assert resampler.add(timestamps[:2], np.array([1.0, 3.0])) == ([], [])
+        assert resampler.pending
+        assert resampler.add(timestamps[2:], np.array([2.0])) == ([50.0], [3.0])
+        assert resampler.flush() == ([120.0], [2.0])
+        assert not resampler.pending
+
+    def test_origin(self):
+        timestamps = np.array([50, 149, 150], dtype=np.int64) * 10 ** 6
+        values = np.array([1.0, 2.0, 3.0])
+
+        assert resample_chunks(SignalResampler(100, SampleMethod.MIN), timestamps, values, []) == \
+               ([50.0, 149.0], [1.0, 2.0])
+        assert resample_chunks(SignalResampler(100, SampleMethod.MIN, origin_ns=50 * 10 ** 6), timestamps, values,
+                               []) == ([50.0, 150.0], [1.0, 3.0])
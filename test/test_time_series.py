@@ -0,0 +1,191 @@
+from datetime import datetime, timezone
+import can_decoder
+import canedge_browser
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+from canedge_datasource import cache, signal
+from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.enums import CanedgeChannel, CanedgeInterface, SampleMethod
+from canedge_datasource.deadline import Deadline
+from canedge_datasource.memory import MemoryBudget, MemoryGuard
+from canedge_datasource.raw_frames import FramePredicate
+from canedge_datasource.signal import SignalQuery, time_series_phy_data
+
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: X
+
+BO_ 256 Frame: 8 X
+ SG_ Value : 0|16@1+ (1,0) [0|0] "" X
+"""
+
+# Two files of session 1 (continuous), and one file of session 2
+LOG_FILES = {"AABBCCDD/00000001/00000001.MF4": 0, "AABBCCDD/00000001/00000002.MF4": 10,
+             "AABBCCDD/00000002/00000001.MF4": 30}
+
+
+class FakeFs(CanedgeFileSystem):
+
+    def __init__(self):
+        pass
+
+    def stat(self, path, **kwargs):
+        return {"size": 1 << 20}
+
+
+def make_data_frame(start_s: int, count: int) -> pd.DataFrame:
+    """Frames with values counting from the start time (in s), one frame per second on channel 1"""
+    index = pd.DatetimeIndex(pd.to_datetime((start_s + np.arange(count)) * 10 ** 9, utc=True), name="TimeStamp")
+    return pd.DataFrame({"BusChannel": np.ones(count, dtype=np.uint8),
+                         "ID": np.full(count, 0x100, dtype=np.uint32),
+                         "IDE": np.zeros(count, dtype=bool),
+                         "DLC": np.full(count, 8, dtype=np.uint8),
+                         "DataLength": np.full(count, 8, dtype=np.uint8),
+                         "DataBytes": [[(start_s + x) % 256, 0, 0, 0, 0, 0, 0, 0] for x in range(count)]}, index=index)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "test.dbc"
+    path.write_text(DBC)
+    return can_decoder.load_dbc(str(path))
+
+
+@pytest.fixture
+def log_files(monkeypatch):
+    data = {log_file: make_data_frame(start_s, 10) for log_file, start_s in LOG_FILES.items()}
+    loaded = []
+
+    def load_log_file(fs, log_file, itf_used, passwords, predicates=None):
+        loaded.append(log_file)
+        df = data[log_file]
+        return (None, signal._to_frames(df, dict(predicates or ()).get(CanedgeInterface.CAN)),
+                signal._to_frames(df.iloc[:0]), np.unique(df["ID"].values))
+
+    monkeypatch.setattr(canedge_browser, "get_log_files", lambda *args, **kwargs: list(LOG_FILES))
+    monkeypatch.setattr(signal, "_load_log_file", load_log_file)
+    return loaded
+
+
+class TestTimeSeries(object):
+
+    start_date = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    stop_date = datetime(1970, 1, 2, tzinfo=timezone.utc)
+
+    def query(self, db, interval_ms, method=SampleMethod.MAX, **kwargs):
+        signal_query = SignalQuery(refid="A", target="Value", device="AABBCCDD", itf=CanedgeInterface.CAN,
+                                   chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=interval_ms,
+                                   method=method)
+        return time_series_phy_data(FakeFs(), [signal_query], self.start_date, self.stop_date, limit_mb=100,
+                                    passwords={}, tp_type="", **kwargs)[0]["datapoints"]
+
+    def test_continuous_across_files(self, db, log_files):
+
+        # Intervals of 4 s: the interval 8-12 s spans the first two files, and is not split
+        datapoints = self.query(db, 4000)
+        assert [list(x) for x in datapoints] == [[3.0, 3000.0], [7.0, 7000.0], [11.0, 11000.0], [15.0, 15000.0], [19.0, 19000.0],
+                              [None, None], [31.0, 31000.0], [35.0, 35000.0], [39.0, 39000.0]]
+
+    @pytest.mark.parametrize("chunk_rows", [None, 1, 3])
+    def test_chunks(self, db, log_files, chunk_rows):
+        datapoints = self.query(db, 1000, method=SampleMethod.NEAREST, chunk_rows=chunk_rows)
+        assert [x[0] for x in datapoints] == list(range(20)) + [None] + list(range(30, 40))
+
+    def test_memory_ceiling(self, db, log_files, monkeypatch):
+        monkeypatch.setattr(signal, "LOAD_EXPANSION", 0)
+        result = time_series_phy_data(FakeFs(), [SignalQuery(refid="A", target="Value", device="AABBCCDD",
+                                                             itf=CanedgeInterface.CAN, chn=CanedgeChannel.CH1, db=db,
+                                                             signal_name="Value", interval_ms=1000)],
+                                      self.start_date, self.stop_date, limit_mb=100, passwords={}, tp_type="",
+                                      max_query_mb=0.0001)[0]
+
+        # Remaining files skipped once the ceiling is exceeded
+        assert len(log_files) == 1
+        assert "memory" in result["meta"]["notices"][0]["text"]
+
+    def test_memory_ceiling_load(self, db, log_files):
+
+        signal_query = SignalQuery(refid="A", target="Value", device="AABBCCDD", itf=CanedgeInterface.CAN,
+                                   chn=CanedgeChannel.CH1, db=db, signal_name="Value", interval_ms=1000)
+
+        # The data frame of a 1 MB file is expected to take 10 MB while loading
+        result = time_series_phy_data(FakeFs(), [signal_query], self.start_date, self.stop_date, limit_mb=100,
+                                      passwords={}, tp_type="", max_query_mb=5)[0]
+        assert len(log_files) == 0
+        assert "memory 5 MB" in result["meta"]["notices"][0]["text"]
+
+        result = time_series_phy_data(FakeFs(), [signal_query], self.start_date, self.stop_date, limit_mb=100,
+                                      passwords={}, tp_type="", max_query_mb=20)[0]
+        assert len(log_files) == 3
+        assert "meta" not in result
+
+    def test_skip_reason(self):
+        assert signal._skip_reason(deadline=Deadline(), memory=MemoryBudget(1)) is None
+        assert signal._skip_reason(file_size=2 << 20, data_processed_mb=99, limit_mb=100) == ("limit", "limit 100 MB")
+        assert signal._skip_reason(memory=MemoryBudget(5), file_size=1 << 20) == ("memory", "memory 5 MB")
+        assert signal._skip_reason(memory_guard=MemoryGuard(100, rss=lambda: 95 << 20),
+                                   file_size=1 << 20) == ("process_memory", "process memory 100 MB")
+
+        # The deadline is checked before the memory ceiling
+        memory = MemoryBudget(1)
+        memory.add(2 << 20)
+        assert signal._skip_reason(deadline=Deadline(), memory=memory) == ("memory", "memory 1 MB")
+        assert signal._skip_reason(deadline=Deadline(-1), memory=memory) == ("deadline", "deadline -1 s")
+
+    def test_load_cache_time_window(self, monkeypatch):
+        df = make_data_frame(0, 10)
+        loaded = []
+
+        def read_log_file(fs, log_file, itf_used, passwords, predicates=None):
+            loaded.append(predicates)
+            return (None, signal._to_frames(df, dict(predicates).get(CanedgeInterface.CAN)),
+                    signal._to_frames(df.iloc[:0]), np.unique(df["ID"].values))
+
+        monkeypatch.setattr(signal, "read_log_file", read_log_file)
+
+        app = Flask(__name__)
+        cache.init_app(app)
+        with app.app_context():
+            for start_s, stop_s in [(0, 9), (2, 5), (4, 20)]:
+                predicate = FramePredicate(channels=(1,), start_ns=start_s * 10 ** 9, stop_ns=stop_s * 10 ** 9)
+                _, frames, _, _ = signal._load_log_file(None, "AABBCCDD/00000001/00000001.MF4",
+                                                        [CanedgeInterface.CAN], {},
+                                                        ((CanedgeInterface.CAN, predicate),))
+                assert (frames.timestamp // 10 ** 9).tolist() == list(range(start_s, min(stop_s, 9) + 1))
+
+        # Loaded once, without the time window
+        assert len(loaded) == 1
+        assert loaded[0][0][1].start_ns is None and loaded[0][0][1].stop_ns is None
+
+    def test_memory_guard_reject(self, db, log_files):
+        guard = MemoryGuard(100, rss=lambda: 100 << 20)
+        result = time_series_phy_data(FakeFs(), [SignalQuery(refid="A", target="Value", device="AABBCCDD",
+                                                             itf=CanedgeInterface.CAN, chn=CanedgeChannel.CH1, db=db,
+                                                             signal_name="Value", interval_ms=1000)],
+                                      self.start_date, self.stop_date, limit_mb=100, passwords={}, tp_type="",
+                                      memory_guard=guard)[0]
+
+        assert len(log_files) == 0
+        assert result["datapoints"] == []
+        assert "Rejected" in result["meta"]["notices"][0]["text"]
+
+    def test_memory_guard_degrade(self, db, log_files):
+
+        # 15 MB available: the data points of a day at 1 s (~10 MB) exceed their share, the interval is doubled
+        guard = MemoryGuard(100, rss=lambda: 85 << 20)
+        datapoints = self.query(db, 1000, method=SampleMethod.NEAREST, memory_guard=guard)
+        assert [x[0] for x in datapoints] == list(range(0, 20, 2)) + [None] + list(range(30, 40, 2))
+
+    def test_memory_guard_skip_files(self, db, log_files):
+
+        # 5 MB available: files of 1 MB are not expected to fit when loaded
+        guard = MemoryGuard(100, rss=lambda: 95 << 20)
+        self.query(db, 60000, memory_guard=guard)
+        assert len(log_files) == 0
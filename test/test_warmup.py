@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+
+from canedge_datasource import warmup
+from canedge_datasource.dashboard import Dashboard
+from canedge_datasource.warmup import Warmup, device_variables
+
+TEMPLATE = Path(__file__).resolve().parent.parent / "dashboard_templates" / "dashboard-template-simple.json"
+
+
+class FakeServer(object):
+    """Answers searches, and rejects the first query as busy"""
+
+    def __init__(self):
+        self.requests = []
+        self.busy = 1
+
+    def post(self, endpoint, body):
+        self.requests.append((endpoint, body))
+        if endpoint == "/search":
+            search = json.loads(body["target"])
+            return 200, {"device": ["AABBCCDD", "11223344"],
+                         "db": ["canmod-gps"],
+                         "signal": [f"Speed ({search.get('db')})"]}.get(search["search"], [])
+        if endpoint == "/query" and self.busy > 0:
+            self.busy -= 1
+            return 501, None
+        return 200, []
+
+
+class TestWarmup(object):
+
+    def test_device_variables(self):
+        assert device_variables(Dashboard.load(str(TEMPLATE))) == ["DEVICE"]
+
+    def test_run(self, monkeypatch):
+        monkeypatch.setattr(warmup, "BUSY_WAIT_S", 0)
+        server = FakeServer()
+        progress = []
+
+        result = Warmup(server.post, [Dashboard.load(str(TEMPLATE))], progress=lambda *x: progress.append(x)).run()
+
+        assert result.devices == ["AABBCCDD", "11223344"]
+        assert progress == [(1, 2), (2, 2)]
+
+        # Per device: 2 annotations and 1 panel query. The rejected query is sent again
+        assert result.requests == 6 and result.failed == 0
+        queries = [body for endpoint, body in server.requests if endpoint == "/query"]
+        assert len(queries) == 3
+
+        # Variables are resolved in order (the signal search refers to the DB found)
+        target = json.loads(queries[-1]["targets"][0]["target"])
+        assert target["device"] == "11223344"
+        assert target["db"] == "canmod-gps"
+        assert target["signal"] == "Speed (canmod-gps)"
+
+    def test_configured(self):
+        server = FakeServer()
+        server.busy = 0
+
+        result = Warmup(server.post, [Dashboard.load(str(TEMPLATE))], devices=["AABBCCDD"],
+                        values={"DB": "other", "SIGNAL": ["A", "B"]}).run()
+
+        assert result.devices == ["AABBCCDD"]
+        assert [endpoint for endpoint, _ in server.requests].count("/search") == 0
+        query = [body for endpoint, body in server.requests if endpoint == "/query"][0]
+        assert json.loads(query["targets"][0]["target"])["signal"] == "(A|B)"
+
+    def test_busy(self, monkeypatch):
+        monkeypatch.setattr(warmup, "IDLE_WAIT_S", 0)
+        server = FakeServer()
+        server.busy = 0
+
+        # Requests sent before each poll, while user queries are running (the first 3 polls)
+        polls = []
+
+        def busy():
+            polls.append(len(server.requests))
+            return len(polls) <= 3
+
+        result = Warmup(server.post, [Dashboard.load(str(TEMPLATE))], devices=["AABBCCDD"],
+                        values={"DB": "other", "SIGNAL": "A"}, busy=busy).run()
+
+        assert polls[:4] == [0, 0, 0, 0]
+        assert result.requests == 3 and result.failed == 0
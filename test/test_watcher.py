@@ -0,0 +1,40 @@
+import json
+import shutil
+from pathlib import Path
+
+from canedge_datasource.CanedgeFileSystem import CanedgeFileSystem
+from canedge_datasource.databases import DatabaseStore
+from canedge_datasource.watcher import RootWatcher
+
+DBC = Path(__file__).resolve().parent.parent / "LOG" / "canmod-gps.dbc"
+
+
+class TestRootWatcher(object):
+
+    def test_poll(self, tmp_path):
+        fs = CanedgeFileSystem(protocol="file", base_path=str(tmp_path))
+        shutil.copy(DBC, tmp_path / "canmod-gps.dbc")
+        store = DatabaseStore(fs)
+        store.load_all()
+
+        applied = []
+        watcher = RootWatcher(fs, store, on_passwords=applied.append)
+        assert not watcher.poll()
+
+        (tmp_path / "passwords.json").write_text(json.dumps({"AABBCCDD": "secret"}))
+        assert watcher.poll()
+        assert applied == [{"AABBCCDD": "secret"}]
+        assert not watcher.poll()
+
+        # Partially written file is retried
+        (tmp_path / "passwords.json").write_text('{"AABBCCDD": ')
+        assert not watcher.poll()
+        (tmp_path / "passwords.json").write_text(json.dumps({"AABBCCDD": "other"}))
+        assert watcher.poll()
+        assert applied[-1] == {"AABBCCDD": "other"}
+
+        (tmp_path / "passwords.json").unlink()
+        shutil.copy(DBC, tmp_path / "other.dbc")
+        assert watcher.poll()
+        assert applied[-1] == {}
+        assert list(store.keys()) == ["canmod-gps", "other"]